@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import gzip
+import queue
+import random
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _safe(part: Any) -> str:
+    return _UNSAFE.sub("-", str(part)).strip("-") or "x"
+
+
+class ArtifactWriter:
+    """
+    Debug artifacts for failed scrapes, written off the scrape loop.
+
+    The scrape loop only grabs the page HTML (and a viewport screenshot) and
+    hands them to a background thread through a bounded queue; when the queue
+    is full the capture is skipped rather than waited for. HTML is gzipped and
+    files are named by job, item, store, reason and attempt. The folder is kept
+    under ``max_bytes`` by deleting the oldest files first.
+
+    Sampling: the first ``always_first`` failures per (store, reason) are kept,
+    after that only ``sample_rate`` of them, so a failure storm costs little.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        max_bytes: int,
+        sample_rate: float = 1.0,
+        always_first: int = 3,
+        screenshots: bool = True,
+        queue_size: int = 16,
+        stats: Dict[str, int] | None = None,
+    ) -> None:
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.always_first = max(0, int(always_first))
+        self.screenshots = screenshots
+        self.stats = stats if stats is not None else {}
+        for key in ("artifacts_saved", "artifacts_sampled_out", "artifacts_dropped", "artifacts_evicted"):
+            self.stats.setdefault(key, 0)
+        self._queue: "queue.Queue[Tuple[Path, bytes | None, bytes | None] | None]" = queue.Queue(max(1, queue_size))
+        self._seen: Dict[Tuple[str, str], int] = {}
+        self._files: "OrderedDict[Path, int]" = OrderedDict()
+        self._total = 0
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def wanted(self, store_name: str, reason: str) -> bool:
+        """Sampling and back-pressure check; call before touching the page."""
+        with self._lock:
+            n = self._seen.get((store_name, reason), 0) + 1
+            self._seen[(store_name, reason)] = n
+        if n > self.always_first and random.random() >= self.sample_rate:
+            self.stats["artifacts_sampled_out"] += 1
+            return False
+        if self._queue.full():
+            self.stats["artifacts_dropped"] += 1
+            return False
+        return True
+
+    def path_for(self, job_id: Any, key: Any, store_name: str, reason: str, attempt: int) -> Path:
+        job = f"job{_safe(job_id)}" if job_id is not None else "adhoc"
+        item = f"item{_safe(key)}" if key is not None else "item"
+        return self.root / job / f"{item}_{_safe(store_name.lower())}_{_safe(reason)}_a{attempt}"
+
+    def submit(self, base: Path, html: str | None, screenshot: bytes | None) -> None:
+        self._start()
+        try:
+            self._queue.put_nowait((base, html.encode("utf-8") if html is not None else None, screenshot))
+        except queue.Full:
+            self.stats["artifacts_dropped"] += 1
+
+    def capture(self, page: Any, store_name: str, reason: str, *, job_id: Any = None, key: Any = None, attempt: int = 0) -> None:
+        """Sync Playwright page."""
+        if not self.wanted(store_name, reason):
+            return
+        html = shot = None
+        try:
+            html = page.content()
+            if self.screenshots:
+                shot = page.screenshot(full_page=False, type="jpeg", quality=70)
+        except Exception:
+            pass
+        if html is not None or shot is not None:
+            self.submit(self.path_for(job_id, key, store_name, reason, attempt), html, shot)
+
+    async def capture_async(
+        self, page: Any, store_name: str, reason: str, *, job_id: Any = None, key: Any = None, attempt: int = 0
+    ) -> None:
+        """Async Playwright page."""
+        if not self.wanted(store_name, reason):
+            return
+        html = shot = None
+        try:
+            html = await page.content()
+            if self.screenshots:
+                shot = await page.screenshot(full_page=False, type="jpeg", quality=70)
+        except Exception:
+            pass
+        if html is not None or shot is not None:
+            self.submit(self.path_for(job_id, key, store_name, reason, attempt), html, shot)
+
+    def close(self) -> None:
+        """Flush queued artifacts and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        self._scan()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            base, html, shot = job
+            try:
+                base.parent.mkdir(parents=True, exist_ok=True)
+                if html is not None:
+                    self._write(base.with_name(base.name + ".html.gz"), gzip.compress(html, compresslevel=6))
+                if shot is not None:
+                    self._write(base.with_name(base.name + ".jpg"), shot)
+                self.stats["artifacts_saved"] += 1
+            except OSError:
+                self.stats["artifacts_dropped"] += 1
+            self._evict()
+
+    def _scan(self) -> None:
+        if not self.root.exists():
+            return
+        files = []
+        for path in self.root.rglob("*"):
+            try:
+                if path.is_file():
+                    st = path.stat()
+                    files.append((st.st_mtime, path, st.st_size))
+            except OSError:
+                continue
+        for _, path, size in sorted(files):
+            self._files[path] = size
+            self._total += size
+
+    def _write(self, path: Path, payload: bytes) -> None:
+        path.write_bytes(payload)
+        self._total += len(payload) - self._files.pop(path, 0)
+        self._files[path] = len(payload)
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self._total -= size
+            try:
+                path.unlink()
+                self.stats["artifacts_evicted"] += 1
+            except OSError:
+                pass
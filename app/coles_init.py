@@ -1,18 +1,20 @@
 from __future__ import annotations
 
-from pathlib import Path
-
 from playwright.sync_api import sync_playwright
 
+from .scrape import SESSIONS
+
 
-def init_coles_session(url: str, state_path: str, slowmo_ms: int = 250) -> None:
+def init_coles_session(url: str, slowmo_ms: int = 250) -> str:
+    """
+    Open Coles in a visible browser for a human to clear the security check, then
+    hand the session to SESSIONS (so running scrapes pick it up for their next
+    context) and write it to disk. Returns the state file path.
+    """
     target_url = (url or "").strip()
     if not target_url:
         raise ValueError("A Coles URL is required")
 
-    path = Path(state_path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-
     with sync_playwright() as p:
         browser = p.chromium.launch(channel="msedge", headless=False, slow_mo=max(0, int(slowmo_ms or 0)))
         context = browser.new_context()
@@ -22,6 +24,7 @@ def init_coles_session(url: str, state_path: str, slowmo_ms: int = 250) -> None:
         # Human-in-the-loop: user completes any challenge in a visible browser window.
         page.pause()
 
-        context.storage_state(path=str(path))
+        SESSIONS.update("COLES", context.storage_state(), force=True)
         context.close()
         browser.close()
+    return str(SESSIONS.path("COLES"))
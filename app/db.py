@@ -1,15 +1,93 @@
 from __future__ import annotations
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DB_PATH = os.environ.get("PRICEWATCH_DB", os.path.join(os.path.dirname(__file__), "..", "pricewatch.db"))
 DB_URL = f"sqlite:///{os.path.abspath(DB_PATH)}"
 
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+# Applied to every connection on connect. WAL lets the dashboard, /api/capture and the
+# capture poller read while a scrape job commits; synchronous=NORMAL is durable in WAL
+# except for the last commits on power loss. busy_timeout makes a second writer (another
+# process, or the writer pool) wait instead of failing with "database is locked".
+# cache_size is in KiB when negative. Each can be overridden with PRICEWATCH_SQLITE_<NAME>.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 10000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,
+}
+SQLITE_PRAGMAS.update(
+    {name: os.environ[f"PRICEWATCH_SQLITE_{name.upper()}"] for name in SQLITE_PRAGMAS if f"PRICEWATCH_SQLITE_{name.upper()}" in os.environ}
+)
+# Read-only connections for request handlers; the writer is a single connection, so
+# writes in this process queue for it instead of contending inside SQLite.
+READ_POOL_SIZE = int(os.environ.get("PRICEWATCH_DB_READERS", "4"))
+
+
+def _apply_pragmas(dbapi_conn, *, read_only: bool) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if name == "journal_mode" and read_only:
+                continue  # persistent in the file; set by the writer
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+def _make_engine(*, read_only: bool):
+    eng = create_engine(
+        DB_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=READ_POOL_SIZE if read_only else 1,
+        max_overflow=READ_POOL_SIZE if read_only else 0,
+        pool_timeout=60,
+    )
+    event.listen(eng, "connect", lambda dbapi_conn, _record: _apply_pragmas(dbapi_conn, read_only=read_only))
+    return eng
+
+
+engine = _make_engine(read_only=False)
+read_engine = _make_engine(read_only=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# For handlers that only read (dashboard, buy list, shop, status polls): never waits for the writer.
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
-def init_db():
+
+def init_db() -> list:
+    """Create tables, add new columns, then apply pending migrations. Returns the migrations applied."""
     from . import models  # noqa: F401
+    from .migrations import run_migrations
+
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    return run_migrations(engine)
+
+
+def _add_missing_columns() -> None:
+    """
+    create_all() never alters an existing table, so columns added to a model
+    after the DB was created are added here with ALTER TABLE ... ADD COLUMN.
+    """
+    with engine.begin() as conn:
+        insp = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=engine.dialect)}"
+                default = col.default.arg if col.default is not None and col.default.is_scalar else None
+                if default is not None:
+                    literal = int(default) if isinstance(default, bool) else default
+                    ddl += f" DEFAULT {literal!r}" if isinstance(literal, str) else f" DEFAULT {literal}"
+                    if not col.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import gzip
+import http.client
+import json
+import re
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+# Structured-data extractors tried, in order, on server-rendered HTML before a browser is used.
+# Each takes (store_name, html, url) and returns a partial price dict or None; ``url`` is the
+# product link, for pages that embed other products' data too (it may be None).
+Extractor = Callable[[str, str, Optional[str]], Optional[Dict[str, Any]]]
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-AU,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+_JSON_LD_RE = re.compile(
+    r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL,
+)
+_NEXT_DATA_RE = re.compile(
+    r'<script[^>]+id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL,
+)
+_NUMBER_RE = re.compile(r"([0-9]+(?:\.[0-9]{1,2})?)")
+
+
+class HttpClient:
+    """
+    Minimal keep-alive HTTP(S) client: one persistent connection per
+    (scheme, host, port) per thread, gzip/deflate decoding and redirects.
+    """
+
+    def __init__(self, timeout: float = 15.0, max_redirects: int = 5) -> None:
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._local = threading.local()
+        self._all: List[http.client.HTTPConnection] = []
+        self._all_lock = threading.Lock()
+
+    def _connection(self, scheme: str, host: str, port: int | None) -> http.client.HTTPConnection:
+        conns: Dict[Tuple[str, str, int | None], http.client.HTTPConnection] = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        key = (scheme, host, port)
+        conn = conns.get(key)
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = conns[key] = cls(host, port, timeout=self.timeout)
+            with self._all_lock:
+                self._all.append(conn)
+        return conn
+
+    def _drop(self, scheme: str, host: str, port: int | None) -> None:
+        conns = getattr(self._local, "conns", {}) or {}
+        conn = conns.pop((scheme, host, port), None)
+        if conn is not None:
+            conn.close()
+
+    def get(self, url: str) -> Tuple[int, str, str]:
+        """Returns (status, final_url, body_text)."""
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            scheme, host, port = parts.scheme or "http", parts.hostname or "", parts.port
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            for retry in range(2):
+                conn = self._connection(scheme, host, port)
+                try:
+                    conn.request("GET", path, headers=DEFAULT_HEADERS)
+                    resp = conn.getresponse()
+                    raw = resp.read()
+                    break
+                except (http.client.HTTPException, OSError):
+                    # Server closed an idle keep-alive connection; reconnect once.
+                    self._drop(scheme, host, port)
+                    if retry:
+                        raise
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                url = urljoin(url, resp.getheader("Location"))
+                continue
+            return resp.status, url, _decode_body(raw, resp.getheader("Content-Encoding"), resp.getheader("Content-Type"))
+        raise http.client.HTTPException(f"Too many redirects for {url}")
+
+    def close(self) -> None:
+        # Connections are per thread, but close() may be called from any of them.
+        with self._all_lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+def _decode_body(raw: bytes, encoding: str | None, content_type: str | None) -> str:
+    encoding = (encoding or "").lower()
+    if encoding == "gzip":
+        raw = gzip.decompress(raw)
+    elif encoding == "deflate":
+        try:
+            raw = zlib.decompress(raw)
+        except zlib.error:
+            raw = zlib.decompress(raw, -zlib.MAX_WBITS)
+    charset = "utf-8"
+    m = re.search(r"charset=([\w-]+)", content_type or "", re.IGNORECASE)
+    if m:
+        charset = m.group(1)
+    return raw.decode(charset, errors="replace")
+
+
+def _to_price(value: Any) -> float | None:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    m = _NUMBER_RE.search(str(value).replace(",", ""))
+    if not m:
+        return None
+    price = float(m.group(1))
+    return price if price > 0 else None
+
+
+def _walk(obj: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(obj, dict):
+        yield obj
+        for v in obj.values():
+            yield from _walk(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _walk(v)
+
+
+def _has_type(node: Dict[str, Any], name: str) -> bool:
+    t = node.get("@type")
+    return t == name or (isinstance(t, list) and name in t)
+
+
+def extract_json_ld(store_name: str, html: str, url: str | None = None) -> Dict[str, Any] | None:
+    """schema.org Product -> Offer/AggregateOffer price."""
+    for block in _JSON_LD_RE.findall(html):
+        try:
+            doc = json.loads(block.strip())
+        except ValueError:
+            continue
+        for node in _walk(doc):
+            if not _has_type(node, "Product"):
+                continue
+            offers = node.get("offers")
+            for offer in offers if isinstance(offers, list) else [offers]:
+                if not isinstance(offer, dict):
+                    continue
+                price = _to_price(offer.get("price")) or _to_price(offer.get("lowPrice"))
+                if price is None:
+                    continue
+                was_price = None
+                for spec in _walk(offer.get("priceSpecification")):
+                    if "Strikethrough" in str(spec.get("priceType") or ""):
+                        was_price = _to_price(spec.get("price"))
+                return {"price": price, "was_price": was_price}
+    return None
+
+
+def _next_pricing(node: Dict[str, Any]) -> Dict[str, Any] | None:
+    pricing = node.get("pricing")
+    if not isinstance(pricing, dict):
+        return None
+    price = _to_price(pricing.get("now"))
+    if price is None:
+        return None
+    unit = pricing.get("unit") if isinstance(pricing.get("unit"), dict) else {}
+    return {
+        "price": price,
+        "was_price": _to_price(pricing.get("was")),
+        "unit_price": _to_price(unit.get("price")),
+        "promo_text": (pricing.get("promotionDescription") or pricing.get("offerDescription") or None),
+    }
+
+
+def _url_product_keys(url: str | None) -> set:
+    """Product id and slug in a product URL, e.g. /product/coles-milk-2l-8150288 -> {"8150288", "coles-milk-2l-8150288"}."""
+    segment = urlsplit(url or "").path.rstrip("/").rsplit("/", 1)[-1]
+    if not segment:
+        return set()
+    keys = {segment}
+    m = re.search(r"(?:^|-)(\d+)$", segment)
+    if m:
+        keys.add(m.group(1))
+    return keys
+
+
+def extract_next_data(store_name: str, html: str, url: str | None = None) -> Dict[str, Any] | None:
+    """
+    Next.js __NEXT_DATA__ (Coles): the "pricing" of the page's product. That is
+    props.pageProps.product when present; otherwise the node whose id or slug is
+    in ``url``. Other nodes with pricing (related products, ads) are never taken:
+    None when the product cannot be told apart from them.
+    """
+    m = _NEXT_DATA_RE.search(html)
+    if not m:
+        return None
+    try:
+        doc = json.loads(m.group(1))
+    except ValueError:
+        return None
+    page_props = (doc.get("props") or {}).get("pageProps") if isinstance(doc, dict) else None
+    product = page_props.get("product") if isinstance(page_props, dict) else None
+    if isinstance(product, dict):
+        return _next_pricing(product)
+
+    candidates = [(node, found) for node in _walk(doc) for found in [_next_pricing(node)] if found is not None]
+    keys = _url_product_keys(url)
+    matched = [
+        found for node, found in candidates if keys & {str(node[k]) for k in ("id", "slug") if node.get(k) is not None}
+    ]
+    if not matched:
+        # Without a URL match only a page with a single priced node is unambiguous.
+        matched = [found for _, found in candidates]
+    distinct = {json.dumps(found, sort_keys=True) for found in matched}
+    return matched[0] if len(distinct) == 1 else None
+
+
+EXTRACTORS: List[Extractor] = [
+    extract_next_data,
+    extract_json_ld,
+]
+
+
+def extract_structured(store_name: str, html: str, url: str | None = None) -> Dict[str, Any] | None:
+    for extractor in EXTRACTORS:
+        try:
+            found = extractor(store_name, html, url)
+        except Exception:
+            continue
+        if found and found.get("price") is not None:
+            return found
+    return None
@@ -1,27 +1,84 @@
 from __future__ import annotations
 
+import json
+import os
+import socket
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
-from typing import Any, Dict, Optional
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
-from .db import SessionLocal
-from .models import Item, PriceHistory, ScrapeJob, Store, StoreLink
-from .scrape import scrape_item_prices
-from .services import get_scrape_settings
+from sqlalchemy import and_, func, insert, update
+
+from .db import ReadSessionLocal, SessionLocal
+from .metrics import ScrapeMetrics
+from .models import (
+    Item,
+    PriceHistory,
+    ScrapeEvent,
+    ScrapeJob,
+    ScrapeJobItem,
+    ScrapeMetricsTotal,
+    ShopPurchase,
+    Store,
+    StoreLink,
+)
+from .pacing import CircuitBreaker
+from .scrape import BrowserPool, SelectorStats, scrape_url
+from .scrape_async import run_async_scrape
+from .scrape_procs import run_process_scrape
+from .services import (
+    freshness_ttl_hours,
+    get_scrape_settings,
+    load_selector_stats,
+    record_prices,
+    save_selector_stats,
+)
 
 _executor = ThreadPoolExecutor(max_workers=1)
 _lock = threading.Lock()
 _cancel_events: Dict[int, threading.Event] = {}
+# Metrics of jobs running in this process, for /scrape/status and /metrics before they are stored.
+_live_metrics: Dict[int, ScrapeMetrics] = {}
+
+# (item_id, store_name, url)
+WorkRow = Tuple[int, str, str]
+# (store_name, url, item_ids): one page load shared by every item linking to that URL
+PageTask = Tuple[str, str, Tuple[int, ...]]
+
+
+SCRAPE_MODES = ("full", "stale")
+# "inline": jobs run on a thread of the web process. "worker": enqueue only inserts the
+# row and `python -m app.worker` processes claim it, so the web app can run --workers N.
+JOB_RUNNER = os.environ.get("PRICEWATCH_JOB_RUNNER", "inline").strip().lower()
+LEASE_SECONDS = 120
+_INLINE_OWNER = f"web:{socket.gethostname()}:{os.getpid()}"
+# A failed page is retried on resume until it has been attempted this many times.
+MAX_PAGE_ATTEMPTS = 3
 
 
-def enqueue_scrape_job(store: Optional[str] = None) -> int:
+def enqueue_scrape_job(
+    store: Optional[str] = None,
+    mode: str = "full",
+    max_pages: Optional[int] = None,
+    max_minutes: Optional[int] = None,
+) -> int:
+    """
+    Inserts a queued ScrapeJob row; a worker claims it (see claim_next_job).
+    mode "stale" only scrapes (item, store) pairs whose latest price is older than
+    its freshness TTL, oldest and most-purchased first. max_pages / max_minutes cap
+    the run; for stale jobs they default to the stale_max_* scrape settings.
+    """
     db = SessionLocal()
     try:
         job = ScrapeJob(
             status="queued",
             created_at=datetime.utcnow(),
             store=(store.upper() if store and store.strip() else None),
+            mode=mode if mode in SCRAPE_MODES else "full",
+            max_pages=max_pages,
+            max_minutes=max_minutes,
         )
         db.add(job)
         db.commit()
@@ -30,92 +87,698 @@ def enqueue_scrape_job(store: Optional[str] = None) -> int:
     finally:
         db.close()
 
+    if JOB_RUNNER == "inline":
+        _executor.submit(drain_queue, _INLINE_OWNER)
+    return job_id
+
+
+def cancel_scrape_job(job_id: int) -> bool:
+    """
+    Asks a running job to stop after its in-flight pages (the owning worker sees
+    cancel_requested on its next heartbeat); a queued job is cancelled outright.
+    """
+    with _lock:
+        ev = _cancel_events.get(job_id)
+    if ev is not None:
+        ev.set()
+    db = SessionLocal()
+    try:
+        job = db.get(ScrapeJob, job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return ev is not None
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+        else:
+            job.cancel_requested = True
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def _claimable(now: datetime) -> Any:
+    # Queued, or running under a lease nobody renewed (its worker died or was restarted).
+    return (ScrapeJob.status == "queued") | (
+        (ScrapeJob.status == "running") & ((ScrapeJob.lease_expires_at.is_(None)) | (ScrapeJob.lease_expires_at < now))
+    )
+
+
+def claim_next_job(owner: str, stores: Optional[List[str]] = None, lease_s: int = LEASE_SECONDS) -> Optional[int]:
+    """
+    Claims the oldest claimable job for ``owner`` and returns its id. With
+    ``stores`` only single-store jobs for those stores are taken, so workers can
+    be sharded by store; an unsharded worker takes everything.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        q = db.query(ScrapeJob.id).filter(_claimable(now))
+        if stores:
+            q = q.filter(ScrapeJob.store.in_([s.upper() for s in stores]))
+        for (job_id,) in q.order_by(ScrapeJob.id).limit(10):
+            # Compare-and-set: only one worker's UPDATE matches.
+            claimed = (
+                db.query(ScrapeJob)
+                .filter(ScrapeJob.id == job_id, _claimable(now))
+                .update(
+                    {"status": "running", "lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_s)},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if claimed:
+                return int(job_id)
+        return None
+    finally:
+        db.close()
+
+
+def renew_lease(job_id: int, owner: str, lease_s: int = LEASE_SECONDS) -> Tuple[bool, bool]:
+    """Extends the lease if ``owner`` still holds it. Returns (still_owner, cancel_requested)."""
+    db = SessionLocal()
+    try:
+        renewed = (
+            db.query(ScrapeJob)
+            .filter(ScrapeJob.id == job_id, ScrapeJob.lease_owner == owner, ScrapeJob.status == "running")
+            .update({"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_s)}, synchronize_session=False)
+        )
+        db.commit()
+        job = db.get(ScrapeJob, job_id)
+        return bool(renewed), bool(job is not None and job.cancel_requested)
+    finally:
+        db.close()
+
+
+def run_leased_job(job_id: int, owner: str, lease_s: int = LEASE_SECONDS) -> None:
+    """
+    Runs a claimed job while a heartbeat thread renews its lease and watches for
+    cancellation. A lost lease (another worker took over, or renewals kept failing
+    until it lapsed) aborts the run without writing anything more for the job.
+    """
     ev = threading.Event()
+    lost = threading.Event()
+    done = threading.Event()
     with _lock:
         _cancel_events[job_id] = ev
 
-    _executor.submit(_run_scrape_job, job_id, store, ev)
-    return job_id
+    def heartbeat() -> None:
+        renewed_at = time.monotonic()
+        while not done.wait(max(1.0, lease_s / 3)):
+            try:
+                still_owner, cancel = renew_lease(job_id, owner, lease_s)
+            except Exception:
+                # Busy or pool timeout: try again next beat, unless the lease has lapsed meanwhile.
+                still_owner, cancel = time.monotonic() - renewed_at < lease_s, False
+            else:
+                renewed_at = time.monotonic()
+            if not still_owner:
+                lost.set()
+            if cancel or not still_owner:
+                ev.set()
+
+    beat = threading.Thread(target=heartbeat, name=f"lease-{job_id}", daemon=True)
+    beat.start()
+    try:
+        _run_scrape_job(job_id, ev, owner, lost)
+    finally:
+        done.set()
+        beat.join()
+        db = SessionLocal()
+        try:
+            db.query(ScrapeJob).filter(ScrapeJob.id == job_id, ScrapeJob.lease_owner == owner).update(
+                {"lease_expires_at": None}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
 
 
-def _run_scrape_job(job_id: int, store: Optional[str], cancel_event: threading.Event) -> None:
-    del cancel_event  # reserved for future cancellation support
+def drain_queue(owner: str, stores: Optional[List[str]] = None, lease_s: int = LEASE_SECONDS) -> int:
+    """Claims and runs jobs until none are claimable; returns how many ran."""
+    ran = 0
+    while True:
+        job_id = claim_next_job(owner, stores, lease_s)
+        if job_id is None:
+            return ran
+        run_leased_job(job_id, owner, lease_s)
+        ran += 1
+
+
+def resume_interrupted_jobs() -> None:
+    """
+    Inline runner only: picks up jobs left queued or running by a previous
+    process (e.g. a uvicorn restart). Running jobs become claimable once their
+    lease lapses and continue from their scrape_job_items checkpoint.
+    """
+    if JOB_RUNNER != "inline":
+        return
+
+    def wait_and_drain() -> None:
+        while True:
+            drain_queue(_INLINE_OWNER)
+            db = SessionLocal()
+            try:
+                next_expiry = (
+                    db.query(func.min(ScrapeJob.lease_expires_at)).filter(ScrapeJob.status == "running").scalar()
+                )
+            finally:
+                db.close()
+            if next_expiry is None:
+                return
+            time.sleep(min(30.0, max(1.0, (next_expiry - datetime.utcnow()).total_seconds() + 1)))
+
+    _executor.submit(wait_and_drain)
+
+
+def _checkpoint_plan(db: Any, job: ScrapeJob, scrape_settings: Dict[str, Any]) -> None:
+    """Plans the job once and stores every page as a pending scrape_job_items row."""
+    store_filter = (job.store or "ALL").strip().upper()
+    max_pages = job.max_pages
+    fresh_skipped = 0
+    if job.mode == "stale":
+        work, fresh_skipped = plan_stale_work(db, store_filter, scrape_settings.get("freshness_ttl") or {})
+        max_pages = max_pages if max_pages is not None else scrape_settings.get("stale_max_pages")
+    else:
+        work = plan_scrape_work(db, store_filter)
+    pages = group_page_tasks(work, limit=max_pages or None)
+    if pages:
+        db.execute(
+            insert(ScrapeJobItem),
+            [
+                {
+                    "job_id": job.id,
+                    "store": store_name,
+                    "url": url,
+                    "item_ids": ",".join(str(item_id) for item_id in item_ids),
+                    "state": "pending",
+                    "attempts": 0,
+                }
+                for store_name, url, item_ids in pages
+            ],
+        )
+    job.planned_at = datetime.utcnow()
+    job.plan_stats = json.dumps(
+        {
+            "page_loads_saved": sum(len(item_ids) for _, _, item_ids in pages) - len(pages),
+            "fresh_skipped": fresh_skipped,
+            "budget_cut": len({(store_name, url) for _, store_name, url in work}) - len(pages),
+        }
+    )
+    db.commit()
+
+
+def _commit_as_owner(db: Any, job_id: int, owner: Optional[str]) -> bool:
+    """
+    Commits unless ``owner`` no longer holds the job's lease, in which case the
+    transaction is rolled back and False returned. The check runs after the
+    transaction's writes, so no other worker can claim the job in between.
+    """
+    if owner is not None:
+        db.flush()
+        if db.query(ScrapeJob.id).filter(ScrapeJob.id == job_id, ScrapeJob.lease_owner == owner).first() is None:
+            db.rollback()
+            return False
+    db.commit()
+    return True
+
+
+def _run_scrape_job(
+    job_id: int,
+    cancel_event: threading.Event,
+    owner: Optional[str] = None,
+    lost: Optional[threading.Event] = None,
+) -> None:
+    """
+    Runs one job. With ``owner``, every commit after the start is made only while
+    that owner still holds the lease; once it is lost (``lost`` is set by the
+    heartbeat or by a failed commit) the run stops and leaves the job to the new owner.
+    """
+    lost = lost or threading.Event()
+    metrics: Optional[ScrapeMetrics] = None
     db = SessionLocal()
     try:
         job = db.get(ScrapeJob, job_id)
-        if not job:
+        if not job or job.status not in ("queued", "running"):
             return
+        if job.cancel_requested:
+            cancel_event.set()
 
+        resumed = job.planned_at is not None
         job.status = "running"
-        job.started_at = datetime.utcnow()
-        job.message = None
+        job.started_at = job.started_at or datetime.utcnow()
+        job.message = "Resumed after restart" if resumed else None
         db.commit()
 
-        store_filter = (store or "ALL").strip().upper()
-        items = db.query(Item).order_by(Item.id.asc()).all()
         scrape_settings = get_scrape_settings(db)
+        if job.planned_at is None:
+            _checkpoint_plan(db, job, scrape_settings)
+        # Pages that already succeeded are never fetched again; failures get a few more tries on resume.
+        tasks = (
+            db.query(ScrapeJobItem.id, ScrapeJobItem.store, ScrapeJobItem.url, ScrapeJobItem.item_ids, ScrapeJobItem.attempts)
+            .filter(
+                ScrapeJobItem.job_id == job_id,
+                (ScrapeJobItem.state == "pending")
+                | ((ScrapeJobItem.state == "failed") & (ScrapeJobItem.attempts < MAX_PAGE_ATTEMPTS)),
+            )
+            .order_by(ScrapeJobItem.id)
+            .all()
+        )
+        attempts = {task_id: n for task_id, _, _, _, n in tasks}
+        pages = [
+            (store_name, url, (task_id, tuple(int(i) for i in item_ids.split(","))))
+            for task_id, store_name, url, item_ids, _ in tasks
+        ]
+
+        max_minutes = job.max_minutes
+        if max_minutes is None and job.mode == "stale":
+            max_minutes = scrape_settings.get("stale_max_minutes")
+        deadline = time.monotonic() + max_minutes * 60 if max_minutes else None
+        deferred = 0
+
+        def allow(store_name: str) -> bool:
+            nonlocal deferred
+            if cancel_event.is_set() or lost.is_set():
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                deferred += 1
+                return False
+            return breaker.allow(store_name)
+
+        selector_stats = SelectorStats(load_selector_stats(db))
+        # This run only; a resumed job's earlier runs stay on job.metrics and are added at the end.
+        metrics = ScrapeMetrics()
+        with _lock:
+            _live_metrics[job_id] = metrics
+        writer = PriceRowWriter(
+            db,
+            scrape_settings.get("commit_interval", 100),
+            metrics,
+            scrape_settings.get("price_storage", "change_only"),
+            lease=(job_id, owner) if owner is not None else None,
+            lost=lost,
+        )
 
-        saved_count = 0
         error_count = 0
+        ready_ms: List[int] = []
+        pool_stats: Dict[str, int] = {}
+        breaker = CircuitBreaker(
+            threshold=scrape_settings.get("breaker_threshold", 3),
+            cooldown_s=scrape_settings.get("breaker_cooldown_s", 600),
+        )
+        blocked_events: Dict[str, ScrapeEvent] = {}
+        # End the planning reads so the writer connection is free (for the lease
+        # heartbeat and /api/capture) while the first pages load.
+        db.commit()
 
-        for item in items:
-            links = db.query(StoreLink).join(Store).filter(StoreLink.item_id == item.id).all()
-            eligible = []
-            for sl in links:
-                if sl.url and (store_filter == "ALL" or sl.store.name == store_filter):
-                    eligible.append(sl)
-            if not eligible:
-                continue
+        def handle_result(key: Tuple[int, Tuple[int, ...]], store_name: str, data: Dict[str, Any]) -> None:
+            task_id, item_ids = key
+            attempts[task_id] += 1
+            blocked = _is_blocked(data)
+            if breaker.record(store_name, blocked):
+                # One event per store per run instead of a [blocked] row for every remaining URL.
+                event = blocked_events.get(store_name)
+                if event is None:
+                    event = blocked_events[store_name] = ScrapeEvent(job_id=job_id, store=store_name, kind="store_blocked")
+                    db.add(event)
+                event.created_at = datetime.utcnow()
+                event.detail = json.dumps({"reason": data.get("promo_text"), "circuit_opened": True})
+            if blocked:
+                writer.mark(task_id, "failed", attempts[task_id], "blocked")
+                return
+            for item_id in item_ids:
+                writer.add(item_id, store_name, data)
+            # The rows and the checkpoint commit together, so a resume never saves a page twice.
+            if data.get("price") is not None:
+                writer.mark(task_id, "done", attempts[task_id])
+            else:
+                writer.mark(task_id, "failed", attempts[task_id], (data.get("promo_text") or "").strip() or "no price")
+            if data.get("ready_ms") is not None:
+                ready_ms.append(data["ready_ms"])
 
-            try:
-                results = scrape_item_prices(eligible, settings=scrape_settings)
-            except Exception as exc:  # noqa: PERF203
-                error_count += 1
-                job.message = f"Partial failures so far. Last: item_id={item.id} {type(exc).__name__}"
-                db.commit()
-                continue
-
-            for store_name, data in results.items():
-                st = db.query(Store).filter(Store.name == store_name).first()
-                if st is None:
-                    continue
-                db.add(
-                    PriceHistory(
-                        item_id=item.id,
-                        store_id=st.id,
-                        captured_at=datetime.utcnow(),
-                        price=data.get("price"),
-                        was_price=data.get("was_price"),
-                        unit_price=data.get("unit_price"),
-                        promo_text=data.get("promo_text"),
-                        discount_percent=data.get("discount_percent"),
-                    )
+        if scrape_settings.get("engine") in ("async", "process"):
+            # All stores at once, bounded per store; rows are written as each page finishes.
+            # The process engine spreads the pages over several browsers and streams results back here.
+            runner = run_process_scrape if scrape_settings["engine"] == "process" else run_async_scrape
+            pool_stats = runner(
+                pages,
+                scrape_settings,
+                handle_result,
+                selector_stats,
+                allow,
+                job_id,
+                metrics,
+            )
+        else:
+            # One browser for the whole job; pages come grouped by store so each warm
+            # context works through its store's whole queue before the next one is used.
+            with BrowserPool(scrape_settings, selector_stats, job_id, metrics) as pool:
+
+                def scrape_one(store_name: str, url: str, key: Tuple[int, Tuple[int, ...]]) -> None:
+                    nonlocal error_count
+                    task_id, item_ids = key
+                    try:
+                        data = scrape_url(pool, store_name, url, item_ids)
+                    except Exception as exc:  # noqa: PERF203
+                        error_count += 1
+                        attempts[task_id] += 1
+                        writer.mark(task_id, "failed", attempts[task_id], type(exc).__name__)
+                        job.message = f"Partial failures so far. Last: item_id={item_ids[0]} {store_name} {type(exc).__name__}"
+                        data = None
+                    if data is not None:
+                        handle_result(key, store_name, data)
+                    else:
+                        # No result to record: a half-open probe must not keep the probe slot.
+                        breaker.release(store_name)
+
+                # A store whose circuit opens is skipped for the rest of the run (counted by allow()).
+                for store_name, url, key in pages:
+                    if cancel_event.is_set() or lost.is_set():
+                        break
+                    if allow(store_name):
+                        scrape_one(store_name, url, key)
+                pool_stats = dict(pool.stats)
+        writer.flush()
+        if lost.is_set():
+            # Another worker holds the job now and continues from the last committed checkpoint.
+            db.rollback()
+            return
+
+        cancelled = cancel_event.is_set()
+        if not cancelled:
+            # Whatever is still pending was cut by the breaker or the time budget.
+            db.query(ScrapeJobItem).filter(ScrapeJobItem.job_id == job_id, ScrapeJobItem.state == "pending").update(
+                {"state": "skipped", "updated_at": datetime.utcnow()}, synchronize_session=False
+            )
+
+        plan_stats = json.loads(job.plan_stats or "{}")
+        pool_stats["page_loads_saved"] = plan_stats.get("page_loads_saved", 0)
+        pool_stats["fresh_skipped"] = plan_stats.get("fresh_skipped", 0)
+        # Pages cut by the page budget plus pages not started before the time budget ran out.
+        pool_stats["deferred_pages"] = plan_stats.get("budget_cut", 0) + deferred
+
+        for store_name in breaker.blocks:
+            if store_name not in blocked_events:
+                blocked_events[store_name] = ScrapeEvent(
+                    job_id=job_id,
+                    store=store_name,
+                    kind="store_blocked",
+                    created_at=datetime.utcnow(),
+                    detail=json.dumps({"circuit_opened": False}),
                 )
-                saved_count += 1
-            db.commit()
+                db.add(blocked_events[store_name])
+        for store_name, event in blocked_events.items():
+            detail = json.loads(event.detail or "{}")
+            detail["blocked_pages"] = breaker.blocks.get(store_name, 0)
+            detail["skipped_pages"] = breaker.skipped.get(store_name, 0)
+            event.detail = json.dumps(detail)
+        pool_stats["blocked_pages"] = sum(breaker.blocks.values())
+        pool_stats["skipped_pages"] = sum(breaker.skipped.values())
 
-        job.status = "done" if error_count == 0 else "error"
+        # Selector order for the next job follows what matched in this one.
+        save_selector_stats(db, selector_stats.rows(dirty_only=True))
+
+        _store_run_metrics(db, job, metrics)
         job.finished_at = datetime.utcnow()
-        if error_count == 0:
-            job.message = f"OK ({saved_count} price rows saved)"
+        if cancelled:
+            job.status = "cancelled"
+            job.message = f"Cancelled ({writer.saved} price rows saved{_job_summary(ready_ms, pool_stats)})"
+        elif error_count == 0:
+            job.status = "done"
+            job.message = f"OK ({writer.saved} price rows saved{_job_summary(ready_ms, pool_stats)})"
         else:
-            job.message = f"Completed with failures ({saved_count} saved, {error_count} failed items)"
-        db.commit()
+            job.status = "error"
+            job.message = (
+                f"Completed with failures ({writer.saved} saved, {error_count} failed pages"
+                f"{_job_summary(ready_ms, pool_stats)})"
+            )
+        _commit_as_owner(db, job_id, owner)
     except Exception as exc:  # noqa: PERF203
-        job = db.get(ScrapeJob, job_id)
+        db.rollback()
+        job = None if lost.is_set() else db.get(ScrapeJob, job_id)
         if job:
             job.status = "error"
             job.finished_at = datetime.utcnow()
             job.message = f"{type(exc).__name__}: {exc}"
-            db.commit()
+            if metrics is not None:
+                _store_run_metrics(db, job, metrics)
+            _commit_as_owner(db, job_id, owner)
     finally:
         db.close()
         with _lock:
             _cancel_events.pop(job_id, None)
+            _live_metrics.pop(job_id, None)
+
+
+def _is_blocked(data: Dict[str, Any]) -> bool:
+    return (data.get("promo_text") or "").startswith("[blocked:")
+
+
+def _job_summary(ready_ms: List[int], pool_stats: Dict[str, int]) -> str:
+    out = ""
+    if pool_stats.get("blocked_pages"):
+        out += f", {pool_stats['blocked_pages']} pages blocked"
+    if pool_stats.get("skipped_pages"):
+        out += f", {pool_stats['skipped_pages']} skipped by circuit breaker"
+    if pool_stats.get("crash_skipped_pages"):
+        out += f", {pool_stats['crash_skipped_pages']} lost to crashed scrape processes"
+    if pool_stats.get("page_loads_saved"):
+        out += f", {pool_stats['page_loads_saved']} page loads saved by shared URLs"
+    if pool_stats.get("fresh_skipped"):
+        out += f", {pool_stats['fresh_skipped']} still fresh"
+    if pool_stats.get("deferred_pages"):
+        out += f", {pool_stats['deferred_pages']} pages left for the next run (budget)"
+    if pool_stats.get("http_hits"):
+        out += f", {pool_stats['http_hits']} via HTTP"
+    if ready_ms:
+        out += f", avg ready {sum(ready_ms) / len(ready_ms) / 1000.0:.1f}s/page"
+    if pool_stats.get("requests_blocked"):
+        out += (
+            f", {pool_stats['requests_blocked']} requests blocked"
+            f" ({pool_stats.get('bytes_received', 0) // 1024} KiB downloaded)"
+        )
+    return out
+
+
+def plan_scrape_work(db: Any, store_filter: str = "ALL") -> List[WorkRow]:
+    """Every (item_id, store_name, url) with a non-empty URL, in one query, in item order."""
+    q = (
+        db.query(StoreLink.item_id, Store.name, StoreLink.url)
+        .join(Store, Store.id == StoreLink.store_id)
+        .filter(StoreLink.url.isnot(None), func.trim(StoreLink.url) != "")
+    )
+    if store_filter != "ALL":
+        q = q.filter(Store.name == store_filter)
+    return [(item_id, store_name, url.strip()) for item_id, store_name, url in q.order_by(StoreLink.item_id, StoreLink.id)]
+
+
+def group_page_tasks(work: List[WorkRow], limit: Optional[int] = None) -> List[PageTask]:
+    """
+    One task per distinct (store, url), listing every item that links to it.
+    ``limit`` keeps the first N pages in plan order (the priority order for
+    stale jobs). Tasks are then grouped by store, keeping plan order within one.
+    """
+    pages: Dict[Tuple[str, str], List[int]] = {}
+    for item_id, store_name, url in work:
+        pages.setdefault((store_name, url), []).append(item_id)
+    tasks = [(store_name, url, tuple(item_ids)) for (store_name, url), item_ids in pages.items()]
+    if limit is not None:
+        tasks = tasks[:limit]
+    tasks.sort(key=lambda task: task[0])
+    return tasks
+
+
+def plan_stale_work(db: Any, store_filter: str, freshness: Dict[str, Any], now: datetime | None = None) -> Tuple[List[WorkRow], int]:
+    """
+    Like plan_scrape_work, but drops (item, store) pairs whose latest priced row is
+    younger than their freshness TTL. Never-priced pairs come first, then the oldest,
+    with ties going to the items bought most often. Returns (work, fresh_skipped).
+    """
+    now = now or datetime.utcnow()
+    latest = (
+        db.query(
+            PriceHistory.item_id,
+            PriceHistory.store_id,
+            func.max(func.coalesce(PriceHistory.last_seen_at, PriceHistory.captured_at)).label("last_at"),
+        )
+        .filter(PriceHistory.price.isnot(None))
+        .group_by(PriceHistory.item_id, PriceHistory.store_id)
+        .subquery()
+    )
+    bought = (
+        db.query(ShopPurchase.item_id, func.count(ShopPurchase.id).label("n"))
+        .group_by(ShopPurchase.item_id)
+        .subquery()
+    )
+    q = (
+        db.query(StoreLink.item_id, Store.name, StoreLink.url, Item.buy_freq, latest.c.last_at, bought.c.n)
+        .join(Store, Store.id == StoreLink.store_id)
+        .join(Item, Item.id == StoreLink.item_id)
+        .outerjoin(latest, and_(latest.c.item_id == StoreLink.item_id, latest.c.store_id == StoreLink.store_id))
+        .outerjoin(bought, bought.c.item_id == StoreLink.item_id)
+        .filter(StoreLink.url.isnot(None), func.trim(StoreLink.url) != "")
+    )
+    if store_filter != "ALL":
+        q = q.filter(Store.name == store_filter)
+
+    stale = []
+    fresh_skipped = 0
+    for item_id, store_name, url, buy_freq, last_at, purchases in q:
+        if last_at is not None and now - last_at < timedelta(hours=freshness_ttl_hours(freshness, store_name, buy_freq)):
+            fresh_skipped += 1
+            continue
+        stale.append((last_at or datetime.min, -(purchases or 0), item_id, store_name, url.strip()))
+    stale.sort()
+    return [(item_id, store_name, url) for _, _, item_id, store_name, url in stale], fresh_skipped
+
+
+class PriceRowWriter:
+    """
+    Buffers price observations and writes them through services.record_prices
+    (``storage`` "change_only" or "append") with a commit every
+    ``commit_interval`` observations. Store ids are looked up once.
+    Checkpoint updates for scrape_job_items (``mark``) ride in the same commit.
+    With ``lease`` (job_id, owner) a flush commits only while that owner holds
+    the job's lease; otherwise it rolls back, sets ``lost`` and drops everything
+    buffered from then on.
+    Each flush is timed as the "db_write" stage when ``metrics`` is given.
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        commit_interval: int = 100,
+        metrics: ScrapeMetrics | None = None,
+        storage: str = "change_only",
+        lease: Tuple[int, str] | None = None,
+        lost: threading.Event | None = None,
+    ) -> None:
+        self.db = db
+        self.metrics = metrics
+        self.storage = storage
+        self.lease = lease
+        self.lost = lost or threading.Event()
+        self.commit_interval = max(1, int(commit_interval or 1))
+        self.store_ids: Dict[str, int] = {name: store_id for store_id, name in db.query(Store.id, Store.name)}
+        self.saved = 0
+        self.inserted = 0
+        self._rows: List[Dict[str, Any]] = []
+        self._marks: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, item_id: int, store_name: str, data: Dict[str, Any]) -> bool:
+        store_id = self.store_ids.get(store_name)
+        if store_id is None or self.lost.is_set():
+            return False
+        self._rows.append(
+            {
+                "item_id": item_id,
+                "store_id": store_id,
+                "captured_at": datetime.utcnow(),
+                "price": data.get("price"),
+                "was_price": data.get("was_price"),
+                "unit_price": data.get("unit_price"),
+                "promo_text": data.get("promo_text"),
+                "discount_percent": data.get("discount_percent"),
+                "source": data.get("source"),
+            }
+        )
+        if len(self._rows) >= self.commit_interval:
+            self.flush()
+        return True
+
+    def mark(self, task_id: int, state: str, attempts: int, error: str | None = None) -> None:
+        if self.lost.is_set():
+            return
+        self._marks[task_id] = {
+            "id": task_id,
+            "state": state,
+            "attempts": attempts,
+            "error": error,
+            "updated_at": datetime.utcnow(),
+        }
+        if len(self._rows) + len(self._marks) >= self.commit_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes buffered rows (if any) and commits everything pending on the session."""
+        started = time.perf_counter()
+        rows, marks = self._rows, self._marks
+        self._rows, self._marks = [], {}
+        if self.lost.is_set():
+            return
+        inserted = record_prices(self.db, rows, self.storage) if rows else 0
+        if marks:
+            self.db.execute(update(ScrapeJobItem), list(marks.values()))
+        if self.lease is not None and not _commit_as_owner(self.db, *self.lease):
+            # The rows and their checkpoints go together, so the new owner redoes these pages.
+            self.lost.set()
+            return
+        if self.lease is None:
+            self.db.commit()
+        self.saved += len(rows)
+        self.inserted += inserted
+        if self.metrics is not None:
+            self.metrics.observe("db_write", "all", time.perf_counter() - started)
+
+
+def _store_run_metrics(db: Any, job: ScrapeJob, metrics: ScrapeMetrics) -> None:
+    """
+    Adds this run's metrics to job.metrics and to the scrape_metrics_total row, in
+    the caller's transaction. The job row is flushed first so the read-modify-write
+    of the total runs under SQLite's write lock and cannot lose another worker's run.
+    """
+    run = metrics.snapshot()
+    combined = ScrapeMetrics()
+    combined.merge(json.loads(job.metrics or "null"))
+    combined.merge(run)
+    job.metrics = json.dumps(combined.snapshot())
+    db.flush()
+    total_row = db.get(ScrapeMetricsTotal, 1)
+    if total_row is None:
+        total_row = ScrapeMetricsTotal(id=1)
+        db.add(total_row)
+    total = ScrapeMetrics()
+    total.merge(json.loads(total_row.metrics or "null"))
+    total.merge(run)
+    total_row.metrics = json.dumps(total.snapshot())
+    total_row.updated_at = datetime.utcnow()
+
+
+def job_metrics(job: ScrapeJob) -> Optional[Dict[str, Any]]:
+    """The stored snapshot plus, while the job runs in this process, the live run's."""
+    with _lock:
+        live = _live_metrics.get(job.id)
+    stored = json.loads(job.metrics) if job.metrics else None
+    if live is None:
+        return stored
+    combined = ScrapeMetrics()
+    combined.merge(stored)
+    combined.merge(live.snapshot())
+    return combined.snapshot()
+
+
+def all_job_metrics() -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    The finished-run total (one row, updated as each run ends) plus the live runs
+    in this process, and job-count gauges, for /metrics.
+    """
+    db = ReadSessionLocal()
+    try:
+        with _lock:
+            live = list(_live_metrics.values())
+        total_row = db.get(ScrapeMetricsTotal, 1)
+        snapshots = [json.loads(total_row.metrics)] if total_row is not None and total_row.metrics else []
+        snapshots.extend(m.snapshot() for m in live)
+        gauges: Dict[str, float] = {"scrape_jobs_running": 0, "scrape_jobs_queued": 0}
+        for status, n in db.query(ScrapeJob.status, func.count()).filter(ScrapeJob.status.in_(("running", "queued"))).group_by(ScrapeJob.status):
+            gauges[f"scrape_jobs_{status}"] = n
+        return snapshots, gauges
+    finally:
+        db.close()
 
 
 def get_job(job_id: int) -> Optional[ScrapeJob]:
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         return db.get(ScrapeJob, job_id)
     finally:
@@ -15,27 +15,29 @@ from sqlalchemy.orm import joinedload
 
 from fastapi import FastAPI, Request, Form, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from .db import SessionLocal, init_db
+from .db import ReadSessionLocal, SessionLocal, init_db
 from .models import (
     Item,
     Store,
     StoreLink,
-    PriceHistory,
     ShopSession,
     ShopPurchase,
     CaptureRun,
     CaptureRunItem,
 )
-from .jobs import enqueue_scrape_job, get_job
+from .jobs import all_job_metrics, cancel_scrape_job, enqueue_scrape_job, get_job, job_metrics, resume_interrupted_jobs
+from .metrics import render_prometheus, summarize
 from .coles_init import init_coles_session
 from .services import (
     get_latest_prices_for_items,
+    record_prices,
     compute_best_store_map,
     compute_cycle_insights,
+    count_blocked,
     build_buylist_groups,
     seed_from_json_if_empty,
     get_scrape_settings,
@@ -73,23 +75,19 @@ def _startup():
         seed_from_json_if_empty(db, seed_path)
     finally:
         db.close()
+    # Jobs interrupted by a restart pick up from their checkpoint.
+    resume_interrupted_jobs()
 
 
 @app.get("/", response_class=HTMLResponse)
 def dashboard(request: Request):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         items = db.query(Item).order_by(Item.category.asc().nullslast(), Item.name.asc()).all()
         latest = get_latest_prices_for_items(db, [i.id for i in items])
-        coles_blocked_count = (
-            db.query(PriceHistory)
-            .join(Store, Store.id == PriceHistory.store_id)
-            .filter(Store.name == "COLES")
-            .filter(PriceHistory.promo_text.ilike("%[blocked: imperva%"))
-            .count()
-        )
+        coles_blocked_count = count_blocked(db, "COLES")
         best = compute_best_store_map(items, latest)
-        cycles = compute_cycle_insights(db, [i.id for i in items])
+        cycles = compute_cycle_insights(db, [i.id for i in items], archive=True)
         stores = db.query(Store).order_by(Store.name.asc()).all()
         scrape_settings = get_scrape_settings(db)
         return templates.TemplateResponse(
@@ -112,7 +110,7 @@ def dashboard(request: Request):
 
 @app.get("/items/new", response_class=HTMLResponse)
 def item_new_form(request: Request):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         stores = db.query(Store).order_by(Store.name.asc()).all()
         return templates.TemplateResponse(
@@ -171,7 +169,7 @@ def item_new(
 
 @app.get("/items/{item_id}", response_class=HTMLResponse)
 def item_edit_form(request: Request, item_id: int):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         item = db.query(Item).filter(Item.id == item_id).one()
         stores = db.query(Store).order_by(Store.name.asc()).all()
@@ -239,10 +237,27 @@ def item_edit(
 
 
 @app.post("/scrape/start")
-def scrape_start(store: str = Form("ALL")):
+def scrape_start(
+    store: str = Form("ALL"),
+    mode: str = Form("full"),
+    max_pages: str = Form(""),
+    max_minutes: str = Form(""),
+):
     store_filter = (store or "ALL").strip().upper()
     store_arg = None if store_filter == "ALL" else store_filter
-    job_id = enqueue_scrape_job(store=store_arg)
+    job_id = enqueue_scrape_job(
+        store=store_arg,
+        mode=(mode or "full").strip().lower(),
+        max_pages=_to_int(max_pages),
+        max_minutes=_to_int(max_minutes),
+    )
+    return {"ok": True, "job_id": job_id}
+
+
+@app.post("/scrape/cancel/{job_id}")
+def scrape_cancel(job_id: int):
+    if not cancel_scrape_job(job_id):
+        return JSONResponse({"ok": False, "error": "not_running"}, status_code=409)
     return {"ok": True, "job_id": job_id}
 
 
@@ -261,21 +276,39 @@ def scrape_status(job_id: int):
         "finished_at": job.finished_at.isoformat() if job.finished_at else None,
         "message": job.message,
         "store": job.store,
+        "mode": job.mode,
+        "metrics": summarize(job_metrics(job)),
     }
 
 
+@app.get("/metrics")
+def metrics():
+    snapshots, gauges = all_job_metrics()
+    return PlainTextResponse(render_prometheus(snapshots, gauges), media_type="text/plain; version=0.0.4")
+
+
+def _to_int(value: str) -> int | None:
+    try:
+        return max(0, int((value or "").strip()))
+    except ValueError:
+        return None
+
 
 def _get_store(db, store_name: str) -> Store:
     return db.query(Store).filter(Store.name == store_name).one()
 
 
-def _ensure_capture_run(db, store_name: str) -> CaptureRun:
-    run = (
+def _latest_capture_run(db, store_name: str) -> Optional[CaptureRun]:
+    return (
         db.query(CaptureRun)
         .filter(CaptureRun.store == store_name)
         .order_by(CaptureRun.id.desc())
         .first()
     )
+
+
+def _ensure_capture_run(db, store_name: str) -> CaptureRun:
+    run = _latest_capture_run(db, store_name)
     if run:
         return run
     run = CaptureRun(store=store_name, started_at=datetime.utcnow())
@@ -287,7 +320,7 @@ def _ensure_capture_run(db, store_name: str) -> CaptureRun:
 
 @app.get("/capture", response_class=HTMLResponse)
 def capture_center(request: Request, store: str = "WOOLWORTHS"):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         stores = db.query(Store).order_by(Store.name.asc()).all()
         store_name = store.strip().upper() if store else "WOOLWORTHS"
@@ -324,10 +357,19 @@ def api_capture_reset(payload: dict = Body(...)):
 @app.get("/api/capture/status")
 def api_capture_status(store: str):
     store_name = store.strip().upper()
-    db = SessionLocal()
+    # Polled every few seconds by the capture page, so it reads on the read-only pool;
+    # only the very first poll for a store needs the writer, to open a run.
+    db = ReadSessionLocal()
     try:
         st = _get_store(db, store_name)
-        run = _ensure_capture_run(db, store_name)
+        run = _latest_capture_run(db, store_name)
+        if run is None:
+            writer = SessionLocal()
+            try:
+                run_id = _ensure_capture_run(writer, store_name).id
+            finally:
+                writer.close()
+            run = db.get(CaptureRun, run_id)
 
         total_items_with_urls = (
             db.query(StoreLink)
@@ -405,8 +447,6 @@ def api_next(store: str):
         db.close()
 
 
-
-
 @app.get("/api/next_multi")
 def api_next_multi(stores: str):
     store_order = [part.strip().upper() for part in stores.split(",") if part.strip()]
@@ -472,20 +512,21 @@ def api_capture(payload: dict = Body(...)):
         if run is None:
             run = _ensure_capture_run(db, store)
 
-        ph = PriceHistory(
-            item_id=item_id,
-            store_id=st.id,
-            captured_at=datetime.utcnow(),
-            price=float(payload["price"]) if payload.get("price") is not None else None,
-            was_price=float(payload["was_price"]) if payload.get("was_price") is not None else None,
-            unit_price=float(payload["unit_price"]) if payload.get("unit_price") is not None else None,
-            promo_text=(payload.get("promo_text") or None),
-            discount_percent=None,
-        )
-        if ph.price is not None and ph.was_price is not None and ph.was_price > 0 and ph.was_price > ph.price:
-            ph.discount_percent = round((ph.was_price - ph.price) / ph.was_price * 100.0, 1)
+        obs = {
+            "item_id": item_id,
+            "store_id": st.id,
+            "captured_at": datetime.utcnow(),
+            "price": float(payload["price"]) if payload.get("price") is not None else None,
+            "was_price": float(payload["was_price"]) if payload.get("was_price") is not None else None,
+            "unit_price": float(payload["unit_price"]) if payload.get("unit_price") is not None else None,
+            "promo_text": (payload.get("promo_text") or None),
+            "discount_percent": None,
+            "source": "extension",
+        }
+        if obs["price"] is not None and obs["was_price"] is not None and obs["was_price"] > 0 and obs["was_price"] > obs["price"]:
+            obs["discount_percent"] = round((obs["was_price"] - obs["price"]) / obs["was_price"] * 100.0, 1)
 
-        db.add(ph)
+        record_prices(db, [obs], get_scrape_settings(db)["price_storage"])
 
         existing_capture = (
             db.query(CaptureRunItem)
@@ -510,10 +551,9 @@ def api_capture(payload: dict = Body(...)):
         db.close()
 
 
-
 @app.get("/api/settings/scrape")
 def api_get_scrape_settings():
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         return get_scrape_settings(db)
     finally:
@@ -541,9 +581,8 @@ def api_coles_init_session(payload: dict = Body(...)):
     except (TypeError, ValueError):
         slowmo_ms = 250
 
-    state_path = os.path.join(os.path.dirname(__file__), "..", "state", "coles.json")
     try:
-        init_coles_session(url=url, state_path=state_path, slowmo_ms=slowmo_ms)
+        state_path = init_coles_session(url=url, slowmo_ms=slowmo_ms)
     except Exception as exc:
         logger.exception("Coles init session failed")
         return JSONResponse(
@@ -553,16 +592,17 @@ def api_coles_init_session(payload: dict = Body(...)):
 
     return {
         "ok": True,
-        "message": "Coles init session complete; state saved to state/coles.json",
+        "message": f"Coles init session complete; state saved to {state_path}",
     }
 
+
 @app.get("/buylist", response_class=HTMLResponse)
 def buylist(request: Request):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         items = db.query(Item).order_by(Item.category.asc().nullslast(), Item.name.asc()).all()
         latest = get_latest_prices_for_items(db, [i.id for i in items])
-        cycles = compute_cycle_insights(db, [i.id for i in items])
+        cycles = compute_cycle_insights(db, [i.id for i in items], archive=True)
         groups = build_buylist_groups(items, latest, cycles)
         return templates.TemplateResponse(
             "buylist.html",
@@ -586,12 +626,12 @@ def shop_start():
 
 @app.get("/shop/{session_id}", response_class=HTMLResponse)
 def shop_view(request: Request, session_id: int):
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         session = db.query(ShopSession).filter(ShopSession.id == session_id).one()
         items = db.query(Item).order_by(Item.category.asc().nullslast(), Item.name.asc()).all()
         latest = get_latest_prices_for_items(db, [i.id for i in items])
-        cycles = compute_cycle_insights(db, [i.id for i in items])
+        cycles = compute_cycle_insights(db, [i.id for i in items], archive=True)
         groups = build_buylist_groups(items, latest, cycles)
 
         # existing purchases
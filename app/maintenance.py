@@ -0,0 +1,59 @@
+"""
+One-off maintenance commands for the price tables.
+
+  python -m app.maintenance rebuild-latest   # recompute latest_price from price_history
+  python -m app.maintenance compact-history  # fold repeated unchanged prices into change-only rows
+  python -m app.maintenance retention --keep-days 180  # roll up + archive older raw history
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from .db import SessionLocal, init_db
+from .retention import ARCHIVE_DIR, RAW_RETENTION_DAYS, run_retention
+from .services import compact_price_history, rebuild_latest_prices
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="PriceWatch maintenance")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild-latest", help="recompute latest_price from price_history")
+    sub.add_parser("compact-history", help="fold consecutive unchanged price_history rows into one row each")
+    p_ret = sub.add_parser("retention", help="roll old price_history into price_daily and archive it to Parquet by month")
+    p_ret.add_argument("--keep-days", type=int, default=RAW_RETENTION_DAYS, help="raw rows kept in price_history")
+    p_ret.add_argument("--archive-dir", default=str(ARCHIVE_DIR))
+    p_ret.add_argument("--dry-run", action="store_true", help="only count the rows per month that would move")
+    args = ap.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.cmd == "rebuild-latest":
+            t0 = time.perf_counter()
+            n = rebuild_latest_prices(db)
+            db.commit()
+            print(f"[+] latest_price rebuilt: {n} (item, store) rows in {time.perf_counter() - t0:.2f}s")
+        elif args.cmd == "compact-history":
+            t0 = time.perf_counter()
+            stats = compact_price_history(db)
+            print(
+                f"[+] compacted {stats['pairs']} (item, store) pairs: "
+                f"{stats['rows_before']} -> {stats['rows_after']} price_history rows in {time.perf_counter() - t0:.2f}s"
+            )
+        elif args.cmd == "retention":
+            t0 = time.perf_counter()
+            stats = run_retention(db, args.keep_days, args.archive_dir, dry_run=args.dry_run)
+            for month, n in sorted(stats["months"].items()):
+                print(f"{month} {n:>8} rows")
+            verb = "would move" if args.dry_run else "archived"
+            print(
+                f"[+] {verb} {stats['rows']} rows captured before {stats['cutoff']:%Y-%m-%d}"
+                f" ({stats['days']} daily rollups) in {time.perf_counter() - t0:.2f}s"
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Upper bounds (seconds) of the stage-duration histogram buckets; +Inf is implicit.
+BUCKETS: Tuple[float, ...] = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages timed by the scrapers and the job writer.
+STAGES = (
+    "browser_launch",
+    "context_create",
+    "session_refresh",
+    "http_fetch",
+    "goto",
+    "readiness",
+    "selector_match",
+    "parse",
+    "db_write",
+)
+# Per-store event counters.
+COUNTERS = ("pages", "http_hits", "blocks", "timeouts", "errors", "retries")
+
+
+class ScrapeMetrics:
+    """
+    Per-store stage timings (histograms) and event counters for one scrape job.
+
+    Snapshots are plain JSON-able dicts so they can be stored on the job row,
+    sent back from scrape processes and summed for /metrics.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (stage, store) -> {"buckets": [...], "count": n, "sum": seconds}
+        self._hist: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+
+    def observe(self, stage: str, store_name: str, seconds: float) -> None:
+        with self._lock:
+            h = self._hist.get((stage, store_name))
+            if h is None:
+                h = self._hist[(stage, store_name)] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+                    break
+            h["count"] += 1
+            h["sum"] += seconds
+
+    @contextmanager
+    def time(self, stage: str, store_name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, store_name, time.perf_counter() - started)
+
+    def inc(self, counter: str, store_name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[(counter, store_name)] = self._counters.get((counter, store_name), 0) + n
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return _snapshot(self._hist, self._counters)
+
+    def take(self) -> Dict[str, Any]:
+        """snapshot() of everything recorded since the last take(), then reset; for streaming deltas."""
+        with self._lock:
+            snap = _snapshot(self._hist, self._counters)
+            self._hist, self._counters = {}, {}
+        return snap
+
+    def merge(self, snapshot: Dict[str, Any] | None) -> None:
+        if not snapshot:
+            return
+        with self._lock:
+            for row in snapshot.get("histograms") or []:
+                key = (row["stage"], row["store"])
+                h = self._hist.setdefault(key, {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0})
+                h["buckets"] = [a + b for a, b in zip(h["buckets"], row["buckets"])]
+                h["count"] += row["count"]
+                h["sum"] += row["sum"]
+            for row in snapshot.get("counters") or []:
+                key = (row["name"], row["store"])
+                self._counters[key] = self._counters.get(key, 0) + row["value"]
+
+
+def _snapshot(hist: Dict[Tuple[str, str], Dict[str, Any]], counters: Dict[Tuple[str, str], int]) -> Dict[str, Any]:
+    return {
+        "histograms": [
+            {"stage": stage, "store": store_name, "buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]}
+            for (stage, store_name), h in sorted(hist.items())
+        ],
+        "counters": [
+            {"name": name, "store": store_name, "value": value}
+            for (name, store_name), value in sorted(counters.items())
+        ],
+    }
+
+
+def _quantile(buckets: List[int], count: int, q: float) -> float | None:
+    """Upper bucket bound containing the q-quantile (None past the last bound)."""
+    if not count:
+        return None
+    target = q * count
+    seen = 0
+    for bound, n in zip(BUCKETS, buckets):
+        seen += n
+        if seen >= target:
+            return bound
+    return None
+
+
+def summarize(snapshot: Dict[str, Any] | None) -> Dict[str, Any]:
+    """Compact JSON view: {store: {stage: {count, avg_ms, p50_ms, p95_ms}, counters...}}."""
+    out: Dict[str, Dict[str, Any]] = {}
+    for row in (snapshot or {}).get("histograms") or []:
+        p50 = _quantile(row["buckets"], row["count"], 0.5)
+        p95 = _quantile(row["buckets"], row["count"], 0.95)
+        out.setdefault(row["store"], {})[row["stage"]] = {
+            "count": row["count"],
+            "avg_ms": round(row["sum"] / row["count"] * 1000, 1) if row["count"] else None,
+            "p50_ms": int(p50 * 1000) if p50 is not None else None,
+            "p95_ms": int(p95 * 1000) if p95 is not None else None,
+        }
+    for row in (snapshot or {}).get("counters") or []:
+        out.setdefault(row["store"], {})[row["name"]] = row["value"]
+    return out
+
+
+def render_prometheus(snapshots: Iterable[Dict[str, Any] | None], gauges: Dict[str, float] | None = None) -> str:
+    """Prometheus text exposition of the summed snapshots."""
+    total = ScrapeMetrics()
+    for snapshot in snapshots:
+        total.merge(snapshot)
+    snap = total.snapshot()
+    lines = [
+        "# HELP pricewatch_scrape_stage_seconds Time spent per scrape stage.",
+        "# TYPE pricewatch_scrape_stage_seconds histogram",
+    ]
+    for row in snap["histograms"]:
+        labels = f'stage="{row["stage"]}",store="{row["store"]}"'
+        cumulative = 0
+        for bound, n in zip(BUCKETS, row["buckets"]):
+            cumulative += n
+            lines.append(f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="+Inf"}} {row["count"]}')
+        lines.append(f"pricewatch_scrape_stage_seconds_sum{{{labels}}} {row['sum']:.6f}")
+        lines.append(f"pricewatch_scrape_stage_seconds_count{{{labels}}} {row['count']}")
+    names = sorted({row["name"] for row in snap["counters"]})
+    for name in names:
+        lines.append(f"# TYPE pricewatch_scrape_{name}_total counter")
+        for row in snap["counters"]:
+            if row["name"] == name:
+                lines.append(f'pricewatch_scrape_{name}_total{{store="{row["store"]}"}} {row["value"]}')
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE pricewatch_{name} gauge")
+        lines.append(f"pricewatch_{name} {value}")
+    return "\n".join(lines) + "\n"
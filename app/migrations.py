@@ -0,0 +1,111 @@
+"""
+Numbered schema migrations for changes create_all() cannot make to an
+existing pricewatch.db (indexes, data rewrites). init_db() applies pending
+ones in order; each runs in its own transaction and is recorded in
+schema_migrations.
+
+  python -m app.migrations          # apply pending migrations
+  python -m app.migrations --list   # show applied / pending
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Tuple
+
+from sqlalchemy import text
+
+from .db import Base
+
+
+def _create_indexes(conn: Any, *table_names: str) -> None:
+    for name in table_names:
+        for index in Base.metadata.tables[name].indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _price_history_indexes(conn: Any) -> None:
+    _create_indexes(conn, "price_history", "scrape_events")
+    # Fresh statistics so the planner picks the new indexes over a full scan.
+    conn.execute(text("ANALYZE"))
+
+
+def _latest_price_backfill(conn: Any) -> None:
+    from .services import rebuild_latest_prices
+
+    rebuild_latest_prices(conn)
+
+
+def _metrics_total_backfill(conn: Any) -> None:
+    from .metrics import ScrapeMetrics
+    from .models import ScrapeMetricsTotal
+
+    total = ScrapeMetrics()
+    for (raw,) in conn.execute(text("SELECT metrics FROM scrape_jobs WHERE metrics IS NOT NULL")):
+        total.merge(json.loads(raw))
+    conn.execute(ScrapeMetricsTotal.__table__.delete())
+    conn.execute(
+        ScrapeMetricsTotal.__table__.insert(),
+        {"id": 1, "metrics": json.dumps(total.snapshot()), "updated_at": datetime.utcnow()},
+    )
+
+
+# (number, name, fn(connection)); append only, never renumber.
+MIGRATIONS: List[Tuple[int, str, Callable[[Any], None]]] = [
+    (1, "price_history_indexes", _price_history_indexes),
+    (2, "latest_price_backfill", _latest_price_backfill),
+    # Fills latest_price.price_history_id, which change-only storage extends.
+    (3, "latest_price_history_ids", _latest_price_backfill),
+    # Seeds the /metrics aggregate with the jobs stored before it existed.
+    (4, "metrics_total_backfill", _metrics_total_backfill),
+]
+
+
+def applied_migrations(engine: Any) -> set:
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT id FROM schema_migrations"))}
+
+
+def run_migrations(engine: Any) -> List[str]:
+    """Apply every migration not yet in schema_migrations. Returns the names applied."""
+    from .models import SchemaMigration
+
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    done = applied_migrations(engine)
+    applied = []
+    for number, name, fn in MIGRATIONS:
+        if number in done:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                SchemaMigration.__table__.insert(),
+                {"id": number, "name": name, "applied_at": datetime.utcnow()},
+            )
+        applied.append(name)
+    return applied
+
+
+def main() -> None:
+    from .db import engine, init_db
+
+    ap = argparse.ArgumentParser(description="PriceWatch schema migrations")
+    ap.add_argument("--list", action="store_true", help="show migrations without applying them")
+    args = ap.parse_args()
+
+    if args.list:
+        from .models import SchemaMigration
+
+        SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+        done = applied_migrations(engine)
+        for number, name, _ in MIGRATIONS:
+            print(f"{number:>4} {name:<32} {'applied' if number in done else 'pending'}")
+        return
+    for name in init_db():
+        print(f"[+] applied {name}")
+    print("[+] schema up to date")
+
+
+if __name__ == "__main__":
+    main()
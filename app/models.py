@@ -1,11 +1,12 @@
 from __future__ import annotations
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, UniqueConstraint, Text, Boolean, Index, text
 from sqlalchemy.orm import relationship
 
 from .db import Base
 
+
 class Item(Base):
     __tablename__ = "items"
     id = Column(Integer, primary_key=True)
@@ -18,6 +19,8 @@ class Item(Base):
 
     links = relationship("StoreLink", back_populates="item", cascade="all, delete-orphan")
     prices = relationship("PriceHistory", back_populates="item", cascade="all, delete-orphan")
+    latest_prices = relationship("LatestPrice", cascade="all, delete-orphan")
+    daily_prices = relationship("PriceDaily", cascade="all, delete-orphan")
 
 
 class Store(Base):
@@ -57,10 +60,75 @@ class PriceHistory(Base):
     unit_price = Column(Float, nullable=True)
     promo_text = Column(String, nullable=True)
     discount_percent = Column(Float, nullable=True)
+    source = Column(String, nullable=True)  # "http" | "browser" | "extension"
+
+    # Change-only storage (services.record_prices): later identical observations extend this row.
+    last_seen_at = Column(DateTime, nullable=True)  # last observation folded in; None = captured_at
+    seen_count = Column(Integer, nullable=False, default=1)  # observations this row stands for
+    seen_gap_days = Column(Integer, nullable=False, default=0)  # sum of whole-day gaps > 0 between them
+    seen_gaps = Column(Integer, nullable=False, default=0)  # how many such gaps
 
     item = relationship("Item", back_populates="prices")
     store = relationship("Store", back_populates="prices")
 
+    # Created on existing databases by migration 1 (app/migrations.py).
+    __table_args__ = (
+        # Latest price and min price per (item, store), and the stale-job freshness lookup;
+        # price is included so all three are answered from the index alone.
+        Index("ix_price_history_item_store_captured", "item_id", "store_id", "captured_at", "price"),
+        # Discount rows for cycle insights, already in (item, store, time) order.
+        Index(
+            "ix_price_history_discounts",
+            "item_id",
+            "store_id",
+            "captured_at",
+            sqlite_where=text("discount_percent IS NOT NULL OR was_price IS NOT NULL"),
+        ),
+        # Dashboard blocked count: scans one store's promo_text without touching the table.
+        Index("ix_price_history_store_promo", "store_id", "promo_text"),
+    )
+
+
+class LatestPrice(Base):
+    """
+    Newest price_history row per (item, store), kept up to date by every writer
+    (services.upsert_latest_prices) so reading current prices never scans history.
+    Rebuilt from price_history with ``python -m app.maintenance rebuild-latest``.
+    """
+    __tablename__ = "latest_price"
+    item_id = Column(Integer, ForeignKey("items.id"), primary_key=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    price_history_id = Column(Integer, nullable=True)  # the row change-only storage extends
+    captured_at = Column(DateTime, nullable=False)  # last observation
+
+    price = Column(Float, nullable=True)
+    was_price = Column(Float, nullable=True)
+    unit_price = Column(Float, nullable=True)
+    promo_text = Column(String, nullable=True)
+    discount_percent = Column(Float, nullable=True)
+    source = Column(String, nullable=True)
+
+
+class PriceDaily(Base):
+    """
+    Daily rollup of price_history rows moved to the archive by the retention
+    job (app/retention.py): one row per (item, store, day of captured_at).
+    """
+    __tablename__ = "price_daily"
+    item_id = Column(Integer, ForeignKey("items.id"), primary_key=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+
+    min_price = Column(Float, nullable=True)
+    max_price = Column(Float, nullable=True)
+    last_price = Column(Float, nullable=True)
+    last_was_price = Column(Float, nullable=True)
+    last_unit_price = Column(Float, nullable=True)
+    last_promo_text = Column(String, nullable=True)
+    last_discount_percent = Column(Float, nullable=True)
+    last_captured_at = Column(DateTime, nullable=False)
+    observations = Column(Integer, nullable=False, default=0)  # sum of seen_count
+
 
 class CaptureRun(Base):
     __tablename__ = "capture_runs"
@@ -107,6 +175,21 @@ class ScrapeSettings(Base):
     slowmo_ms = Column(Integer, nullable=False, default=0)
     debug_capture_enabled = Column(Boolean, nullable=False, default=True)
     save_storage_state = Column(Boolean, nullable=False, default=True)
+    engine = Column(String, nullable=False, default="sync")  # "sync" | "async" | "process"
+    store_concurrency = Column(Text, nullable=True)  # JSON {STORE: max open pages}, async engine only
+    resource_blocking = Column(Text, nullable=True)  # JSON {STORE: bool}, overrides scrape.RESOURCE_BLOCKING
+    http_first = Column(Boolean, nullable=False, default=True)
+    rate_limits = Column(Text, nullable=True)  # JSON {STORE: {"per_minute": n, "burst": n}}, overrides scrape.RATE_LIMITS
+    rate_jitter_ms = Column(Integer, nullable=False, default=750)
+    breaker_threshold = Column(Integer, nullable=False, default=3)  # consecutive blocks before a store is skipped
+    breaker_cooldown_s = Column(Integer, nullable=False, default=600)  # open -> half-open probe delay
+    commit_interval = Column(Integer, nullable=False, default=100)  # price rows per bulk insert + commit
+    freshness_ttl = Column(Text, nullable=True)  # JSON {"default_h": n, "stores": {STORE: h}, "buy_freq": {freq: h}}
+    stale_max_pages = Column(Integer, nullable=False, default=200)  # page budget for a stale-only job
+    stale_max_minutes = Column(Integer, nullable=False, default=15)  # time budget for a stale-only job
+    processes = Column(Integer, nullable=False, default=0)  # process engine; 0 = scrape.DEFAULT_PROCESSES
+    shard_by = Column(String, nullable=False, default="store")  # process engine: "store" | "url"
+    price_storage = Column(String, nullable=False, default="change_only")  # "change_only" | "append"
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
@@ -119,3 +202,72 @@ class ScrapeJob(Base):
     finished_at = Column(DateTime, nullable=True)
     message = Column(String, nullable=True)
     store = Column(String, nullable=True)
+    mode = Column(String, nullable=False, default="full")  # "full" | "stale"
+    max_pages = Column(Integer, nullable=True)
+    max_minutes = Column(Integer, nullable=True)
+    planned_at = Column(DateTime, nullable=True)  # set once scrape_job_items are written; a resume reuses them
+    lease_owner = Column(String, nullable=True)  # worker currently running the job
+    lease_expires_at = Column(DateTime, nullable=True)  # renewed by the owner's heartbeat; expired -> claimable
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    plan_stats = Column(Text, nullable=True)  # JSON counts from planning, for the job message
+    metrics = Column(Text, nullable=True)  # JSON ScrapeMetrics snapshot: per-store stage timings and counters
+
+
+class ScrapeMetricsTotal(Base):
+    """Single row (id 1): every finished job run's metrics summed, so /metrics never reads each job."""
+    __tablename__ = "scrape_metrics_total"
+    id = Column(Integer, primary_key=True)
+    metrics = Column(Text, nullable=True)  # JSON ScrapeMetrics snapshot
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ScrapeJobItem(Base):
+    """One page of a scrape job: the checkpoint a restarted job resumes from."""
+    __tablename__ = "scrape_job_items"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("scrape_jobs.id"), nullable=False, index=True)
+    store = Column(String, nullable=False)
+    url = Column(Text, nullable=False)
+    item_ids = Column(Text, nullable=False)  # comma-separated item ids sharing this URL
+    state = Column(String, nullable=False, default="pending")  # "pending" | "done" | "failed" | "skipped"
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+
+class SelectorStat(Base):
+    __tablename__ = "selector_stats"
+    id = Column(Integer, primary_key=True)
+    store = Column(String, nullable=False)
+    selector = Column(String, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    misses = Column(Integer, nullable=False, default=0)
+    score = Column(Float, nullable=False, default=0.0)  # decayed recent-success score; higher is tried first
+    avg_match_ms = Column(Float, nullable=True)
+    last_hit_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("store", "selector", name="uq_store_selector"),
+    )
+
+
+class ScrapeEvent(Base):
+    __tablename__ = "scrape_events"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("scrape_jobs.id"), nullable=True)
+    store = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # "store_blocked"
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    detail = Column(Text, nullable=True)  # JSON
+
+    __table_args__ = (
+        Index("ix_scrape_events_store_kind", "store", "kind"),
+    )
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    id = Column(Integer, primary_key=True)  # migration number, see app/migrations.py
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Dict
+
+
+class TokenBucket:
+    """
+    Token bucket for one store: ``per_minute`` requests on average, up to
+    ``burst`` back to back. The effective rate is scaled by ``factor``, which
+    AdaptivePacer lowers on blocks/errors and raises again on successes.
+    """
+
+    def __init__(self, per_minute: float, burst: int) -> None:
+        self.per_minute = max(0.1, float(per_minute))
+        self.burst = max(1, int(burst))
+        self.factor = 1.0
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    @property
+    def rate_per_sec(self) -> float:
+        return self.per_minute * self.factor / 60.0
+
+    def reserve(self) -> float:
+        """Take a token; returns how many seconds the caller must wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate_per_sec)
+        self.updated = now
+        self.tokens -= 1.0
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate_per_sec
+
+
+class AdaptivePacer:
+    """
+    Per-store politeness: a token bucket with random jitter on every wait, and
+    automatic backoff. A block (e.g. Imperva challenge) halves the store's rate;
+    an error rate above ``error_threshold`` (EWMA over recent requests) cuts it
+    by a quarter; each success recovers 10% up to the configured rate.
+    Safe to share between threads and between an event loop and its workers.
+    """
+
+    MIN_FACTOR = 0.05
+    BLOCK_FACTOR = 0.5
+    ERROR_FACTOR = 0.75
+    RECOVER_FACTOR = 1.1
+    ERROR_ALPHA = 0.2
+
+    def __init__(self, limits: Dict[str, Dict[str, Any]], jitter_ms: int = 0, error_threshold: float = 0.3) -> None:
+        self._lock = threading.Lock()
+        self._limits = limits
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._error_rate: Dict[str, float] = {}
+        self.jitter_ms = max(0, int(jitter_ms or 0))
+        self.error_threshold = error_threshold
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def _bucket(self, store_name: str) -> TokenBucket | None:
+        bucket = self._buckets.get(store_name)
+        if bucket is None:
+            cfg = self._limits.get(store_name)
+            if not cfg or not cfg.get("per_minute"):
+                return None
+            bucket = self._buckets[store_name] = TokenBucket(cfg["per_minute"], cfg.get("burst", 1))
+        return bucket
+
+    def _reserve(self, store_name: str) -> float:
+        with self._lock:
+            bucket = self._bucket(store_name)
+            delay = bucket.reserve() if bucket is not None else 0.0
+            if self.jitter_ms:
+                delay += random.uniform(0, self.jitter_ms) / 1000.0
+            st = self.stats.setdefault(store_name, {"waits": 0, "waited_s": 0.0, "backoffs": 0})
+            st["waits"] += 1
+            st["waited_s"] += delay
+        return delay
+
+    def wait(self, store_name: str) -> None:
+        delay = self._reserve(store_name)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, store_name: str) -> None:
+        delay = self._reserve(store_name)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, store_name: str, outcome: str) -> None:
+        """outcome: "ok", "error" or "blocked"."""
+        with self._lock:
+            bucket = self._bucket(store_name)
+            err = self._error_rate.get(store_name, 0.0)
+            err = err * (1 - self.ERROR_ALPHA) + (self.ERROR_ALPHA if outcome != "ok" else 0.0)
+            self._error_rate[store_name] = err
+            if bucket is None:
+                return
+            if outcome == "blocked":
+                bucket.factor = max(self.MIN_FACTOR, bucket.factor * self.BLOCK_FACTOR)
+            elif outcome == "error" and err > self.error_threshold:
+                bucket.factor = max(self.MIN_FACTOR, bucket.factor * self.ERROR_FACTOR)
+            elif outcome == "ok" and err <= self.error_threshold:
+                bucket.factor = min(1.0, bucket.factor * self.RECOVER_FACTOR)
+            else:
+                return
+            if outcome != "ok":
+                self.stats.setdefault(store_name, {"waits": 0, "waited_s": 0.0, "backoffs": 0})["backoffs"] += 1
+
+    def factor(self, store_name: str) -> float:
+        with self._lock:
+            bucket = self._bucket(store_name)
+            return bucket.factor if bucket is not None else 1.0
+
+
+class CircuitBreaker:
+    """
+    Per-store circuit breaker for a scrape run. ``threshold`` blocks in a row
+    open the circuit and the store is skipped; after ``cooldown_s`` it goes
+    half-open and lets a single probe through. A clean probe closes it again,
+    another block re-opens it for a fresh cool-down. A probe that ends without
+    a result (an error, no data) must be handed back with ``release()``.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int = 3, cooldown_s: float = 600.0) -> None:
+        self.threshold = max(1, int(threshold))
+        self.cooldown_s = max(0.0, float(cooldown_s))
+        self._lock = threading.Lock()
+        self._state: Dict[str, str] = {}
+        self._consecutive: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._probing: Dict[str, bool] = {}
+        self.skipped: Dict[str, int] = {}
+        self.blocks: Dict[str, int] = {}
+
+    def state(self, store_name: str) -> str:
+        with self._lock:
+            return self._state.get(store_name, self.CLOSED)
+
+    def allow(self, store_name: str) -> bool:
+        with self._lock:
+            state = self._state.get(store_name, self.CLOSED)
+            if state == self.CLOSED:
+                return True
+            if state == self.OPEN and time.monotonic() - self._opened_at[store_name] >= self.cooldown_s:
+                self._state[store_name] = self.HALF_OPEN
+                self._probing[store_name] = False
+                state = self.HALF_OPEN
+            if state == self.HALF_OPEN and not self._probing.get(store_name):
+                self._probing[store_name] = True
+                return True
+            self.skipped[store_name] = self.skipped.get(store_name, 0) + 1
+            return False
+
+    def record(self, store_name: str, blocked: bool) -> bool:
+        """Returns True when this result opened (or re-opened) the circuit."""
+        with self._lock:
+            state = self._state.get(store_name, self.CLOSED)
+            self._probing[store_name] = False
+            if not blocked:
+                self._consecutive[store_name] = 0
+                if state == self.HALF_OPEN:
+                    self._state[store_name] = self.CLOSED
+                return False
+            self.blocks[store_name] = self.blocks.get(store_name, 0) + 1
+            self._consecutive[store_name] = self._consecutive.get(store_name, 0) + 1
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._consecutive[store_name] >= self.threshold):
+                self._state[store_name] = self.OPEN
+                self._opened_at[store_name] = time.monotonic()
+                return True
+            return False
+
+    def release(self, store_name: str) -> None:
+        """Frees the half-open probe slot when the probe produced nothing to ``record``; a no-op otherwise."""
+        with self._lock:
+            self._probing[store_name] = False
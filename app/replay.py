@@ -0,0 +1,210 @@
+"""
+Record linked product pages once, then replay them from a local server so the
+scraper can be run and benchmarked without touching the supermarket sites.
+
+  python -m app.replay record --out replay/                # every linked URL, via the browser
+  python -m app.replay record --out replay/ --via http --store COLES --limit 50
+  python -m app.replay serve --dir replay/ --port 8765
+
+A recording is <dir>/<store>/<key>.html plus <dir>/index.json, which keeps the
+original URL, status and the response headers challenge detection looks at.
+The server serves each page at /<store>/<key>, the same layout bench_scrape.py
+reads with --pages. Scripts and stylesheets are stripped when recording (JSON
+scripts such as __NEXT_DATA__ and JSON-LD stay), so a replayed page renders
+without going back to the live site.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# path -> html, or (status, headers, html)
+Page = Any
+
+INDEX_FILE = "index.json"
+# Response headers worth replaying: the cheap challenge classifier reads these.
+KEPT_HEADERS = ("server", "x-cdn", "x-iinfo", "cf-ray", "retry-after")
+
+_SCRIPT_RE = re.compile(r"<script\b([^>]*)>.*?</script\s*>", re.IGNORECASE | re.DOTALL)
+_LINK_RE = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+_DROP_LINK_REL = re.compile(r"""rel=["']?(?:stylesheet|preload|modulepreload|prefetch|preconnect|dns-prefetch)""", re.IGNORECASE)
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+
+
+def replay_path(store_name: str, url: str) -> str:
+    return f"/{store_name.lower()}/{url_key(url)}"
+
+
+def strip_live_resources(html: str) -> str:
+    """Drops scripts (except JSON payloads) and stylesheet/preload links."""
+    html = _SCRIPT_RE.sub(lambda m: m.group(0) if "json" in m.group(1).lower() else "", html)
+    return _LINK_RE.sub(lambda m: "" if _DROP_LINK_REL.search(m.group(0)) else m.group(0), html)
+
+
+def _save(out_dir: Path, index: List[Dict[str, Any]], store_name: str, url: str, status: int, headers: Dict[str, str], html: str) -> None:
+    path = replay_path(store_name, url)
+    target = out_dir / (path.strip("/") + ".html")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_text(strip_live_resources(html), encoding="utf-8")
+    index.append({"url": url, "store": store_name, "path": path, "status": status, "headers": headers})
+
+
+def record(links: Iterable[Tuple[str, str]], out_dir: str | Path, via: str = "browser", settings: Dict[str, Any] | None = None) -> int:
+    """
+    Saves a snapshot of every (store_name, url). ``via="browser"`` keeps the
+    rendered DOM after the page settles; ``via="http"`` keeps the raw server HTML.
+    Returns the number of pages recorded; failures are printed and skipped.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    index: List[Dict[str, Any]] = []
+    links = list(dict.fromkeys((store_name, url.strip()) for store_name, url in links if (url or "").strip()))
+
+    if via == "http":
+        from .extract import HttpClient
+
+        client = HttpClient()
+        try:
+            for store_name, url in links:
+                try:
+                    status, _, html = client.get(url)
+                except Exception as exc:  # noqa: PERF203
+                    print(f"[!] {store_name} {url}: {type(exc).__name__}")
+                    continue
+                _save(out_dir, index, store_name, url, status, {}, html)
+        finally:
+            client.close()
+    else:
+        from .scrape import BrowserPool
+
+        with BrowserPool({"debug_capture_enabled": False, "http_first": False, **(settings or {})}) as pool:
+            for store_name, url in links:
+                page = pool.new_page(store_name)
+                try:
+                    pool.pacer.wait(store_name)
+                    response = page.goto(url, wait_until="domcontentloaded", timeout=45000)
+                    try:
+                        page.wait_for_load_state("networkidle", timeout=10000)
+                    except Exception:
+                        pass
+                    headers = {k: v for k, v in (response.headers if response is not None else {}).items() if k.lower() in KEPT_HEADERS}
+                    _save(out_dir, index, store_name, url, response.status if response is not None else 200, headers, page.content())
+                except Exception as exc:
+                    print(f"[!] {store_name} {url}: {type(exc).__name__}")
+                finally:
+                    page.close()
+
+    previous = load_index(out_dir)
+    merged = {row["url"]: row for row in previous + index}
+    (out_dir / INDEX_FILE).write_text(json.dumps(list(merged.values()), indent=2), encoding="utf-8")
+    return len(index)
+
+
+def load_index(snapshot_dir: str | Path) -> List[Dict[str, Any]]:
+    path = Path(snapshot_dir) / INDEX_FILE
+    if not path.exists():
+        return []
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def load_pages(snapshot_dir: str | Path) -> Dict[str, Page]:
+    """Recorded pages by replay path, with their recorded status and headers."""
+    snapshot_dir = Path(snapshot_dir)
+    pages: Dict[str, Page] = {}
+    for row in load_index(snapshot_dir):
+        target = snapshot_dir / (row["path"].strip("/") + ".html")
+        if target.exists():
+            pages[row["path"]] = (row.get("status") or 200, row.get("headers") or {}, target.read_text(encoding="utf-8", errors="replace"))
+    return pages
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    pages: Dict[str, Page] = {}
+    fallback: Callable[[str], Page] | None = None
+
+    def do_GET(self):
+        page = self.pages.get(self.path.split("?", 1)[0])
+        if page is None and self.fallback is not None:
+            page = self.fallback(self.path)
+        if page is None:
+            page = (404, {}, "<html><head><title>Not recorded</title></head><body></body></html>")
+        status, headers, html = page if isinstance(page, tuple) else (200, {}, page)
+        body = html.encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_pages(pages: Dict[str, Page], fallback: Callable[[str], Page] | None = None, port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Starts a background server for ``pages``; returns (server, base_url). Call server.shutdown() when done."""
+    handler = type("ReplayHandler", (_ReplayHandler,), {"pages": dict(pages), "fallback": staticmethod(fallback) if fallback else None})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def replay_links(snapshot_dir: str | Path, base_url: str) -> List[Tuple[str, str, str]]:
+    """(store_name, original_url, replay_url) for every recorded page."""
+    return [(row["store"], row["url"], base_url + row["path"]) for row in load_index(snapshot_dir)]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Record and replay product pages")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("record", help="snapshot linked product pages")
+    p_rec.add_argument("--out", required=True)
+    p_rec.add_argument("--via", choices=["browser", "http"], default="browser")
+    p_rec.add_argument("--store", default="ALL")
+    p_rec.add_argument("--limit", type=int, default=None, help="pages per store")
+    p_srv = sub.add_parser("serve", help="serve a recording until interrupted")
+    p_srv.add_argument("--dir", required=True)
+    p_srv.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+
+    if args.cmd == "record":
+        from .db import SessionLocal, init_db
+        from .jobs import group_page_tasks, plan_scrape_work
+
+        init_db()
+        db = SessionLocal()
+        try:
+            pages = group_page_tasks(plan_scrape_work(db, args.store.strip().upper()))
+        finally:
+            db.close()
+        per_store: Dict[str, int] = {}
+        links = []
+        for store_name, url, _ in pages:
+            per_store[store_name] = per_store.get(store_name, 0) + 1
+            if args.limit is None or per_store[store_name] <= args.limit:
+                links.append((store_name, url))
+        n = record(links, args.out, args.via)
+        print(f"[+] recorded {n}/{len(links)} pages into {args.out}")
+    else:
+        server, base_url = serve_pages(load_pages(args.dir), port=args.port)
+        for store_name, url, local in replay_links(args.dir, base_url):
+            print(f"{store_name:<11} {local}  <- {url}")
+        print(f"[+] serving {args.dir} at {base_url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import LatestPrice, PriceDaily, PriceHistory
+
+# price_history keeps raw rows whose last observation is younger than this; older rows
+# are rolled up into price_daily and moved to Parquet files under ARCHIVE_DIR.
+RAW_RETENTION_DAYS = int(os.environ.get("PRICEWATCH_RETENTION_DAYS", "180"))
+ARCHIVE_DIR = Path(os.environ.get("PRICEWATCH_ARCHIVE_DIR", "archive"))
+
+_ARCHIVE_TABLE = "price_history"
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as exc:  # pragma: no cover - depends on the install
+        raise RuntimeError("The price archive needs pyarrow (pip install pyarrow)") from exc
+    return pa, ds, pq
+
+
+def _archive_schema(pa: Any) -> Any:
+    """Arrow schema mirroring the price_history columns."""
+    types = {"integer": pa.int64(), "float": pa.float64(), "datetime": pa.timestamp("us")}
+    return pa.schema(
+        [pa.field(col.name, types.get(col.type.__visit_name__, pa.string())) for col in PriceHistory.__table__.columns]
+    )
+
+
+def _month(value: datetime) -> str:
+    return value.strftime("%Y-%m")
+
+
+def _write_month(root: Path, month: str, rows: List[Any]) -> Path:
+    """Write one month's rows as a zstd Parquet part, named by id range so a re-run replaces it."""
+    pa, _, pq = _arrow()
+    schema = _archive_schema(pa)
+    table = pa.Table.from_pylist([{name: getattr(row, name) for name in schema.names} for row in rows], schema=schema)
+    folder = root / _ARCHIVE_TABLE / f"month={month}"
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / f"part-{rows[0].id}-{rows[-1].id}.parquet"
+    tmp = path.with_suffix(".parquet.tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+    return path
+
+
+def _daily_rollup(rows: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    price_daily rows for ``rows``, one per item, store and day. Days are UTC
+    calendar days of ``captured_at`` (stored in UTC), not the store's local day,
+    so an evening price in Australia lands on the previous price_daily day.
+    """
+    days: Dict[Tuple[int, int, date], Dict[str, Any]] = {}
+    for row in rows:
+        key = (row.item_id, row.store_id, row.captured_at.date())
+        seen_at = row.last_seen_at or row.captured_at
+        day = days.get(key)
+        if day is None:
+            day = days[key] = {
+                "item_id": row.item_id,
+                "store_id": row.store_id,
+                "day": key[2],
+                "min_price": row.price,
+                "max_price": row.price,
+                "observations": 0,
+                "last_captured_at": seen_at,
+            }
+        elif row.price is not None:
+            day["min_price"] = row.price if day["min_price"] is None else min(day["min_price"], row.price)
+            day["max_price"] = row.price if day["max_price"] is None else max(day["max_price"], row.price)
+        day["observations"] += row.seen_count or 1
+        if seen_at >= day["last_captured_at"]:
+            day.update({
+                "last_captured_at": seen_at,
+                "last_price": row.price,
+                "last_was_price": row.was_price,
+                "last_unit_price": row.unit_price,
+                "last_promo_text": row.promo_text,
+                "last_discount_percent": row.discount_percent,
+            })
+    return list(days.values())
+
+
+def _upsert_daily(db: Session, rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    stmt = sqlite_insert(PriceDaily)
+    new = stmt.excluded
+    newer = new.last_captured_at >= PriceDaily.last_captured_at
+    last = ("last_price", "last_was_price", "last_unit_price", "last_promo_text", "last_discount_percent", "last_captured_at")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PriceDaily.item_id, PriceDaily.store_id, PriceDaily.day],
+        set_={
+            "min_price": func.min(
+                func.coalesce(PriceDaily.min_price, new.min_price), func.coalesce(new.min_price, PriceDaily.min_price)
+            ),
+            "max_price": func.max(
+                func.coalesce(PriceDaily.max_price, new.max_price), func.coalesce(new.max_price, PriceDaily.max_price)
+            ),
+            "observations": PriceDaily.observations + new.observations,
+            **{name: case((newer, new[name]), else_=getattr(PriceDaily, name)) for name in last},
+        },
+    )
+    names = ("item_id", "store_id", "day", "min_price", "max_price", "observations") + last
+    db.execute(stmt, [{name: row.get(name) for name in names} for row in rows])
+
+
+def run_retention(
+    db: Session,
+    keep_days: int = RAW_RETENTION_DAYS,
+    archive_dir: Path | str = ARCHIVE_DIR,
+    now: datetime | None = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Move price_history rows whose last observation is older than ``keep_days``
+    (cut at midnight) into the archive, one month at a time: write the month's
+    rows to ``<archive_dir>/price_history/month=YYYY-MM/``, fold them into
+    price_daily and delete them, then commit. The row latest_price points at is
+    never moved, since change-only storage may still extend it.
+    Returns counts per month.
+    """
+    now = now or datetime.utcnow()
+    cutoff = datetime.combine((now - timedelta(days=max(0, keep_days))).date(), datetime.min.time())
+    root = Path(archive_dir)
+    current = select(LatestPrice.price_history_id).where(LatestPrice.price_history_id.isnot(None))
+    candidates = (
+        db.query(PriceHistory)
+        .filter(func.coalesce(PriceHistory.last_seen_at, PriceHistory.captured_at) < cutoff)
+        .filter(PriceHistory.id.not_in(current))
+    )
+    stats: Dict[str, Any] = {"cutoff": cutoff, "months": {}, "rows": 0, "days": 0, "files": []}
+    if dry_run:
+        for month, n in (
+            candidates.with_entities(func.strftime("%Y-%m", PriceHistory.captured_at), func.count(PriceHistory.id))
+            .group_by(func.strftime("%Y-%m", PriceHistory.captured_at))
+        ):
+            stats["months"][month] = n
+            stats["rows"] += n
+        return stats
+
+    while True:
+        first = candidates.with_entities(func.min(PriceHistory.captured_at)).scalar()
+        if first is None:
+            break
+        month = _month(first)
+        in_month = candidates.filter(func.strftime("%Y-%m", PriceHistory.captured_at) == month)
+        rows = in_month.order_by(PriceHistory.id.asc()).all()
+        stats["files"].append(str(_write_month(root, month, rows)))
+        daily = _daily_rollup(rows)
+        _upsert_daily(db, daily)
+        in_month.filter(PriceHistory.id <= rows[-1].id).delete(synchronize_session=False)
+        db.commit()
+        db.expunge_all()
+        stats["months"][month] = len(rows)
+        stats["rows"] += len(rows)
+        stats["days"] += len(daily)
+    return stats
+
+
+def read_archive(
+    item_ids: List[int],
+    since: datetime | None = None,
+    archive_dir: Path | str = ARCHIVE_DIR,
+    discounts_only: bool = False,
+) -> List[Any]:
+    """
+    Archived price_history rows for ``item_ids`` (captured at or after ``since``),
+    as objects with the PriceHistory column attributes, oldest first. Only month
+    partitions from ``since`` onwards are opened. ``discounts_only`` keeps rows
+    with a discount_percent or was_price. Empty when nothing is archived.
+    """
+    folder = Path(archive_dir) / _ARCHIVE_TABLE
+    if not item_ids or not folder.is_dir():
+        return []
+    pa, ds, _ = _arrow()
+    dataset = ds.dataset(
+        folder,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive"),
+        exclude_invalid_files=True,
+    )
+    expr = ds.field("item_id").isin(list(item_ids))
+    if since is not None:
+        expr = expr & (ds.field("month") >= _month(since)) & (ds.field("captured_at") >= pa.scalar(since, pa.timestamp("us")))
+    if discounts_only:
+        expr = expr & (ds.field("discount_percent").is_valid() | ds.field("was_price").is_valid())
+    table = dataset.to_table(columns=_archive_schema(pa).names, filter=expr)
+    rows = [SimpleNamespace(**row) for row in table.to_pylist()]
+    rows.sort(key=lambda row: (row.captured_at, row.id))
+    return rows
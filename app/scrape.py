@@ -4,14 +4,23 @@ import asyncio
 import os
 import re
 import sys
-from collections import defaultdict
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import Any, DefaultDict, Dict, List
+from typing import Any, Dict, Iterable, List, Tuple
+from urllib.parse import urlsplit
 
 from playwright.sync_api import Error as PlaywrightError
 from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 from playwright.sync_api import sync_playwright
 
+from .artifacts import ArtifactWriter
+from .extract import HttpClient, extract_structured
+from .metrics import ScrapeMetrics
+from .pacing import AdaptivePacer
+from .session_state import SessionStateManager
+
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
@@ -22,11 +31,6 @@ DEBUG_DIR = Path(os.environ.get("PRICEWATCH_DEBUG_DIR", "scrape_debug"))
 DEBUG_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def _state_path(store_name: str) -> str:
-    return str(STATE_DIR / f"{store_name.lower()}.json")
-
-
-
 def _env_bool(name: str, default: bool) -> bool:
     value = os.environ.get(name)
     if value is None:
@@ -60,6 +64,124 @@ SELECTORS = {
     },
 }
 
+# How a product page is judged "ready": a price selector holds the same parseable text for
+# stable_ms (Coles can inject a placeholder price before the real one). network_idle additionally
+# waits for the pricing XHRs to settle first, capped at network_idle_ms.
+DEFAULT_READINESS = {
+    "stable_ms": 400,
+    "poll_ms": 100,
+    "timeout_ms": 15000,
+    "network_idle": False,
+    "network_idle_ms": 5000,
+}
+
+READINESS = {
+    "WOOLWORTHS": {},
+    "COLES": {
+        "stable_ms": 800,
+        "timeout_ms": 20000,
+    },
+    "ALDI": {},
+}
+
+# Requests aborted on scrape pages: we only read one price span, so images, fonts, media and
+# ad/analytics beacons are pure overhead. Per store, "enabled" is the safety switch (also
+# overridable via ScrapeSettings.resource_blocking), "allow_hosts" always wins and
+# "deny_hosts" extends BLOCKED_HOST_PATTERNS. Host patterns are substring matches.
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+
+BLOCKED_HOST_PATTERNS = (
+    "doubleclick.net",
+    "googlesyndication.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "facebook.net",
+    "facebook.com",
+    "hotjar.com",
+    "clarity.ms",
+    "bat.bing.com",
+    "nr-data.net",
+    "newrelic.com",
+    "demdex.net",
+    "omtrdc.net",
+    "adobedtm.com",
+    "criteo.com",
+    "tiktok.com",
+    "pinterest.com",
+    "quantummetric.com",
+)
+
+RESOURCE_BLOCKING = {
+    "WOOLWORTHS": {
+        "enabled": True,
+        "allow_hosts": [],
+        "deny_hosts": [],
+    },
+    "COLES": {
+        # Imperva/hCaptcha scripts and assets must load or Coles serves the security check.
+        "enabled": True,
+        "allow_hosts": ["incapsula", "imperva", "hcaptcha"],
+        "deny_hosts": [],
+    },
+    "ALDI": {
+        "enabled": True,
+        "allow_hosts": [],
+        "deny_hosts": [],
+    },
+}
+
+# Stores whose product pages are tried with a plain HTTP GET + structured-data parse
+# (app/extract.py) before a browser page. After HTTP_FIRST_MAX_MISSES misses in a row
+# (blocked, non-200, no embedded price) the store goes browser-only for the rest of the job.
+HTTP_FIRST = {
+    "WOOLWORTHS": True,
+    "COLES": True,
+    "ALDI": True,
+}
+HTTP_FIRST_MAX_MISSES = 3
+
+# Politeness per store: average requests per minute and how many may go back to back.
+# Every navigation and HTTP-first fetch takes a token, plus up to rate_jitter_ms of random
+# delay. The pacer halves a store's rate on a block and recovers it as pages succeed.
+# Overridable via ScrapeSettings.rate_limits / rate_jitter_ms.
+RATE_LIMITS = {
+    "WOOLWORTHS": {"per_minute": 30, "burst": 3},
+    "COLES": {"per_minute": 10, "burst": 1},
+    "ALDI": {"per_minute": 30, "burst": 3},
+}
+
+# Process engine: how many scrape processes (each with its own Playwright and
+# browser) and how work is split between them: "store" keeps a store on one
+# process (one warm context, one pacer), "url" spreads every store across all.
+DEFAULT_PROCESSES = max(1, min(4, (os.cpu_count() or 2) // 2))
+SHARD_MODES = ("store", "url")
+
+# Max pages open at once per store in the async engine (overridable via ScrapeSettings.store_concurrency).
+# Coles stays at one: Imperva is quick to challenge bursts from a single session.
+STORE_CONCURRENCY = {
+    "WOOLWORTHS": 3,
+    "COLES": 1,
+    "ALDI": 3,
+}
+
+# Storage state (cookies) is shared per store through SESSIONS. A session older than its
+# max age (time since its cookies last changed) is refreshed before the first product page:
+# a new context visits the store's home page so Imperva can rotate its cookies there,
+# instead of on a product page where a stale session gets challenged.
+SESSION_MAX_AGE_H = {
+    "COLES": 6,
+}
+SESSION_REFRESH_URLS = {
+    "WOOLWORTHS": "https://www.woolworths.com.au/",
+    "COLES": "https://www.coles.com.au/",
+    "ALDI": "https://www.aldi.com.au/",
+}
+
+SESSIONS = SessionStateManager(
+    STATE_DIR,
+    max_age_s={name: hours * 3600 for name, hours in SESSION_MAX_AGE_H.items()},
+)
+
 _PRICE_RE = re.compile(r"([0-9]+(?:\.[0-9]{1,2})?)")
 
 
@@ -75,6 +197,100 @@ def _parse_price(text: str) -> float | None:
         return None
 
 
+def _readiness(store_name: str) -> Dict[str, Any]:
+    cfg = dict(DEFAULT_READINESS)
+    cfg.update(READINESS.get(store_name) or {})
+    return cfg
+
+
+# Polled in-page by wait_for_function, so all candidate selectors race in one call instead of
+# a timeout per miss. Resolves with the first selector (in the given order) whose text parses
+# as a price and has not changed for stableMs, plus every selector that currently matches.
+# State lives on window so it resets on navigation.
+_READY_JS = """
+({ selectors, stableMs }) => {
+  const st = (window.__pricewatchReady = window.__pricewatchReady || {});
+  const now = performance.now();
+  const matched = [];
+  let first = null;
+  for (const sel of selectors) {
+    const el = document.querySelector(sel);
+    const text = el ? (el.innerText || el.textContent || "").trim() : "";
+    if (!/[0-9]+(\\.[0-9]{1,2})?/.test(text.replace(/,/g, ""))) continue;
+    matched.push(sel);
+    if (first === null) first = { selector: sel, text: text };
+  }
+  if (first === null) {
+    st.selector = null;
+    return null;
+  }
+  if (st.selector !== first.selector || st.text !== first.text) {
+    st.selector = first.selector;
+    st.text = first.text;
+    st.since = now;
+  }
+  return now - st.since >= stableMs ? { selector: first.selector, text: first.text, matched: matched } : null;
+}
+"""
+
+
+def _wait_until_ready(
+    page: Any, store_name: str, selectors: List[str], metrics: ScrapeMetrics | None = None
+) -> Dict[str, Any] | None:
+    """
+    Return {"selector", "text", "matched"} as soon as a stable, parseable price is in the DOM,
+    or None if none shows up within the store's readiness timeout.
+    ``metrics`` times the whole wait, network idle included, as "readiness" and the
+    selector race with its stability check inside it as "selector_match".
+    """
+    metrics = metrics or ScrapeMetrics()
+    cfg = _readiness(store_name)
+    with metrics.time("readiness", store_name):
+        if cfg["network_idle"]:
+            try:
+                page.wait_for_load_state("networkidle", timeout=cfg["network_idle_ms"])
+            except PlaywrightTimeoutError:
+                pass
+        with metrics.time("selector_match", store_name):
+            try:
+                handle = page.wait_for_function(_READY_JS, **_ready_wait_kwargs(cfg, selectors))
+            except PlaywrightTimeoutError:
+                return None
+            return handle.json_value()
+
+
+def _ready_wait_kwargs(cfg: Dict[str, Any], selectors: List[str]) -> Dict[str, Any]:
+    """wait_for_function() kwargs for _READY_JS under a store's readiness config."""
+    return {
+        "arg": {"selectors": selectors, "stableMs": cfg["stable_ms"]},
+        "timeout": cfg["timeout_ms"],
+        "polling": cfg["poll_ms"],
+    }
+
+
+def _should_block_request(store_name: str, resource_type: str, url: str) -> bool:
+    rules = RESOURCE_BLOCKING.get(store_name) or {}
+    host = (urlsplit(url).hostname or "").lower()
+    if any(pattern in host for pattern in rules.get("allow_hosts") or []):
+        return False
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    deny = list(BLOCKED_HOST_PATTERNS) + list(rules.get("deny_hosts") or [])
+    return any(pattern in host for pattern in deny)
+
+
+def _blocking_enabled(settings: Dict[str, Any], store_name: str) -> bool:
+    return bool(settings["resource_blocking"].get(store_name, False))
+
+
+def _count_response_bytes(stats: Dict[str, int], response: Any) -> None:
+    # Aborted requests never report a size, so we track what still gets downloaded instead.
+    try:
+        stats["bytes_received"] += int(response.headers.get("content-length") or 0)
+    except (TypeError, ValueError):
+        pass
+
+
 def _selector_list(value: Any) -> List[str]:
     if isinstance(value, list):
         return [v for v in value if isinstance(v, str) and v.strip()]
@@ -83,6 +299,83 @@ def _selector_list(value: Any) -> List[str]:
     return []
 
 
+class SelectorStats:
+    """
+    Hit/miss counts, a decayed recent-success score and mean match latency per
+    (store, selector). Loaded from and saved to the selector_stats table by the
+    job; selectors are tried in descending score order, ties keep SELECTORS order.
+    """
+
+    DECAY = 0.9
+
+    def __init__(self, rows: Iterable[Dict[str, Any]] = ()) -> None:
+        self._lock = threading.Lock()
+        self._rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for row in rows:
+            self._rows[(row["store"], row["selector"])] = dict(row)
+        self._loaded = {key: dict(row) for key, row in self._rows.items()}
+
+    def ordered(self, store_name: str, selectors: List[str]) -> List[str]:
+        with self._lock:
+            scores = {sel: (self._rows.get((store_name, sel)) or {}).get("score") or 0.0 for sel in selectors}
+        return sorted(selectors, key=lambda sel: -scores[sel])
+
+    def record(self, store_name: str, selectors: List[str], matched: List[str], match_ms: int | None) -> None:
+        now = datetime.utcnow()
+        with self._lock:
+            for sel in selectors:
+                row = self._rows.setdefault((store_name, sel), {
+                    "store": store_name,
+                    "selector": sel,
+                    "hits": 0,
+                    "misses": 0,
+                    "score": 0.0,
+                    "avg_match_ms": None,
+                    "last_hit_at": None,
+                })
+                hit = sel in matched
+                row["score"] = (row["score"] or 0.0) * self.DECAY + (1.0 if hit else 0.0)
+                if hit:
+                    row["hits"] += 1
+                    row["last_hit_at"] = now
+                    if match_ms is not None:
+                        prev = row["avg_match_ms"]
+                        row["avg_match_ms"] = float(match_ms) if prev is None else prev + (match_ms - prev) / row["hits"]
+                else:
+                    row["misses"] += 1
+                row["dirty"] = True
+
+    def merge(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        Folds in dirty rows from a copy that started from the same loaded rows
+        (e.g. a scrape process): counts add up, the score keeps the higher value.
+        """
+        with self._lock:
+            for row in rows:
+                key = (row["store"], row["selector"])
+                base = self._loaded.get(key) or {"hits": 0, "misses": 0}
+                cur = self._rows.get(key)
+                if cur is None:
+                    self._rows[key] = dict(row, dirty=True)
+                    continue
+                new_hits = row["hits"] - base["hits"]
+                if new_hits and row.get("avg_match_ms") is not None:
+                    prev, total = cur.get("avg_match_ms"), cur["hits"] + new_hits
+                    cur["avg_match_ms"] = row["avg_match_ms"] if prev is None else (
+                        prev * cur["hits"] + row["avg_match_ms"] * new_hits
+                    ) / total
+                cur["hits"] += new_hits
+                cur["misses"] += row["misses"] - base["misses"]
+                cur["score"] = max(cur.get("score") or 0.0, row.get("score") or 0.0)
+                if row.get("last_hit_at") and (cur.get("last_hit_at") is None or row["last_hit_at"] > cur["last_hit_at"]):
+                    cur["last_hit_at"] = row["last_hit_at"]
+                cur["dirty"] = True
+
+    def rows(self, dirty_only: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self._rows.values() if row.get("dirty") or not dirty_only]
+
+
 def _close_quietly(resource: Any) -> None:
     try:
         resource.close()
@@ -90,32 +383,225 @@ def _close_quietly(resource: Any) -> None:
         pass
 
 
-def _looks_like_imperva_challenge(page: Any) -> bool:
+def _imperva_markers(content: str, url: str, title: str) -> bool:
+    content = (content or "").lower()
+    url = (url or "").lower()
+    title = (title or "").lower()
+    if "additional security check" in content:
+        return True
+    if "hcaptcha" in content:
+        return True
+    if "imperva" in content:
+        return True
+    if "security check" in title:
+        return True
+    if "secure.coles.com.au" in url and "enable javascript" in content:
+        return True
+    return False
+
+
+# Cheap in-page probe: a handful of querySelector calls instead of serialising the whole DOM.
+_CHALLENGE_PROBE_JS = """
+() => ({
+  challengeFrame: !!document.querySelector(
+    'iframe[src*="hcaptcha"], iframe[src*="_Incapsula_Resource"], iframe#main-iframe, .h-captcha, [data-hcaptcha-widget-id]'
+  ),
+  productData: !!document.querySelector('#__NEXT_DATA__, [data-testid="pricing"], script[type="application/ld+json"]'),
+})
+"""
+
+_CHALLENGE_TITLES = ("security check", "access denied", "pardon our interruption")
+
+
+def _classify_challenge(
+    status: int | None,
+    headers: Dict[str, str] | None,
+    url: str,
+    title: str,
+    probe: Dict[str, Any] | None,
+) -> bool | None:
+    """
+    Decide from cheap signals whether a navigation landed on the Imperva challenge.
+    Returns True (challenge), False (product page) or None when the signals are ambiguous.
+    """
+    url = (url or "").lower()
+    title = (title or "").lower()
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    probe = probe or {}
+    if "_incapsula_resource" in url:
+        return True
+    if any(marker in title for marker in _CHALLENGE_TITLES):
+        return True
+    if probe.get("challengeFrame"):
+        return True
+    imperva_edge = "x-iinfo" in headers or "imperva" in (headers.get("x-cdn") or "").lower()
+    if status in (403, 429) and imperva_edge:
+        return True
+    if status == 200 and probe.get("productData"):
+        return False
+    return None
+
+
+def _looks_like_imperva_challenge(page: Any, response: Any = None, mode: str = "cheap") -> bool:
+    """
+    mode "cheap": navigation status/headers, URL, title and a tiny evaluate probe;
+    the full HTML is only read when those are ambiguous. mode "full": always scan the HTML.
+    """
     try:
-        content = (page.content() or "").lower()
-        url = (page.url or "").lower()
-        title = (page.title() or "").lower()
-        if "additional security check" in content:
-            return True
-        if "hcaptcha" in content:
-            return True
-        if "imperva" in content:
-            return True
-        if "security check" in title:
-            return True
-        if "secure.coles.com.au" in url and "enable javascript" in content:
-            return True
+        if mode != "full":
+            verdict = _classify_response(response, page.url, page.title(), page.evaluate(_CHALLENGE_PROBE_JS))
+            if verdict is not None:
+                return verdict
+        return _imperva_markers(page.content(), page.url, page.title())
     except Exception:
         return False
-    return False
 
 
-def _launch_browser(playwright: Any, *, headful: bool, slowmo_ms: int):
+def _classify_response(response: Any, url: str, title: str, probe: Dict[str, Any] | None) -> bool | None:
+    """_classify_challenge() for a Playwright navigation response (sync or async; both expose status/headers)."""
+    return _classify_challenge(
+        response.status if response is not None else None,
+        response.headers if response is not None else None,
+        url,
+        title,
+        probe,
+    )
+
+
+def _empty_price_data(url: str) -> Dict[str, Any]:
+    return {
+        "price": None,
+        "was_price": None,
+        "unit_price": None,
+        "promo_text": None,
+        "discount_percent": None,
+        "url": url,
+        "source": None,
+    }
+
+
+def _apply_discount(data: Dict[str, Any]) -> None:
+    if (
+        data.get("price") is not None
+        and data.get("was_price") is not None
+        and data["was_price"] > 0
+    ):
+        data["discount_percent"] = round(
+            (data["was_price"] - data["price"]) / data["was_price"] * 100.0,
+            1,
+        )
+
+
+BLOCKED_PROMO = "[blocked: imperva_security_check]"
+
+
+# The helpers below hold the per-page decisions shared by scrape_url() and
+# scrape_async.scrape_url_async(); ``pool`` is a BrowserPool or an AsyncBrowserPool,
+# and the two scrape functions only add the page I/O around them.
+
+
+def _price_selectors(store_name: str) -> List[str]:
+    """The store's configured price selectors; empty when it has none (nothing to scrape)."""
+    return _selector_list(SELECTORS.get(store_name, {}).get("price"))
+
+
+def _start_browser_result(url: str) -> Dict[str, Any]:
+    data = _empty_price_data(url)
+    data["source"] = "browser"
+    return data
+
+
+def _mark_blocked(pool: Any, store_name: str, data: Dict[str, Any]) -> None:
+    pool.pacer.record(store_name, "blocked")
+    pool.metrics.inc("blocks", store_name)
+    data.update(price=None, was_price=None, unit_price=None, discount_percent=None, promo_text=BLOCKED_PROMO)
+
+
+def _accept_ready(
+    pool: Any,
+    store_name: str,
+    data: Dict[str, Any],
+    price_selectors: List[str],
+    ready: Dict[str, Any] | None,
+    started: float,
+) -> str | None:
+    """Price text from a readiness result, recording the hit; None when it did not parse."""
+    if not ready or _parse_price(ready.get("text") or "") is None:
+        return None
+    data["ready_ms"] = int((time.perf_counter() - started) * 1000)
+    pool.selector_stats.record(store_name, price_selectors, ready.get("matched") or [ready["selector"]], data["ready_ms"])
+    pool.pacer.record(store_name, "ok")
+    return ready["text"]
+
+
+def _no_match(pool: Any, store_name: str, price_selectors: List[str]) -> Exception:
+    pool.selector_stats.record(store_name, price_selectors, [], None)
+    return Exception(f"No elements matched selectors: {price_selectors}")
+
+
+def _extra_selectors(store_name: str) -> Tuple[str | None, str | None]:
+    """(was_price, promo_text) selectors read once a price is found."""
+    sel = SELECTORS.get(store_name, {})
+    return sel.get("was_price"), sel.get("promo_text")
+
+
+def _finish_result(
+    pool: Any,
+    store_name: str,
+    data: Dict[str, Any],
+    price_text: str | None,
+    was_text: str | None,
+    promo_text: str | None,
+    parse_started: float,
+) -> None:
+    if price_text is not None:
+        data["price"] = _parse_price(price_text)
+    if was_text is not None:
+        data["was_price"] = _parse_price(was_text)
+    if promo_text is not None:
+        data["promo_text"] = promo_text
+    _apply_discount(data)
+    pool.metrics.observe("parse", store_name, time.perf_counter() - parse_started)
+    pool.metrics.inc("pages", store_name)
+    if price_text is not None:
+        data["promo_text"] = (data.get("promo_text") or "") or None
+
+
+def _mark_failed(pool: Any, store_name: str, data: Dict[str, Any], exc: BaseException) -> None:
+    pool.pacer.record(store_name, "error")
+    # playwright.async_api re-exports the same TimeoutError class.
+    if isinstance(exc, PlaywrightTimeoutError):
+        pool.metrics.inc("timeouts", store_name)
+        data["promo_text"] = (data.get("promo_text") or "") + " [timeout]"
+    else:
+        pool.metrics.inc("errors", store_name)
+        data["promo_text"] = (data.get("promo_text") or "") + f" [error: {type(exc).__name__}]"
+
+
+def _context_kwargs(store_name: str) -> Tuple[Dict[str, Any], int]:
+    """new_context() kwargs for a store, and the SESSIONS version its storage state came from."""
+    ctx_kwargs: Dict[str, Any] = {}
+    state, version = SESSIONS.checkout(store_name)
+    if state is not None:
+        ctx_kwargs["storage_state"] = state
+
+    lat = float(os.environ.get("PRICEWATCH_GEO_LAT", "-37.8136"))
+    lon = float(os.environ.get("PRICEWATCH_GEO_LON", "144.9631"))
+    ctx_kwargs["geolocation"] = {"latitude": lat, "longitude": lon}
+    return ctx_kwargs, version
+
+
+def _launch_options(headful: bool, slowmo_ms: int) -> Tuple[Dict[str, Any], str]:
+    """chromium.launch() kwargs and the preferred browser channel ("" for bundled Chromium)."""
     launch_kwargs = {
         "headless": not headful,
         "slow_mo": slowmo_ms if headful else 0,
     }
-    preferred_channel = os.environ.get("PRICEWATCH_BROWSER_CHANNEL", "msedge").strip()
+    return launch_kwargs, os.environ.get("PRICEWATCH_BROWSER_CHANNEL", "msedge").strip()
+
+
+def _launch_browser(playwright: Any, *, headful: bool, slowmo_ms: int):
+    launch_kwargs, preferred_channel = _launch_options(headful, slowmo_ms)
     if preferred_channel:
         try:
             return playwright.chromium.launch(channel=preferred_channel, **launch_kwargs)
@@ -124,185 +610,425 @@ def _launch_browser(playwright: Any, *, headful: bool, slowmo_ms: int):
     return playwright.chromium.launch(**launch_kwargs)
 
 
-def scrape_item_prices(store_links: List[Any], settings: Dict[str, Any] | None = None) -> Dict[str, Dict[str, Any]]:
-    """
-    store_links: list of StoreLink rows (must have .store.name and .url)
-    Returns: {STORE_NAME: {"price": float, "was_price": float|None, ...}}
-    """
-    results: Dict[str, Dict[str, Any]] = {}
-    by_store: DefaultDict[str, List[Any]] = defaultdict(list)
-    for sl in store_links:
-        if sl.url:
-            by_store[sl.store.name].append(sl)
-
+def _resolve_settings(settings: Dict[str, Any] | None) -> Dict[str, Any]:
     settings = settings or {}
     env_headful = _env_bool("PRICEWATCH_HEADFUL", False)
     env_slowmo_ms = _env_int("PRICEWATCH_SLOWMO_MS", 0)
-    headful = bool(settings.get("headful", env_headful))
+    env_max_pages = _env_int("PRICEWATCH_CONTEXT_MAX_PAGES", 50)
     try:
         slowmo_ms = max(0, int(settings.get("slowmo_ms", env_slowmo_ms) or 0))
     except (TypeError, ValueError):
         slowmo_ms = env_slowmo_ms
-    debug_capture_enabled = bool(settings.get("debug_capture_enabled", _env_bool("PRICEWATCH_DEBUG_CAPTURE", True)))
-    save_storage_state = bool(settings.get("save_storage_state", _env_bool("PRICEWATCH_SAVE_STATE", True)))
+    try:
+        context_max_pages = max(1, int(settings.get("context_max_pages", env_max_pages) or env_max_pages))
+    except (TypeError, ValueError):
+        context_max_pages = max(1, env_max_pages)
+    resource_blocking = {name: bool(rules.get("enabled")) for name, rules in RESOURCE_BLOCKING.items()}
+    if not _env_bool("PRICEWATCH_BLOCK_RESOURCES", True):
+        resource_blocking = {name: False for name in resource_blocking}
+    for store_name, enabled in (settings.get("resource_blocking") or {}).items():
+        resource_blocking[str(store_name).upper()] = bool(enabled)
+    rate_limits = {name: dict(cfg) for name, cfg in RATE_LIMITS.items()}
+    for store_name, cfg in (settings.get("rate_limits") or {}).items():
+        if isinstance(cfg, dict):
+            rate_limits.setdefault(str(store_name).upper(), {}).update(cfg)
+    try:
+        rate_jitter_ms = max(0, int(settings.get("rate_jitter_ms", _env_int("PRICEWATCH_RATE_JITTER_MS", 750))))
+    except (TypeError, ValueError):
+        rate_jitter_ms = 750
+    try:
+        debug_sample_rate = float(settings.get("debug_sample_rate", os.environ.get("PRICEWATCH_DEBUG_SAMPLE_RATE", 0.2)))
+    except (TypeError, ValueError):
+        debug_sample_rate = 0.2
+    try:
+        debug_max_mb = max(1, int(settings.get("debug_max_mb", _env_int("PRICEWATCH_DEBUG_MAX_MB", 200))))
+    except (TypeError, ValueError):
+        debug_max_mb = 200
+    try:
+        processes = max(1, int(settings.get("processes") or _env_int("PRICEWATCH_PROCESSES", DEFAULT_PROCESSES)))
+    except (TypeError, ValueError):
+        processes = DEFAULT_PROCESSES
+    shard_by = str(settings.get("shard_by") or os.environ.get("PRICEWATCH_SHARD_BY", "store")).strip().lower()
+    store_concurrency = dict(STORE_CONCURRENCY)
+    for store_name, limit in (settings.get("store_concurrency") or {}).items():
+        try:
+            store_concurrency[str(store_name).upper()] = max(1, int(limit))
+        except (TypeError, ValueError):
+            continue
+    return {
+        "headful": bool(settings.get("headful", env_headful)),
+        "slowmo_ms": slowmo_ms,
+        "debug_capture_enabled": bool(settings.get("debug_capture_enabled", _env_bool("PRICEWATCH_DEBUG_CAPTURE", True))),
+        "debug_sample_rate": debug_sample_rate,
+        "debug_max_mb": debug_max_mb,
+        "debug_screenshots": bool(settings.get("debug_screenshots", _env_bool("PRICEWATCH_DEBUG_SCREENSHOTS", True))),
+        "save_storage_state": bool(settings.get("save_storage_state", _env_bool("PRICEWATCH_SAVE_STATE", True))),
+        "context_max_pages": context_max_pages,
+        "engine": str(settings.get("engine") or os.environ.get("PRICEWATCH_SCRAPE_ENGINE", "sync")).strip().lower(),
+        "store_concurrency": store_concurrency,
+        "processes": processes,
+        "shard_by": shard_by if shard_by in SHARD_MODES else "store",
+        "resource_blocking": resource_blocking,
+        "http_first": bool(settings.get("http_first", _env_bool("PRICEWATCH_HTTP_FIRST", True))),
+        "rate_limits": rate_limits,
+        "rate_jitter_ms": rate_jitter_ms,
+        "challenge_detection": str(
+            settings.get("challenge_detection") or os.environ.get("PRICEWATCH_CHALLENGE_DETECTION", "cheap")
+        ).strip().lower(),
+    }
+
+
+def _artifact_writer(settings: Dict[str, Any], stats: Dict[str, int]) -> ArtifactWriter:
+    return ArtifactWriter(
+        DEBUG_DIR,
+        max_bytes=settings["debug_max_mb"] * 1024 * 1024,
+        sample_rate=settings["debug_sample_rate"],
+        screenshots=settings["debug_screenshots"],
+        stats=stats,
+    )
+
+
+def _is_target_closed(exc: BaseException) -> bool:
+    return "Target page, context or browser has been closed" in str(exc)
+
+
+class BrowserPool:
+    """
+    One Playwright browser held for the lifetime of a scrape job, with a warm
+    context per store that is reused across items.
 
-    with sync_playwright() as p:
-        # NOTE: Coles tends to behave differently in bundled headless Chromium vs a real installed browser.
-        # Using the installed Edge channel on Windows usually matches "debug headful" behaviour much better.
-        browser = _launch_browser(p, headful=headful, slowmo_ms=slowmo_ms)
+    A store's context is recycled (storage state handed back to SESSIONS,
+    context closed) after
+    ``context_max_pages`` pages, or thrown away when it crashes. The browser is
+    relaunched if it disconnects. Sync Playwright objects are bound to the
+    thread that created them, so a pool must stay on one thread.
+    """
+
+    def __init__(
+        self,
+        settings: Dict[str, Any] | None = None,
+        selector_stats: SelectorStats | None = None,
+        job_id: int | None = None,
+        metrics: ScrapeMetrics | None = None,
+    ) -> None:
+        self.settings = _resolve_settings(settings)
+        self.job_id = job_id
+        self.selector_stats = selector_stats or SelectorStats()
+        self.metrics = metrics or ScrapeMetrics()
+        self.pacer = AdaptivePacer(self.settings["rate_limits"], self.settings["rate_jitter_ms"])
+        self._playwright: Any = None
+        self._browser: Any = None
+        self._contexts: Dict[str, Any] = {}
+        self._pages_used: Dict[str, int] = {}
+        # SESSIONS version each store's context was opened from.
+        self._session_versions: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {
+            "browser_launches": 0,
+            "contexts_created": 0,
+            "context_recycles": 0,
+            "pages_opened": 0,
+            "requests_blocked": 0,
+            "requests_allowed": 0,
+            "bytes_received": 0,
+            "http_hits": 0,
+            "http_misses": 0,
+            "session_refreshes": 0,
+        }
+        self.http = HttpClient()
+        self.http_misses: Dict[str, int] = {}
+        self.artifacts = _artifact_writer(self.settings, self.stats)
+
+    def __enter__(self) -> "BrowserPool":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
 
-        for store_name, links in by_store.items():
-            ctx_kwargs: Dict[str, Any] = {}
-            sp = _state_path(store_name)
-            if Path(sp).exists():
-                ctx_kwargs["storage_state"] = sp
+    def start(self) -> None:
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
 
-            lat = float(os.environ.get("PRICEWATCH_GEO_LAT", "-37.8136"))
-            lon = float(os.environ.get("PRICEWATCH_GEO_LON", "144.9631"))
-            ctx_kwargs["geolocation"] = {"latitude": lat, "longitude": lon}
+    def browser(self) -> Any:
+        self.start()
+        if self._browser is not None and not self._browser.is_connected():
+            # Contexts die with their browser; drop them without saving state.
+            for store_name in list(self._contexts):
+                self.recycle(store_name, crashed=True)
+            self._browser = None
+        if self._browser is None:
+            # NOTE: Coles tends to behave differently in bundled headless Chromium vs a real installed browser.
+            # Using the installed Edge channel on Windows usually matches "debug headful" behaviour much better.
+            with self.metrics.time("browser_launch", "all"):
+                self._browser = _launch_browser(
+                    self._playwright,
+                    headful=self.settings["headful"],
+                    slowmo_ms=self.settings["slowmo_ms"],
+                )
+            self.stats["browser_launches"] += 1
+        return self._browser
 
-            context = browser.new_context(**ctx_kwargs)
+    def context(self, store_name: str) -> Any:
+        context = self._contexts.get(store_name)
+        if context is not None and self._pages_used.get(store_name, 0) >= self.settings["context_max_pages"]:
+            self.recycle(store_name)
+            context = None
+        if context is None:
+            self.browser()
+            with self.metrics.time("context_create", store_name):
+                context = self._new_context(store_name)
+        return context
 
+    def new_page(self, store_name: str) -> Any:
+        try:
+            page = self.context(store_name).new_page()
+        except PlaywrightError as e:
+            if not _is_target_closed(e):
+                raise
+            self.recycle(store_name, crashed=True)
+            page = self.context(store_name).new_page()
+        self._pages_used[store_name] = self._pages_used.get(store_name, 0) + 1
+        self.stats["pages_opened"] += 1
+        return page
+
+    def recycle(self, store_name: str, *, crashed: bool = False) -> None:
+        context = self._contexts.pop(store_name, None)
+        self._pages_used.pop(store_name, None)
+        opened_from = self._session_versions.pop(store_name, None)
+        if context is None:
+            return
+        if not crashed:
             try:
-                if store_name == "COLES":
-                    context.grant_permissions(["geolocation"], origin="https://www.coles.com.au")
+                SESSIONS.update(
+                    store_name,
+                    context.storage_state(),
+                    persist=self.settings["save_storage_state"],
+                    opened_from=opened_from,
+                )
             except Exception:
                 pass
+        _close_quietly(context)
+        self.stats["context_recycles"] += 1
 
-            for sl in links:
-                url = (sl.url or "").strip()
-                if not url:
-                    continue
+    def close(self) -> None:
+        for store_name in list(self._contexts):
+            self.recycle(store_name)
+        if self._browser is not None:
+            _close_quietly(self._browser)
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+        self.http.close()
+        self.artifacts.close()
 
-                sel = SELECTORS.get(store_name, {})
-                price_selectors = _selector_list(sel.get("price"))
-                if not price_selectors:
-                    continue
+    def _new_context(self, store_name: str) -> Any:
+        ctx_kwargs, version = _context_kwargs(store_name)
+        context = self.browser().new_context(**ctx_kwargs)
+
+        try:
+            if store_name == "COLES":
+                context.grant_permissions(["geolocation"], origin="https://www.coles.com.au")
+        except Exception:
+            pass
+
+        stats = self.stats
+        context.on("response", lambda response: _count_response_bytes(stats, response))
+        if _blocking_enabled(self.settings, store_name):
+
+            def _route(route: Any) -> None:
+                request = route.request
+                if _should_block_request(store_name, request.resource_type, request.url):
+                    stats["requests_blocked"] += 1
+                    route.abort()
+                else:
+                    stats["requests_allowed"] += 1
+                    route.continue_()
+
+            context.route("**/*", _route)
+
+        if SESSIONS.is_stale(store_name) and self._refresh_session(store_name, context):
+            version = SESSIONS.version(store_name)
+
+        self._contexts[store_name] = context
+        self._session_versions[store_name] = version
+        self._pages_used[store_name] = 0
+        self.stats["contexts_created"] += 1
+        return context
+
+    def _refresh_session(self, store_name: str, context: Any) -> bool:
+        """Visit the store's home page in ``context`` and store the rotated session. True when stored."""
+        url = SESSION_REFRESH_URLS.get(store_name)
+        if not url:
+            return False
+        page = context.new_page()
+        try:
+            self.pacer.wait(store_name)
+            with self.metrics.time("session_refresh", store_name):
+                page.goto(url, wait_until="domcontentloaded", timeout=45000)
+            SESSIONS.update(store_name, context.storage_state(), persist=self.settings["save_storage_state"], force=True)
+            self.stats["session_refreshes"] += 1
+            return True
+        except Exception:
+            return False
+        finally:
+            _close_quietly(page)
 
-                page = context.new_page()
-                data: Dict[str, Any] = {
-                    "price": None,
-                    "was_price": None,
-                    "unit_price": None,
-                    "promo_text": None,
-                    "discount_percent": None,
-                    "url": url,
-                }
-                try:
-                    # Coles (and some SPA flows) can "half render": selector appears before final price is injected.
-                    # Retry a few times with increasing waits to mirror debug/slow-mo behaviour.
-                    price_text = None
-                    matched_selector = None
-                    for attempt in range(3):
-                        try:
-                            page.goto(url, wait_until="domcontentloaded", timeout=45000)
-                        except PlaywrightError as e:
-                            if "Target page, context or browser has been closed" not in str(e):
-                                raise
-                            _close_quietly(page)
-                            page = context.new_page()
-                            page.goto(url, wait_until="domcontentloaded", timeout=45000)
-
-                        if store_name == "COLES" and _looks_like_imperva_challenge(page):
-                            if debug_capture_enabled:
-                                page.screenshot(path=str(DEBUG_DIR / "coles_imperva_blocked.png"), full_page=True)
-                                (DEBUG_DIR / "coles_imperva_blocked.html").write_text(page.content(), encoding="utf-8")
-                            data["price"] = None
-                            data["was_price"] = None
-                            data["unit_price"] = None
-                            data["discount_percent"] = None
-                            data["promo_text"] = "[blocked: imperva_security_check]"
-                            price_text = None
-                            break
-
-                        page.wait_for_timeout(2500 + attempt * 1000)
-
-                        for price_sel in price_selectors:
-                            try:
-                                page.wait_for_selector(price_sel, timeout=15000)
-                            except PlaywrightTimeoutError:
-                                continue
-
-                            if page.locator(price_sel).count() <= 0:
-                                continue
-
-                            txt = page.locator(price_sel).first.inner_text().strip()
-                            parsed = _parse_price(txt)
-                            if parsed is not None:
-                                price_text = txt
-                                matched_selector = price_sel
-                                break
-
-                        if price_text:
-                            break
-
-                    if data.get("promo_text") == "[blocked: imperva_security_check]":
-                        pass
-                    elif price_text is None:
-                        if store_name == "COLES" and debug_capture_enabled:
-                            page.screenshot(path=str(DEBUG_DIR / "coles_no_match.png"), full_page=True)
-                            (DEBUG_DIR / "coles_no_match.html").write_text(page.content(), encoding="utf-8")
-                        raise Exception(f"No elements matched selectors: {price_selectors}")
-
-                    if price_text is not None:
-                        data["price"] = _parse_price(price_text)
-
-                    was_sel = sel.get("was_price")
-                    if was_sel:
-                        try:
-                            was_text = page.locator(was_sel).first.inner_text().strip()
-                            data["was_price"] = _parse_price(was_text)
-                        except Exception:
-                            pass
-
-                    promo_sel = sel.get("promo_text")
-                    if promo_sel:
-                        try:
-                            data["promo_text"] = page.locator(promo_sel).first.inner_text().strip()
-                        except Exception:
-                            pass
-
-                    if (
-                        data.get("price") is not None
-                        and data.get("was_price") is not None
-                        and data["was_price"] > 0
-                    ):
-                        data["discount_percent"] = round(
-                            (data["was_price"] - data["price"]) / data["was_price"] * 100.0,
-                            1,
-                        )
-
-                    if matched_selector:
-                        data["promo_text"] = (data.get("promo_text") or "") or None
-
-                except PlaywrightTimeoutError:
-                    if debug_capture_enabled:
-                        try:
-                            page.screenshot(path=str(DEBUG_DIR / f"{store_name.lower()}_error.png"), full_page=True)
-                            (DEBUG_DIR / f"{store_name.lower()}_error.html").write_text(page.content(), encoding="utf-8")
-                        except Exception:
-                            pass
-                    data["promo_text"] = (data.get("promo_text") or "") + " [timeout]"
-                except Exception as e:
-                    if debug_capture_enabled:
-                        try:
-                            page.screenshot(path=str(DEBUG_DIR / f"{store_name.lower()}_error.png"), full_page=True)
-                            (DEBUG_DIR / f"{store_name.lower()}_error.html").write_text(page.content(), encoding="utf-8")
-                        except Exception:
-                            pass
-                    data["promo_text"] = (data.get("promo_text") or "") + f" [error: {type(e).__name__}]"
-                finally:
-                    _close_quietly(page)
-
-                results[store_name] = data
-
-            if save_storage_state:
-                try:
-                    context.storage_state(path=sp)
-                except Exception:
-                    pass
-            _close_quietly(context)
-
-        _close_quietly(browser)
 
+def _try_http_first(pool: Any, store_name: str, url: str) -> Dict[str, Any] | None:
+    """
+    Fetch the page over keep-alive HTTP and parse embedded structured data.
+    Returns a complete price dict (source "http"), or None to fall back to the browser.
+    Works with both BrowserPool and the async pool (called from a worker thread there).
+    """
+    if not pool.settings["http_first"] or not HTTP_FIRST.get(store_name):
+        return None
+    if pool.http_misses.get(store_name, 0) >= HTTP_FIRST_MAX_MISSES:
+        return None
+
+    found = None
+    pool.pacer.wait(store_name)
+    try:
+        with pool.metrics.time("http_fetch", store_name):
+            status, final_url, html = pool.http.get(url)
+        if status == 429:
+            pool.pacer.record(store_name, "blocked")
+            pool.metrics.inc("blocks", store_name)
+        elif status == 200 and not _imperva_markers(html, final_url, ""):
+            with pool.metrics.time("parse", store_name):
+                found = extract_structured(store_name, html, url)
+    except Exception:
+        found = None
+
+    if found is None:
+        pool.http_misses[store_name] = pool.http_misses.get(store_name, 0) + 1
+        pool.stats["http_misses"] += 1
+        return None
+    pool.http_misses[store_name] = 0
+    pool.stats["http_hits"] += 1
+    pool.metrics.inc("http_hits", store_name)
+    pool.metrics.inc("pages", store_name)
+
+    data = _empty_price_data(url)
+    data.update({k: v for k, v in found.items() if k in data})
+    data["source"] = "http"
+    _apply_discount(data)
+    return data
+
+
+def _locator_text(page: Any, selector: str | None) -> str | None:
+    if not selector:
+        return None
+    try:
+        return page.locator(selector).first.inner_text().strip()
+    except Exception:
+        return None
+
+
+def scrape_url(pool: BrowserPool, store_name: str, url: str, key: Any = None) -> Dict[str, Any] | None:
+    """
+    Scrape one product page: structured data over HTTP when possible,
+    otherwise a page in a warm context from ``pool``. ``key`` (e.g. the item id)
+    names debug artifacts. Returns the price dict, or None when the store has no price selector.
+    """
+    price_selectors = _price_selectors(store_name)
+    if not price_selectors:
+        return None
+
+    data = _try_http_first(pool, store_name, url)
+    if data is not None:
+        return data
+
+    price_selectors = pool.selector_stats.ordered(store_name, price_selectors)
+    debug_capture_enabled = pool.settings["debug_capture_enabled"]
+    page = pool.new_page(store_name)
+    data = _start_browser_result(url)
+    attempt = 0
+    failure = "error"
+
+    def capture(reason: str) -> None:
+        if debug_capture_enabled:
+            pool.artifacts.capture(page, store_name, reason, job_id=pool.job_id, key=key, attempt=attempt)
+
+    try:
+        # Coles (and some SPA flows) can "half render": selector appears before final price is injected.
+        # Readiness waits for a stable price; a page that never settles is reloaded up to twice.
+        price_text = None
+        started = time.perf_counter()
+        for attempt in range(3):
+            if attempt:
+                pool.metrics.inc("retries", store_name)
+            pool.pacer.wait(store_name)
+            try:
+                with pool.metrics.time("goto", store_name):
+                    response = page.goto(url, wait_until="domcontentloaded", timeout=45000)
+            except PlaywrightError as e:
+                if not _is_target_closed(e):
+                    raise
+                _close_quietly(page)
+                pool.recycle(store_name, crashed=True)
+                page = pool.new_page(store_name)
+                with pool.metrics.time("goto", store_name):
+                    response = page.goto(url, wait_until="domcontentloaded", timeout=45000)
+
+            if store_name == "COLES" and _looks_like_imperva_challenge(page, response, pool.settings["challenge_detection"]):
+                _mark_blocked(pool, store_name, data)
+                capture("blocked")
+                break
+
+            ready = _wait_until_ready(page, store_name, price_selectors, pool.metrics)
+            price_text = _accept_ready(pool, store_name, data, price_selectors, ready, started)
+            if price_text:
+                break
+
+        if price_text is None and data["promo_text"] != BLOCKED_PROMO:
+            failure = "no_match"
+            raise _no_match(pool, store_name, price_selectors)
+
+        parse_started = time.perf_counter()
+        was_sel, promo_sel = _extra_selectors(store_name)
+        _finish_result(
+            pool,
+            store_name,
+            data,
+            price_text,
+            _locator_text(page, was_sel),
+            _locator_text(page, promo_sel),
+            parse_started,
+        )
+
+    except Exception as e:
+        _mark_failed(pool, store_name, data, e)
+        capture("timeout" if isinstance(e, PlaywrightTimeoutError) else failure)
+    finally:
+        _close_quietly(page)
+
+    return data
+
+
+def scrape_item_prices(
+    store_links: List[Any],
+    settings: Dict[str, Any] | None = None,
+    pool: BrowserPool | None = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    store_links: list of StoreLink rows (must have .store.name and .url)
+    pool: job-scoped BrowserPool; when omitted a browser is launched for this call only
+    Returns: {STORE_NAME: {"price": float, "was_price": float|None, ...}}
+    """
+    if pool is None:
+        with BrowserPool(settings) as own_pool:
+            return scrape_item_prices(store_links, pool=own_pool)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for sl in store_links:
+        url = (sl.url or "").strip()
+        if not url:
+            continue
+        data = scrape_url(pool, sl.store.name, url, getattr(sl, "item_id", None))
+        if data is not None:
+            results[sl.store.name] = data
     return results
@@ -0,0 +1,434 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import async_playwright
+
+from .extract import HttpClient
+from .metrics import ScrapeMetrics
+from .pacing import AdaptivePacer
+from .scrape import (
+    BLOCKED_PROMO,
+    SESSION_REFRESH_URLS,
+    SESSIONS,
+    SelectorStats,
+    _READY_JS,
+    _accept_ready,
+    _artifact_writer,
+    _blocking_enabled,
+    _count_response_bytes,
+    _context_kwargs,
+    _empty_price_data,
+    _extra_selectors,
+    _finish_result,
+    _CHALLENGE_PROBE_JS,
+    _classify_response,
+    _imperva_markers,
+    _is_target_closed,
+    _launch_options,
+    _mark_blocked,
+    _mark_failed,
+    _no_match,
+    _price_selectors,
+    _readiness,
+    _ready_wait_kwargs,
+    _resolve_settings,
+    _should_block_request,
+    _start_browser_result,
+    _try_http_first,
+)
+
+# (store_name, url, key) -> on_result(key, store_name, data)
+WorkItem = Tuple[str, str, Any]
+ResultCallback = Callable[[Any, str, Dict[str, Any]], None]
+
+
+async def _close_quietly(resource: Any) -> None:
+    try:
+        await resource.close()
+    except Exception:
+        pass
+
+
+async def _launch_browser(playwright: Any, *, headful: bool, slowmo_ms: int):
+    launch_kwargs, preferred_channel = _launch_options(headful, slowmo_ms)
+    if preferred_channel:
+        try:
+            return await playwright.chromium.launch(channel=preferred_channel, **launch_kwargs)
+        except Exception:
+            pass
+    return await playwright.chromium.launch(**launch_kwargs)
+
+
+class _StoreContext:
+    def __init__(self, context: Any, session_version: int) -> None:
+        self.context = context
+        # SESSIONS version the context's storage state came from.
+        self.session_version = session_version
+        self.pages_used = 0
+        self.open_pages = 0
+        self.retired = False
+
+
+class AsyncBrowserPool:
+    """
+    Async counterpart of scrape.BrowserPool. Several pages of the same store
+    share one context; when a context reaches ``context_max_pages`` it is
+    retired (no new pages) and closed once its last open page finishes.
+    """
+
+    def __init__(
+        self,
+        settings: Dict[str, Any] | None = None,
+        selector_stats: SelectorStats | None = None,
+        job_id: int | None = None,
+        metrics: ScrapeMetrics | None = None,
+    ) -> None:
+        self.settings = _resolve_settings(settings)
+        self.job_id = job_id
+        self.selector_stats = selector_stats or SelectorStats()
+        self.metrics = metrics or ScrapeMetrics()
+        self.pacer = AdaptivePacer(self.settings["rate_limits"], self.settings["rate_jitter_ms"])
+        self._playwright_cm: Any = None
+        self._playwright: Any = None
+        self._browser: Any = None
+        self._contexts: Dict[str, _StoreContext] = {}
+        self._lock = asyncio.Lock()
+        self.stats: Dict[str, int] = {
+            "browser_launches": 0,
+            "contexts_created": 0,
+            "context_recycles": 0,
+            "pages_opened": 0,
+            "requests_blocked": 0,
+            "requests_allowed": 0,
+            "bytes_received": 0,
+            "http_hits": 0,
+            "http_misses": 0,
+            "session_refreshes": 0,
+        }
+        self.http = HttpClient()
+        self.http_misses: Dict[str, int] = {}
+        self.artifacts = _artifact_writer(self.settings, self.stats)
+
+    async def __aenter__(self) -> "AsyncBrowserPool":
+        self._playwright_cm = async_playwright()
+        self._playwright = await self._playwright_cm.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        for store_name in list(self._contexts):
+            await self._retire(store_name)
+        if self._browser is not None:
+            await _close_quietly(self._browser)
+            self._browser = None
+        if self._playwright_cm is not None:
+            await self._playwright_cm.__aexit__(*exc_info)
+            self._playwright_cm = None
+            self._playwright = None
+        self.http.close()
+        await asyncio.to_thread(self.artifacts.close)
+
+    async def _ensure_browser(self) -> Any:
+        if self._browser is not None and not self._browser.is_connected():
+            for store_name in list(self._contexts):
+                await self._retire(store_name, crashed=True)
+            self._browser = None
+        if self._browser is None:
+            with self.metrics.time("browser_launch", "all"):
+                self._browser = await _launch_browser(
+                    self._playwright,
+                    headful=self.settings["headful"],
+                    slowmo_ms=self.settings["slowmo_ms"],
+                )
+            self.stats["browser_launches"] += 1
+        return self._browser
+
+    async def new_page(self, store_name: str) -> Tuple[Any, _StoreContext]:
+        async with self._lock:
+            entry = self._contexts.get(store_name)
+            if entry is not None and entry.pages_used >= self.settings["context_max_pages"]:
+                await self._retire(store_name)
+                entry = None
+            if entry is None:
+                browser = await self._ensure_browser()
+                with self.metrics.time("context_create", store_name):
+                    ctx_kwargs, version = _context_kwargs(store_name)
+                    context = await browser.new_context(**ctx_kwargs)
+                    try:
+                        if store_name == "COLES":
+                            await context.grant_permissions(["geolocation"], origin="https://www.coles.com.au")
+                    except Exception:
+                        pass
+                    await self._install_route_filter(context, store_name)
+                if SESSIONS.is_stale(store_name) and await self._refresh_session(store_name, context):
+                    version = SESSIONS.version(store_name)
+                entry = _StoreContext(context, version)
+                self._contexts[store_name] = entry
+                self.stats["contexts_created"] += 1
+            entry.pages_used += 1
+            entry.open_pages += 1
+            self.stats["pages_opened"] += 1
+        try:
+            page = await entry.context.new_page()
+        except Exception:
+            await self.release(store_name, entry)
+            raise
+        return page, entry
+
+    async def _install_route_filter(self, context: Any, store_name: str) -> None:
+        stats = self.stats
+        context.on("response", lambda response: _count_response_bytes(stats, response))
+        if not _blocking_enabled(self.settings, store_name):
+            return
+
+        async def _route(route: Any) -> None:
+            request = route.request
+            if _should_block_request(store_name, request.resource_type, request.url):
+                stats["requests_blocked"] += 1
+                await route.abort()
+            else:
+                stats["requests_allowed"] += 1
+                await route.continue_()
+
+        await context.route("**/*", _route)
+
+    async def _refresh_session(self, store_name: str, context: Any) -> bool:
+        url = SESSION_REFRESH_URLS.get(store_name)
+        if not url:
+            return False
+        page = await context.new_page()
+        try:
+            await self.pacer.wait_async(store_name)
+            with self.metrics.time("session_refresh", store_name):
+                await page.goto(url, wait_until="domcontentloaded", timeout=45000)
+            SESSIONS.update(store_name, await context.storage_state(), persist=self.settings["save_storage_state"], force=True)
+            self.stats["session_refreshes"] += 1
+            return True
+        except Exception:
+            return False
+        finally:
+            await _close_quietly(page)
+
+    async def release(self, store_name: str, entry: _StoreContext, page: Any = None) -> None:
+        if page is not None:
+            await _close_quietly(page)
+        entry.open_pages -= 1
+        if entry.retired and entry.open_pages <= 0:
+            await self._close_context(store_name, entry, save_state=True)
+
+    async def crashed(self, store_name: str, entry: _StoreContext) -> None:
+        async with self._lock:
+            if self._contexts.get(store_name) is entry:
+                await self._retire(store_name, crashed=True)
+
+    async def _retire(self, store_name: str, *, crashed: bool = False) -> None:
+        entry = self._contexts.pop(store_name, None)
+        if entry is None:
+            return
+        entry.retired = True
+        if crashed or entry.open_pages <= 0:
+            await self._close_context(store_name, entry, save_state=not crashed)
+
+    async def _close_context(self, store_name: str, entry: _StoreContext, *, save_state: bool) -> None:
+        if entry.context is None:
+            return
+        context, entry.context = entry.context, None
+        if save_state:
+            try:
+                SESSIONS.update(
+                    store_name,
+                    await context.storage_state(),
+                    persist=self.settings["save_storage_state"],
+                    opened_from=entry.session_version,
+                )
+            except Exception:
+                pass
+        await _close_quietly(context)
+        self.stats["context_recycles"] += 1
+
+
+async def _looks_like_imperva_challenge(page: Any, response: Any = None, mode: str = "cheap") -> bool:
+    try:
+        if mode != "full":
+            verdict = _classify_response(response, page.url, await page.title(), await page.evaluate(_CHALLENGE_PROBE_JS))
+            if verdict is not None:
+                return verdict
+        return _imperva_markers(await page.content(), page.url, await page.title())
+    except Exception:
+        return False
+
+
+async def _wait_until_ready(
+    page: Any, store_name: str, selectors: List[str], metrics: ScrapeMetrics | None = None
+) -> Dict[str, Any] | None:
+    metrics = metrics or ScrapeMetrics()
+    cfg = _readiness(store_name)
+    with metrics.time("readiness", store_name):
+        if cfg["network_idle"]:
+            try:
+                await page.wait_for_load_state("networkidle", timeout=cfg["network_idle_ms"])
+            except PlaywrightTimeoutError:
+                pass
+        with metrics.time("selector_match", store_name):
+            try:
+                handle = await page.wait_for_function(_READY_JS, **_ready_wait_kwargs(cfg, selectors))
+            except PlaywrightTimeoutError:
+                return None
+            return await handle.json_value()
+
+
+async def _locator_text(page: Any, selector: str | None) -> str | None:
+    if not selector:
+        return None
+    try:
+        return (await page.locator(selector).first.inner_text()).strip()
+    except Exception:
+        return None
+
+
+async def scrape_url_async(pool: AsyncBrowserPool, store_name: str, url: str, key: Any = None) -> Dict[str, Any] | None:
+    """
+    Async version of scrape.scrape_url; same HTTP-first stage, retries, blocking and result shape.
+    """
+    price_selectors = _price_selectors(store_name)
+    if not price_selectors:
+        return None
+
+    data = await asyncio.to_thread(_try_http_first, pool, store_name, url)
+    if data is not None:
+        return data
+
+    price_selectors = pool.selector_stats.ordered(store_name, price_selectors)
+    debug_capture_enabled = pool.settings["debug_capture_enabled"]
+    entry: _StoreContext | None
+    page, entry = await pool.new_page(store_name)
+    data = _start_browser_result(url)
+    attempt = 0
+    failure = "error"
+
+    async def capture(reason: str) -> None:
+        if debug_capture_enabled:
+            await pool.artifacts.capture_async(page, store_name, reason, job_id=pool.job_id, key=key, attempt=attempt)
+
+    try:
+        price_text = None
+        started = time.perf_counter()
+        for attempt in range(3):
+            if attempt:
+                pool.metrics.inc("retries", store_name)
+            await pool.pacer.wait_async(store_name)
+            try:
+                with pool.metrics.time("goto", store_name):
+                    response = await page.goto(url, wait_until="domcontentloaded", timeout=45000)
+            except PlaywrightError as e:
+                if not _is_target_closed(e):
+                    raise
+                await pool.release(store_name, entry, page)
+                await pool.crashed(store_name, entry)
+                entry = None
+                page, entry = await pool.new_page(store_name)
+                with pool.metrics.time("goto", store_name):
+                    response = await page.goto(url, wait_until="domcontentloaded", timeout=45000)
+
+            if store_name == "COLES" and await _looks_like_imperva_challenge(page, response, pool.settings["challenge_detection"]):
+                _mark_blocked(pool, store_name, data)
+                await capture("blocked")
+                break
+
+            ready = await _wait_until_ready(page, store_name, price_selectors, pool.metrics)
+            price_text = _accept_ready(pool, store_name, data, price_selectors, ready, started)
+            if price_text:
+                break
+
+        if price_text is None and data["promo_text"] != BLOCKED_PROMO:
+            failure = "no_match"
+            raise _no_match(pool, store_name, price_selectors)
+
+        parse_started = time.perf_counter()
+        was_sel, promo_sel = _extra_selectors(store_name)
+        _finish_result(
+            pool,
+            store_name,
+            data,
+            price_text,
+            await _locator_text(page, was_sel),
+            await _locator_text(page, promo_sel),
+            parse_started,
+        )
+
+    except Exception as e:
+        _mark_failed(pool, store_name, data, e)
+        await capture("timeout" if isinstance(e, PlaywrightTimeoutError) else failure)
+    finally:
+        if entry is not None:
+            await pool.release(store_name, entry, page)
+
+    return data
+
+
+async def _run(
+    work: List[WorkItem],
+    settings: Dict[str, Any] | None,
+    on_result: ResultCallback,
+    selector_stats: SelectorStats | None,
+    allow: Callable[[str], bool] | None,
+    job_id: int | None,
+    metrics: ScrapeMetrics | None,
+) -> Dict[str, int]:
+    loop = asyncio.get_running_loop()
+    # One thread runs every on_result call, in order, so callers can write to their own
+    # DB session there without blocking the event loop on commits.
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pricewatch-results")
+    try:
+        async with AsyncBrowserPool(settings, selector_stats, job_id, metrics) as pool:
+            limits = pool.settings["store_concurrency"]
+            semaphores: Dict[str, asyncio.Semaphore] = {}
+            for store_name, _, _ in work:
+                if store_name not in semaphores:
+                    semaphores[store_name] = asyncio.Semaphore(max(1, int(limits.get(store_name, 1))))
+
+            async def one(store_name: str, url: str, key: Any) -> None:
+                async with semaphores[store_name]:
+                    # Checked once a slot is free so a store that starts blocking mid-run is skipped.
+                    if allow is not None and not allow(store_name):
+                        return
+                    try:
+                        data = await scrape_url_async(pool, store_name, url, key)
+                    except Exception as exc:
+                        data = _empty_price_data(url)
+                        data["promo_text"] = f"[error: {type(exc).__name__}]"
+                if data is not None:
+                    await loop.run_in_executor(writer, on_result, key, store_name, data)
+
+            await asyncio.gather(*(one(store_name, url, key) for store_name, url, key in work))
+            return dict(pool.stats)
+    finally:
+        writer.shutdown(wait=True)
+
+
+def run_async_scrape(
+    work: Iterable[WorkItem],
+    settings: Dict[str, Any] | None,
+    on_result: ResultCallback,
+    selector_stats: SelectorStats | None = None,
+    allow: Callable[[str], bool] | None = None,
+    job_id: int | None = None,
+    metrics: ScrapeMetrics | None = None,
+) -> Dict[str, int]:
+    """
+    Scrape every (store_name, url, key) in ``work`` with up to
+    ``store_concurrency[store]`` pages open per store, calling
+    ``on_result(key, store_name, data)`` as each page finishes, always from
+    the same worker thread (never the event loop). Work for a
+    store is dropped without a callback while ``allow(store_name)`` is False.
+    Blocks until all work is done; returns the pool stats.
+    """
+    work = [(store_name, (url or "").strip(), key) for store_name, url, key in work if (url or "").strip()]
+    if not work:
+        return {}
+    return asyncio.run(_run(work, settings, on_result, selector_stats, allow, job_id, metrics))
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing as mp
+import queue
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Set
+
+from .metrics import ScrapeMetrics
+from .scrape import SelectorStats, _empty_price_data, _resolve_settings
+from .scrape_async import AsyncBrowserPool, ResultCallback, WorkItem, scrape_url_async
+
+
+# Replacement processes started per run for children that died.
+MAX_PROCESS_RESTARTS = 2
+# A page in flight in this many crashed processes is not handed out again.
+MAX_PAGE_CRASHES = 2
+
+
+def _shard(work: List[WorkItem], shards: int, shard_by: str) -> List[List[int]]:
+    """
+    Indexes into ``work`` per process. Stores are dealt round-robin so no process
+    gets two while another idles; URLs by crc32.
+    """
+    out: List[List[int]] = [[] for _ in range(shards)]
+    stores = sorted({store_name for store_name, _, _ in work})
+    for w, (store_name, url, _) in enumerate(work):
+        if shard_by == "store":
+            index = stores.index(store_name) % shards
+        else:
+            # crc32, not hash(): str hashes are salted per process.
+            index = zlib.crc32(url.encode("utf-8")) % shards
+        out[index].append(w)
+    return [shard for shard in out if shard]
+
+
+async def _serve(index: int, settings: Dict[str, Any], selector_rows: List[Dict[str, Any]], job_id: Any, tasks: Any, results: Any) -> None:
+    async with AsyncBrowserPool(settings, SelectorStats(selector_rows), job_id) as pool:
+        limits = pool.settings["store_concurrency"]
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        running: set = set()
+
+        async def one(w: int, store_name: str, url: str, key: Any) -> None:
+            sem = semaphores.setdefault(store_name, asyncio.Semaphore(max(1, int(limits.get(store_name, 1)))))
+            async with sem:
+                try:
+                    data = await scrape_url_async(pool, store_name, url, key)
+                except Exception as exc:
+                    data = _empty_price_data(url)
+                    data["promo_text"] = f"[error: {type(exc).__name__}]"
+            # Metrics go back as deltas with every page so /metrics sees a running process's work.
+            results.put(("result", index, w, data, pool.metrics.take()))
+
+        while True:
+            task = await asyncio.to_thread(tasks.get)
+            if task is None:
+                break
+            t = asyncio.create_task(one(*task))
+            running.add(t)
+            t.add_done_callback(running.discard)
+        await asyncio.gather(*running)
+        stats = dict(pool.stats)
+        rows = pool.selector_stats.rows(dirty_only=True)
+        metrics = pool.metrics.take()
+    results.put(("done", index, stats, rows, metrics))
+
+
+def _process_main(index: int, settings: Dict[str, Any], selector_rows: List[Dict[str, Any]], job_id: Any, tasks: Any, results: Any) -> None:
+    asyncio.run(_serve(index, settings, selector_rows, job_id, tasks, results))
+
+
+def run_process_scrape(
+    work: List[WorkItem],
+    settings: Dict[str, Any] | None,
+    on_result: ResultCallback,
+    selector_stats: SelectorStats | None = None,
+    allow: Callable[[str], bool] | None = None,
+    job_id: Any = None,
+    metrics: ScrapeMetrics | None = None,
+) -> Dict[str, int]:
+    """
+    Same contract as scrape_async.run_async_scrape, spread over
+    ``settings["processes"]`` processes, each with its own Playwright and
+    browser running the async engine on its shard (by store or hashed URL).
+
+    The calling process stays the single decision maker and writer: it hands
+    pages to each process as slots free up (checking ``allow`` right before),
+    and calls ``on_result`` for every page streamed back. When a process dies,
+    the pages it had in flight and the rest of its shard go to a live process
+    or a replacement (``MAX_PROCESS_RESTARTS``); pages that cannot be placed,
+    or were in flight in ``MAX_PAGE_CRASHES`` crashes, get no callback and are
+    counted in ``crash_skipped_pages``.
+    """
+    work = [(store_name, (url or "").strip(), key) for store_name, url, key in work if (url or "").strip()]
+    if not work:
+        return {}
+    resolved = _resolve_settings(settings)
+    shard_by = resolved["shard_by"]
+    initial = _shard(work, min(resolved["processes"], len(work)), shard_by)
+    n = len(initial)
+
+    child_settings = dict(settings or {})
+    if shard_by == "url" and n > 1:
+        # Every process paces a store on its own, so each gets a share of the store's rate.
+        child_settings["rate_limits"] = {
+            store_name: dict(cfg, per_minute=cfg["per_minute"] / n) for store_name, cfg in resolved["rate_limits"].items()
+        }
+    selector_stats = selector_stats or SelectorStats()
+    selector_rows = [{k: v for k, v in row.items() if k != "dirty"} for row in selector_stats.rows()]
+    concurrency = resolved["store_concurrency"]
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    task_queues: List[Any] = []
+    procs: List[Any] = []
+    capacity: List[int] = []
+    cursor: List[int] = []
+    # Indexes of work sent to each process and not yet returned.
+    sent: List[Set[int]] = []
+    closed: List[bool] = []
+    finished: List[bool] = []
+    shards: List[List[int]] = []
+    crashes = [0] * len(work)
+    stats: Dict[str, int] = {"processes": n}
+
+    def start(shard: List[int]) -> None:
+        i = len(procs)
+        task_queues.append(ctx.Queue())
+        procs.append(
+            ctx.Process(target=_process_main, args=(i, child_settings, selector_rows, job_id, task_queues[i], results), daemon=True)
+        )
+        # Enough pages queued per process to keep every store's slots busy.
+        capacity.append(max(1, sum(int(concurrency.get(s, 1)) for s in {work[w][0] for w in shard})))
+        cursor.append(0)
+        sent.append(set())
+        closed.append(False)
+        finished.append(False)
+        shards.append(shard)
+        procs[i].start()
+
+    def dispatch(i: int) -> None:
+        while len(sent[i]) < capacity[i] and cursor[i] < len(shards[i]):
+            w = shards[i][cursor[i]]
+            cursor[i] += 1
+            store_name, url, key = work[w]
+            if allow is not None and not allow(store_name):
+                continue
+            task_queues[i].put((w, store_name, url, key))
+            sent[i].add(w)
+        if not closed[i] and not sent[i] and cursor[i] >= len(shards[i]):
+            task_queues[i].put(None)
+            closed[i] = True
+
+    def count(name: str, n: int = 1) -> None:
+        stats[name] = stats.get(name, 0) + n
+
+    def reap() -> None:
+        """Hands a dead process's unfinished pages to a live one or a replacement."""
+        for i, proc in enumerate(procs):
+            if finished[i] or proc.is_alive():
+                continue
+            finished[i] = True
+            count("process_crashes")
+            for w in sent[i]:
+                crashes[w] += 1
+            orphans = [w for w in sent[i] if crashes[w] < MAX_PAGE_CRASHES] + shards[i][cursor[i]:]
+            if len(sent[i]) + len(shards[i]) - cursor[i] > len(orphans):
+                count("crash_skipped_pages", len(sent[i]) + len(shards[i]) - cursor[i] - len(orphans))
+            sent[i].clear()
+            cursor[i] = len(shards[i])
+            if not orphans:
+                continue
+            live = [j for j in range(len(procs)) if not finished[j] and not closed[j] and procs[j].is_alive()]
+            if live:
+                j = min(live, key=lambda j: len(shards[j]) - cursor[j])
+                shards[j].extend(orphans)
+                dispatch(j)
+            elif stats.get("process_restarts", 0) < MAX_PROCESS_RESTARTS:
+                count("process_restarts")
+                start(orphans)
+                dispatch(len(procs) - 1)
+            else:
+                # Never returned: the job leaves these pages pending, then marks them skipped.
+                count("crash_skipped_pages", len(orphans))
+                continue
+            count("crash_replaced_pages", len(orphans))
+
+    try:
+        for shard in initial:
+            start(shard)
+        for i in range(n):
+            dispatch(i)
+        last_reap = time.monotonic()
+        while not all(finished):
+            try:
+                msg = results.get(timeout=1.0)
+            except queue.Empty:
+                msg = None
+            if msg is None or time.monotonic() - last_reap >= 1.0:
+                # Also while other processes keep the queue busy, so a crash is noticed within a second.
+                reap()
+                last_reap = time.monotonic()
+            if msg is None:
+                continue
+            i = msg[1]
+            if finished[i]:
+                # Late message from a process already written off; its pages went elsewhere.
+                continue
+            if msg[0] == "result":
+                _, i, w, data, child_metrics = msg
+                sent[i].discard(w)
+                if metrics is not None:
+                    metrics.merge(child_metrics)
+                if data is not None:
+                    store_name, _, key = work[w]
+                    on_result(key, store_name, data)
+                dispatch(i)
+            else:
+                _, i, child_stats, rows, child_metrics = msg
+                finished[i] = True
+                for name, value in child_stats.items():
+                    count(name, value)
+                selector_stats.merge(rows)
+                if metrics is not None:
+                    metrics.merge(child_metrics)
+    finally:
+        for proc in procs:
+            proc.join(timeout=30)
+            if proc.is_alive():
+                proc.terminate()
+    return stats
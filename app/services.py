@@ -4,10 +4,12 @@ import json
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Tuple
 
-from sqlalchemy import func, and_
+from sqlalchemy import bindparam, func, insert, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
-from .models import Item, Store, StoreLink, PriceHistory, ScrapeSettings
+from .models import Item, Store, StoreLink, LatestPrice, PriceDaily, PriceHistory, ScrapeEvent, ScrapeSettings, SelectorStat
+from .retention import read_archive
 
 
 
@@ -16,8 +18,119 @@ DEFAULT_SCRAPE_SETTINGS: Dict[str, Any] = {
     "slowmo_ms": 0,
     "debug_capture_enabled": True,
     "save_storage_state": True,
+    "engine": "sync",
+    "store_concurrency": {},
+    "resource_blocking": {},
+    "http_first": True,
+    "rate_limits": {},
+    "rate_jitter_ms": 750,
+    "breaker_threshold": 3,
+    "breaker_cooldown_s": 600,
+    "commit_interval": 100,
+    "freshness_ttl": {},
+    "stale_max_pages": 200,
+    "stale_max_minutes": 15,
+    "processes": 0,
+    "shard_by": "store",
+    "price_storage": "change_only",
 }
 
+SCRAPE_ENGINES = ("sync", "async", "process")
+SHARD_MODES = ("store", "url")
+PRICE_STORAGE_MODES = ("change_only", "append")
+
+# Stale-only jobs skip an (item, store) whose latest price is younger than this.
+# Store and buy_freq entries override the default; when both apply the shorter wins.
+DEFAULT_FRESHNESS_TTL: Dict[str, Any] = {
+    "default_h": 24,
+    "stores": {},
+    "buy_freq": {"weekly": 24, "fortnightly": 72, "monthly": 168, "bi-monthly": 336},
+}
+
+
+def _load_json_dict(raw: str | None) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _clean_store_concurrency(value: Any) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    if not isinstance(value, dict):
+        return out
+    for store_name, limit in value.items():
+        try:
+            out[str(store_name).strip().upper()] = max(1, int(limit))
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def _clean_rate_limits(value: Any) -> Dict[str, Dict[str, float]]:
+    out: Dict[str, Dict[str, float]] = {}
+    if not isinstance(value, dict):
+        return out
+    for store_name, cfg in value.items():
+        if not isinstance(cfg, dict):
+            continue
+        try:
+            limit = {"per_minute": max(0.1, float(cfg.get("per_minute")))}
+            limit["burst"] = max(1, int(cfg.get("burst", 1) or 1))
+        except (TypeError, ValueError):
+            continue
+        out[str(store_name).strip().upper()] = limit
+    return out
+
+
+def _clean_store_flags(value: Any) -> Dict[str, bool]:
+    if not isinstance(value, dict):
+        return {}
+    return {str(store_name).strip().upper(): bool(flag) for store_name, flag in value.items()}
+
+
+def _clean_hours(value: Any) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    if not isinstance(value, dict):
+        return out
+    for key, hours in value.items():
+        try:
+            out[str(key).strip()] = max(0.0, float(hours))
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def _clean_freshness_ttl(value: Any) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        return {}
+    out: Dict[str, Any] = {}
+    if value.get("default_h") is not None:
+        try:
+            out["default_h"] = max(0.0, float(value["default_h"]))
+        except (TypeError, ValueError):
+            pass
+    stores = {k.upper(): h for k, h in _clean_hours(value.get("stores")).items()}
+    freqs = {k.lower(): h for k, h in _clean_hours(value.get("buy_freq")).items()}
+    if stores:
+        out["stores"] = stores
+    if freqs:
+        out["buy_freq"] = freqs
+    return out
+
+
+def freshness_ttl_hours(freshness: Dict[str, Any], store_name: str, buy_freq: str | None) -> float:
+    """TTL for one (store, buy_freq) pair: settings over DEFAULT_FRESHNESS_TTL, shortest match wins."""
+    stores = {**DEFAULT_FRESHNESS_TTL["stores"], **(freshness.get("stores") or {})}
+    freqs = {**DEFAULT_FRESHNESS_TTL["buy_freq"], **(freshness.get("buy_freq") or {})}
+    candidates = [h for h in (stores.get(store_name), freqs.get((buy_freq or "").strip().lower())) if h is not None]
+    if candidates:
+        return min(candidates)
+    return float(freshness.get("default_h", DEFAULT_FRESHNESS_TTL["default_h"]))
+
 
 def get_scrape_settings(db: Session) -> Dict[str, Any]:
     row = db.query(ScrapeSettings).filter(ScrapeSettings.id == 1).first()
@@ -28,6 +141,21 @@ def get_scrape_settings(db: Session) -> Dict[str, Any]:
         "slowmo_ms": int(row.slowmo_ms or 0),
         "debug_capture_enabled": bool(row.debug_capture_enabled),
         "save_storage_state": bool(row.save_storage_state),
+        "engine": row.engine if row.engine in SCRAPE_ENGINES else "sync",
+        "store_concurrency": _clean_store_concurrency(_load_json_dict(row.store_concurrency)),
+        "resource_blocking": _clean_store_flags(_load_json_dict(row.resource_blocking)),
+        "http_first": bool(row.http_first),
+        "rate_limits": _clean_rate_limits(_load_json_dict(row.rate_limits)),
+        "rate_jitter_ms": int(row.rate_jitter_ms if row.rate_jitter_ms is not None else 750),
+        "breaker_threshold": int(row.breaker_threshold or 3),
+        "breaker_cooldown_s": int(row.breaker_cooldown_s if row.breaker_cooldown_s is not None else 600),
+        "commit_interval": int(row.commit_interval or 100),
+        "freshness_ttl": _clean_freshness_ttl(_load_json_dict(row.freshness_ttl)),
+        "stale_max_pages": int(row.stale_max_pages if row.stale_max_pages is not None else 200),
+        "stale_max_minutes": int(row.stale_max_minutes if row.stale_max_minutes is not None else 15),
+        "processes": int(row.processes or 0),
+        "shard_by": row.shard_by if row.shard_by in SHARD_MODES else "store",
+        "price_storage": row.price_storage if row.price_storage in PRICE_STORAGE_MODES else "change_only",
     }
 
 
@@ -45,6 +173,45 @@ def set_scrape_settings(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:
         merged["slowmo_ms"] = 0
     merged["debug_capture_enabled"] = bool(merged.get("debug_capture_enabled", True))
     merged["save_storage_state"] = bool(merged.get("save_storage_state", True))
+    engine = str(merged.get("engine") or "sync").strip().lower()
+    merged["engine"] = engine if engine in SCRAPE_ENGINES else "sync"
+    merged["store_concurrency"] = _clean_store_concurrency(merged.get("store_concurrency"))
+    merged["resource_blocking"] = _clean_store_flags(merged.get("resource_blocking"))
+    merged["http_first"] = bool(merged.get("http_first", True))
+    merged["rate_limits"] = _clean_rate_limits(merged.get("rate_limits"))
+    try:
+        merged["rate_jitter_ms"] = max(0, int(merged.get("rate_jitter_ms", 750)))
+    except (TypeError, ValueError):
+        merged["rate_jitter_ms"] = 750
+    try:
+        merged["breaker_threshold"] = max(1, int(merged.get("breaker_threshold", 3)))
+    except (TypeError, ValueError):
+        merged["breaker_threshold"] = 3
+    try:
+        merged["breaker_cooldown_s"] = max(0, int(merged.get("breaker_cooldown_s", 600)))
+    except (TypeError, ValueError):
+        merged["breaker_cooldown_s"] = 600
+    try:
+        merged["commit_interval"] = max(1, int(merged.get("commit_interval", 100)))
+    except (TypeError, ValueError):
+        merged["commit_interval"] = 100
+    merged["freshness_ttl"] = _clean_freshness_ttl(merged.get("freshness_ttl"))
+    try:
+        merged["stale_max_pages"] = max(0, int(merged.get("stale_max_pages", 200)))
+    except (TypeError, ValueError):
+        merged["stale_max_pages"] = 200
+    try:
+        merged["stale_max_minutes"] = max(0, int(merged.get("stale_max_minutes", 15)))
+    except (TypeError, ValueError):
+        merged["stale_max_minutes"] = 15
+    try:
+        merged["processes"] = max(0, int(merged.get("processes") or 0))
+    except (TypeError, ValueError):
+        merged["processes"] = 0
+    shard_by = str(merged.get("shard_by") or "store").strip().lower()
+    merged["shard_by"] = shard_by if shard_by in SHARD_MODES else "store"
+    price_storage = str(merged.get("price_storage") or "change_only").strip().lower()
+    merged["price_storage"] = price_storage if price_storage in PRICE_STORAGE_MODES else "change_only"
 
     row = db.query(ScrapeSettings).filter(ScrapeSettings.id == 1).first()
     if row is None:
@@ -55,10 +222,58 @@ def set_scrape_settings(db: Session, payload: Dict[str, Any]) -> Dict[str, Any]:
     row.slowmo_ms = merged["slowmo_ms"]
     row.debug_capture_enabled = merged["debug_capture_enabled"]
     row.save_storage_state = merged["save_storage_state"]
+    row.engine = merged["engine"]
+    row.store_concurrency = json.dumps(merged["store_concurrency"]) if merged["store_concurrency"] else None
+    row.resource_blocking = json.dumps(merged["resource_blocking"]) if merged["resource_blocking"] else None
+    row.http_first = merged["http_first"]
+    row.rate_limits = json.dumps(merged["rate_limits"]) if merged["rate_limits"] else None
+    row.rate_jitter_ms = merged["rate_jitter_ms"]
+    row.breaker_threshold = merged["breaker_threshold"]
+    row.breaker_cooldown_s = merged["breaker_cooldown_s"]
+    row.commit_interval = merged["commit_interval"]
+    row.freshness_ttl = json.dumps(merged["freshness_ttl"]) if merged["freshness_ttl"] else None
+    row.stale_max_pages = merged["stale_max_pages"]
+    row.stale_max_minutes = merged["stale_max_minutes"]
+    row.processes = merged["processes"]
+    row.shard_by = merged["shard_by"]
+    row.price_storage = merged["price_storage"]
     row.updated_at = datetime.utcnow()
 
     db.commit()
     return get_scrape_settings(db)
+
+
+def load_selector_stats(db: Session) -> List[Dict[str, Any]]:
+    return [
+        {
+            "store": row.store,
+            "selector": row.selector,
+            "hits": int(row.hits or 0),
+            "misses": int(row.misses or 0),
+            "score": float(row.score or 0.0),
+            "avg_match_ms": row.avg_match_ms,
+            "last_hit_at": row.last_hit_at,
+        }
+        for row in db.query(SelectorStat).all()
+    ]
+
+
+def save_selector_stats(db: Session, rows: List[Dict[str, Any]]) -> None:
+    existing = {(r.store, r.selector): r for r in db.query(SelectorStat).all()}
+    for data in rows:
+        row = existing.get((data["store"], data["selector"]))
+        if row is None:
+            row = SelectorStat(store=data["store"], selector=data["selector"])
+            db.add(row)
+        row.hits = data["hits"]
+        row.misses = data["misses"]
+        row.score = data["score"]
+        row.avg_match_ms = data["avg_match_ms"]
+        row.last_hit_at = data["last_hit_at"]
+        row.updated_at = datetime.utcnow()
+    db.commit()
+
+
 def seed_from_json_if_empty(db: Session, seed_path: str) -> None:
     if db.query(Item).count() > 0:
         return
@@ -99,41 +314,286 @@ def seed_from_json_if_empty(db: Session, seed_path: str) -> None:
     db.commit()
 
 
-def get_latest_prices_for_items(db: Session, item_ids: List[int]) -> Dict[int, Dict[str, PriceHistory]]:
+# Values copied from a price_history row into latest_price.
+LATEST_PRICE_FIELDS = ("captured_at", "price", "was_price", "unit_price", "promo_text", "discount_percent", "source")
+
+# Change-only storage extends the current row while these are unchanged. discount_percent
+# follows from price/was_price but is compared too: the scraper and the extension derive it differently.
+PRICE_CHANGE_FIELDS = ("price", "was_price", "unit_price", "promo_text", "discount_percent")
+
+
+def upsert_latest_prices(db: Any, rows: List[Dict[str, Any]]) -> None:
     """
-    Returns: {item_id: {STORE_NAME: latest_price_row}}
+    Fold price observations (dicts with item_id, store_id, price_history_id and
+    LATEST_PRICE_FIELDS) into latest_price, in the caller's transaction. A row
+    replaces the current one unless it is older; on equal timestamps the later
+    write wins, matching the highest id in price_history.
     """
-    if not item_ids:
-        return {}
-    subq = (
-        db.query(
-            PriceHistory.item_id.label("item_id"),
-            PriceHistory.store_id.label("store_id"),
-            func.max(PriceHistory.captured_at).label("max_ts"),
+    if not rows:
+        return
+    newest: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for row in rows:
+        key = (row["item_id"], row["store_id"])
+        if key not in newest or row["captured_at"] >= newest[key]["captured_at"]:
+            newest[key] = row
+    fields = ("price_history_id",) + LATEST_PRICE_FIELDS
+    stmt = sqlite_insert(LatestPrice)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LatestPrice.item_id, LatestPrice.store_id],
+        set_={name: stmt.excluded[name] for name in fields},
+        where=stmt.excluded.captured_at >= LatestPrice.captured_at,
+    )
+    db.execute(
+        stmt,
+        [
+            {"item_id": item_id, "store_id": store_id, **{name: row.get(name) for name in fields}}
+            for (item_id, store_id), row in newest.items()
+        ],
+    )
+
+
+def _insert_history(db: Any, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    Insert price_history rows with one executemany and return their ids, in order.
+    RETURNING would make SQLite run one INSERT per row. The write transaction is
+    held from the INSERT on, so nothing else inserts between its rows and they
+    take consecutive ids ending at max(id).
+    """
+    if not rows:
+        return []
+    db.execute(insert(PriceHistory.__table__), rows)
+    last = db.execute(select(func.max(PriceHistory.id))).scalar_one()
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def _history_row(obs: Dict[str, Any]) -> Dict[str, Any]:
+    row = {"item_id": obs["item_id"], "store_id": obs["store_id"]}
+    row.update({name: obs.get(name) for name in LATEST_PRICE_FIELDS})
+    row.update({"last_seen_at": None, "seen_count": 1, "seen_gap_days": 0, "seen_gaps": 0})
+    return row
+
+
+def record_prices(db: Any, observations: List[Dict[str, Any]], storage: str = "change_only") -> int:
+    """
+    Write price observations (dicts with item_id, store_id and LATEST_PRICE_FIELDS,
+    oldest first) to price_history and latest_price, in the caller's transaction.
+    Returns the number of price_history rows inserted.
+
+    "append" inserts a row per observation. "change_only" extends the current
+    row of the (item, store) instead when PRICE_CHANGE_FIELDS are unchanged:
+    last_seen_at moves forward and seen_count / seen_gap_days / seen_gaps keep
+    what compute_cycle_insights and count_blocked need to give the same answers
+    as one row per observation.
+    """
+    if not observations:
+        return 0
+    if storage != "change_only":
+        rows = [_history_row(obs) for obs in observations]
+        ids = _insert_history(db, rows)
+        upsert_latest_prices(db, [dict(row, price_history_id=i) for row, i in zip(rows, ids)])
+        return len(rows)
+
+    item_ids = {obs["item_id"] for obs in observations}
+    keys = {(obs["item_id"], obs["store_id"]) for obs in observations}
+    # (item, store) -> the row new observations may extend: {"id" | "insert", "end", PRICE_CHANGE_FIELDS}
+    current: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for lp in db.query(LatestPrice).filter(LatestPrice.item_id.in_(item_ids), LatestPrice.price_history_id.isnot(None)):
+        if (lp.item_id, lp.store_id) in keys:
+            cur = {name: getattr(lp, name) for name in PRICE_CHANGE_FIELDS}
+            cur.update({"id": lp.price_history_id, "insert": None, "end": lp.captured_at})
+            current[(lp.item_id, lp.store_id)] = cur
+
+    inserts: List[Dict[str, Any]] = []
+    extends: Dict[int, Dict[str, Any]] = {}
+    latest: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for obs in observations:
+        key = (obs["item_id"], obs["store_id"])
+        seen_at = obs["captured_at"]
+        cur = current.get(key)
+        if (
+            cur is not None
+            and seen_at >= cur["end"]
+            and all(cur[name] == obs.get(name) for name in PRICE_CHANGE_FIELDS)
+        ):
+            gap = (seen_at - cur["end"]).days
+            if cur["insert"] is not None:
+                target = inserts[cur["insert"]]
+            else:
+                target = extends.setdefault(
+                    cur["id"], {"b_id": cur["id"], "seen_count": 0, "seen_gap_days": 0, "seen_gaps": 0}
+                )
+            target["last_seen_at"] = seen_at
+            target["seen_count"] += 1
+            if gap > 0:
+                target["seen_gap_days"] += gap
+                target["seen_gaps"] += 1
+            cur["end"] = seen_at
+        else:
+            cur = {name: obs.get(name) for name in PRICE_CHANGE_FIELDS}
+            cur.update({"id": None, "insert": len(inserts), "end": seen_at})
+            current[key] = cur
+            inserts.append(_history_row(obs))
+        latest[key] = obs
+
+    ids = _insert_history(db, inserts)
+    if extends:
+        db.execute(
+            update(PriceHistory.__table__)
+            .where(PriceHistory.id == bindparam("b_id"))
+            .values(
+                last_seen_at=bindparam("last_seen_at"),
+                seen_count=PriceHistory.seen_count + bindparam("seen_count"),
+                seen_gap_days=PriceHistory.seen_gap_days + bindparam("seen_gap_days"),
+                seen_gaps=PriceHistory.seen_gaps + bindparam("seen_gaps"),
+            ),
+            list(extends.values()),
         )
-        .filter(PriceHistory.item_id.in_(item_ids))
-        .group_by(PriceHistory.item_id, PriceHistory.store_id)
-        .subquery()
+    upsert_latest_prices(
+        db,
+        [
+            dict(obs, price_history_id=current[key]["id"] if current[key]["insert"] is None else ids[current[key]["insert"]])
+            for key, obs in latest.items()
+        ],
     )
+    return len(inserts)
+
+
+def rebuild_latest_prices(db: Any) -> int:
+    """
+    Recompute latest_price from price_history (newest captured_at, then highest id;
+    captured_at is the row's last observation). Returns rows written.
+    """
+    fields = ", ".join(LATEST_PRICE_FIELDS[1:])
+    db.execute(text("DELETE FROM latest_price"))
+    result = db.execute(text(f"""
+        INSERT INTO latest_price (item_id, store_id, price_history_id, captured_at, {fields})
+        SELECT item_id, store_id, id, COALESCE(last_seen_at, captured_at), {fields} FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY item_id, store_id ORDER BY captured_at DESC, id DESC
+            ) AS rn
+            FROM price_history
+        ) WHERE rn = 1
+    """))
+    return result.rowcount
+
+
+def compact_price_history(db: Session, batch_pairs: int = 200) -> Dict[str, int]:
+    """
+    One-off rewrite of append-mode history into change-only rows: each run of
+    consecutive rows with equal PRICE_CHANGE_FIELDS per (item, store) is folded
+    into its first row, then latest_price is rebuilt. Commits every
+    ``batch_pairs`` (item, store) pairs. Returns row counts before and after.
+    """
+    cols = (
+        PriceHistory.id,
+        PriceHistory.captured_at,
+        PriceHistory.last_seen_at,
+        PriceHistory.seen_count,
+        PriceHistory.seen_gap_days,
+        PriceHistory.seen_gaps,
+    ) + tuple(getattr(PriceHistory, name) for name in PRICE_CHANGE_FIELDS)
+    before = db.query(func.count(PriceHistory.id)).scalar() or 0
+    pairs = db.query(PriceHistory.item_id, PriceHistory.store_id).distinct().all()
+    for n, (item_id, store_id) in enumerate(pairs, 1):
+        rows = (
+            db.query(*cols)
+            .filter(PriceHistory.item_id == item_id, PriceHistory.store_id == store_id)
+            .order_by(PriceHistory.captured_at.asc(), PriceHistory.id.asc())
+            .all()
+        )
+        heads: List[Dict[str, Any]] = []
+        drop: List[int] = []
+        for row in rows:
+            values = tuple(getattr(row, name) for name in PRICE_CHANGE_FIELDS)
+            head = heads[-1] if heads else None
+            if head is not None and head["values"] == values:
+                gap = (row.captured_at - head["end"]).days
+                if gap > 0:
+                    head["seen_gap_days"] += gap
+                    head["seen_gaps"] += 1
+                head["seen_gap_days"] += row.seen_gap_days or 0
+                head["seen_gaps"] += row.seen_gaps or 0
+                head["seen_count"] += row.seen_count or 1
+                head["end"] = row.last_seen_at or row.captured_at
+                head["merged"] = True
+                drop.append(row.id)
+            else:
+                heads.append({
+                    "b_id": row.id,
+                    "values": values,
+                    "end": row.last_seen_at or row.captured_at,
+                    "seen_count": row.seen_count or 1,
+                    "seen_gap_days": row.seen_gap_days or 0,
+                    "seen_gaps": row.seen_gaps or 0,
+                    "merged": False,
+                })
+        merged = [
+            dict({k: h[k] for k in ("b_id", "seen_count", "seen_gap_days", "seen_gaps")}, last_seen_at=h["end"])
+            for h in heads
+            if h["merged"]
+        ]
+        if merged:
+            db.execute(
+                update(PriceHistory.__table__)
+                .where(PriceHistory.id == bindparam("b_id"))
+                .values(
+                    last_seen_at=bindparam("last_seen_at"),
+                    seen_count=bindparam("seen_count"),
+                    seen_gap_days=bindparam("seen_gap_days"),
+                    seen_gaps=bindparam("seen_gaps"),
+                ),
+                merged,
+            )
+            db.query(PriceHistory).filter(PriceHistory.id.in_(drop)).delete(synchronize_session=False)
+        if n % batch_pairs == 0:
+            db.commit()
+    rebuild_latest_prices(db)
+    db.commit()
+    after = db.query(func.count(PriceHistory.id)).scalar() or 0
+    return {"pairs": len(pairs), "rows_before": before, "rows_after": after}
 
+
+def get_latest_prices_for_items(db: Session, item_ids: List[int]) -> Dict[int, Dict[str, LatestPrice]]:
+    """
+    Returns: {item_id: {STORE_NAME: latest_price_row}}
+    """
+    if not item_ids:
+        return {}
     rows = (
-        db.query(PriceHistory, Store)
-        .join(Store, Store.id == PriceHistory.store_id)
-        .join(subq, and_(
-            subq.c.item_id == PriceHistory.item_id,
-            subq.c.store_id == PriceHistory.store_id,
-            subq.c.max_ts == PriceHistory.captured_at,
-        ))
+        db.query(LatestPrice, Store.name)
+        .join(Store, Store.id == LatestPrice.store_id)
+        .filter(LatestPrice.item_id.in_(item_ids))
         .all()
     )
 
-    out: Dict[int, Dict[str, PriceHistory]] = {i: {} for i in item_ids}
-    for ph, store in rows:
-        out.setdefault(ph.item_id, {})[store.name] = ph
+    out: Dict[int, Dict[str, LatestPrice]] = {i: {} for i in item_ids}
+    for lp, store_name in rows:
+        out.setdefault(lp.item_id, {})[store_name] = lp
     return out
 
 
-def compute_best_store_map(items: List[Item], latest: Dict[int, Dict[str, PriceHistory]]) -> Dict[int, Tuple[str, float] | None]:
+def count_blocked(db: Session, store_name: str) -> int:
+    """
+    Blocked scrapes for a store: legacy "[blocked: imperva...]" price observations plus
+    store_blocked events recorded by the circuit breaker.
+    """
+    rows = (
+        db.query(func.coalesce(func.sum(PriceHistory.seen_count), 0))
+        .join(Store, Store.id == PriceHistory.store_id)
+        .filter(Store.name == store_name)
+        .filter(PriceHistory.promo_text.ilike("%[blocked: imperva%"))
+        .scalar()
+    )
+    events = (
+        db.query(ScrapeEvent)
+        .filter(ScrapeEvent.store == store_name)
+        .filter(ScrapeEvent.kind == "store_blocked")
+        .count()
+    )
+    return rows + events
+
+
+def compute_best_store_map(items: List[Item], latest: Dict[int, Dict[str, LatestPrice]]) -> Dict[int, Tuple[str, float] | None]:
     """
     For each item, pick the cheapest current price among stores with a latest price.
     Returns {item_id: (store_name, price)} or None
@@ -148,13 +608,22 @@ def compute_best_store_map(items: List[Item], latest: Dict[int, Dict[str, PriceH
     return best
 
 
-def compute_cycle_insights(db: Session, item_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+def compute_cycle_insights(
+    db: Session,
+    item_ids: List[int],
+    since: datetime | None = None,
+    archive: bool = False,
+) -> Dict[int, Dict[str, Any]]:
     """
     Basic cycle model per item (across all stores):
     - min historical price per store
     - last discount date per store
     - avg interval between discounts per store (days)
     - next expected discount (date) per store
+
+    Only price_history (the raw retention window) is read unless ``archive`` is set;
+    then rows moved out by the retention job are read back from the Parquet archive
+    and price_daily too. ``since`` limits the history considered (whole days for price_daily).
     """
     insights: Dict[int, Dict[str, Any]] = {i: {} for i in item_ids}
     if not item_ids:
@@ -164,31 +633,50 @@ def compute_cycle_insights(db: Session, item_ids: List[int]) -> Dict[int, Dict[s
     store_by_id = {s.id: s.name for s in stores}
 
     # Pull discount events: where discount_percent >= 10 OR was_price not null and was_price > price
-    rows = (
+    q = (
         db.query(PriceHistory)
         .filter(PriceHistory.item_id.in_(item_ids))
         .filter(
             (PriceHistory.discount_percent != None) | (PriceHistory.was_price != None)
         )
-        .order_by(PriceHistory.item_id.asc(), PriceHistory.store_id.asc(), PriceHistory.captured_at.asc())
-        .all()
     )
+    if since is not None:
+        q = q.filter(PriceHistory.captured_at >= since)
+    rows = q.order_by(PriceHistory.item_id.asc(), PriceHistory.store_id.asc(), PriceHistory.captured_at.asc()).all()
 
     # min price per store
-    mins = (
+    q = (
         db.query(
             PriceHistory.item_id, PriceHistory.store_id, func.min(PriceHistory.price)
         )
         .filter(PriceHistory.item_id.in_(item_ids))
         .filter(PriceHistory.price != None)
-        .group_by(PriceHistory.item_id, PriceHistory.store_id)
-        .all()
     )
-    min_map = {(i, s): p for i, s, p in mins}
+    if since is not None:
+        q = q.filter(PriceHistory.captured_at >= since)
+    mins = q.group_by(PriceHistory.item_id, PriceHistory.store_id).all()
+
+    if archive:
+        archived = read_archive(item_ids, since, discounts_only=True)
+        rows = sorted(archived + rows, key=lambda ph: (ph.item_id, ph.store_id, ph.captured_at))
+        q = (
+            db.query(PriceDaily.item_id, PriceDaily.store_id, func.min(PriceDaily.min_price))
+            .filter(PriceDaily.item_id.in_(item_ids))
+            .filter(PriceDaily.min_price != None)
+        )
+        if since is not None:
+            q = q.filter(PriceDaily.day >= since.date())
+        mins = list(mins) + q.group_by(PriceDaily.item_id, PriceDaily.store_id).all()
+
+    min_map: Dict[Tuple[int, int], float] = {}
+    for i, s, p in mins:
+        if (i, s) not in min_map or p < min_map[(i, s)]:
+            min_map[(i, s)] = p
 
-    # build per item/store discount timestamps
+    # build per item/store discount runs; a change-only row stands for seen_count observations
+    # from captured_at to last_seen_at, with the whole-day gaps between them already summed
     from collections import defaultdict
-    ts_map = defaultdict(list)
+    runs_map = defaultdict(list)
     for ph in rows:
         # treat as discount if it really looks discounted
         is_disc = False
@@ -197,27 +685,30 @@ def compute_cycle_insights(db: Session, item_ids: List[int]) -> Dict[int, Dict[s
         elif ph.was_price is not None and ph.price is not None and ph.was_price > ph.price:
             is_disc = True
         if is_disc:
-            ts_map[(ph.item_id, ph.store_id)].append(ph.captured_at)
+            runs_map[(ph.item_id, ph.store_id)].append(ph)
 
     for item_id in item_ids:
         per_store: Dict[str, Any] = {}
         for s in stores:
             key = (item_id, s.id)
-            dts = ts_map.get(key, [])
             avg_days = None
             last_disc = None
             next_expected = None
-            if len(dts) >= 2:
-                gaps = []
-                for a, b in zip(dts[:-1], dts[1:]):
-                    gaps.append((b - a).days)
-                gaps = [g for g in gaps if g > 0]
-                if gaps:
-                    avg_days = round(sum(gaps) / len(gaps), 1)
-            if dts:
-                last_disc = dts[-1]
-                if avg_days:
-                    next_expected = last_disc + timedelta(days=float(avg_days))
+            gap_days = 0
+            gap_count = 0
+            for ph in runs_map.get(key, []):
+                if last_disc is not None:
+                    gap = (ph.captured_at - last_disc).days
+                    if gap > 0:
+                        gap_days += gap
+                        gap_count += 1
+                gap_days += ph.seen_gap_days or 0
+                gap_count += ph.seen_gaps or 0
+                last_disc = ph.last_seen_at or ph.captured_at
+            if gap_count:
+                avg_days = round(gap_days / gap_count, 1)
+            if last_disc is not None and avg_days:
+                next_expected = last_disc + timedelta(days=float(avg_days))
             per_store[s.name] = {
                 "min_price": min_map.get(key),
                 "last_discount": last_disc,
@@ -228,7 +719,7 @@ def compute_cycle_insights(db: Session, item_ids: List[int]) -> Dict[int, Dict[s
     return insights
 
 
-def build_buylist_groups(items: List[Item], latest: Dict[int, Dict[str, PriceHistory]], cycles: Dict[int, Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+def build_buylist_groups(items: List[Item], latest: Dict[int, Dict[str, LatestPrice]], cycles: Dict[int, Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
     """
     Group items by which store to buy at (based on cheapest current price).
     Adds simple WAIT suggestion if next expected discount is soon.
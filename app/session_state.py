@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+# Every in-memory session gets a new number, so a context can tell whether the
+# session it was opened from is still the current one.
+_versions = itertools.count(1)
+
+
+def _fingerprint(state: Dict[str, Any]) -> str:
+    """
+    Hash of what identifies a session: cookie names/domains/paths/values and
+    localStorage. Expiry is left out, since sliding expiries change on every
+    page and would make every recycle look like a new session.
+    """
+    cookies = sorted(
+        (c.get("domain") or "", c.get("path") or "", c.get("name") or "", c.get("value") or "")
+        for c in state.get("cookies") or []
+    )
+    origins = sorted(
+        (o.get("origin") or "", sorted((i.get("name") or "", i.get("value") or "") for i in o.get("localStorage") or []))
+        for o in state.get("origins") or []
+    )
+    return hashlib.sha1(json.dumps([cookies, origins]).encode("utf-8")).hexdigest()
+
+
+class _Session:
+    __slots__ = ("state", "fingerprint", "refreshed_at", "flushed", "mtime_ns", "version")
+
+    def __init__(self, state: Dict[str, Any], refreshed_at: float, flushed: bool, mtime_ns: int | None = None) -> None:
+        self.state = state
+        self.fingerprint = _fingerprint(state)
+        self.refreshed_at = refreshed_at
+        self.flushed = flushed
+        # mtime of the file version this session is based on (None: never on disk).
+        self.mtime_ns = mtime_ns
+        self.version = next(_versions)
+
+
+class SessionStateManager:
+    """
+    Playwright storage state per store, kept in memory and shared by every
+    context the process opens for that store.
+
+    ``state/{store}.json`` is read once, on first use. Contexts hand their state
+    back through ``update()`` when they are recycled; the file is rewritten only
+    when the cookies or localStorage actually changed, via a temp file and
+    ``os.replace`` so a reader never sees a half-written file.
+
+    Another process (the web app's "Init Coles session", or another worker)
+    may replace the file; whenever the file is newer than the cached copy it is
+    read again. A context records the version it was opened from
+    (``checkout()``) and passes it back as ``opened_from``; if the session has
+    changed since, here or in another process, its state is dropped instead of
+    written over the newer session.
+
+    ``age()`` is the time since the session last changed (file mtime for a
+    freshly loaded file), which is what ``is_stale()`` compares against a
+    store's max age. Safe to share between threads and event loops.
+    """
+
+    def __init__(self, state_dir: Path, max_age_s: Dict[str, float] | None = None) -> None:
+        self.state_dir = Path(state_dir)
+        self.max_age_s = dict(max_age_s or {})
+        self._sessions: Dict[str, _Session | None] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"loads": 0, "flushes": 0, "unchanged": 0, "outdated": 0}
+
+    def path(self, store_name: str) -> Path:
+        return self.state_dir / f"{store_name.lower()}.json"
+
+    def get(self, store_name: str) -> Dict[str, Any] | None:
+        """Current storage state for a new context, or None when the store has no session yet."""
+        with self._lock:
+            session = self._load(store_name)
+            return session.state if session is not None else None
+
+    def checkout(self, store_name: str) -> Tuple[Dict[str, Any] | None, int]:
+        """(state, version) for a new context; version 0 when the store has no session yet."""
+        with self._lock:
+            session = self._load(store_name)
+            return (session.state, session.version) if session is not None else (None, 0)
+
+    def version(self, store_name: str) -> int:
+        return self.checkout(store_name)[1]
+
+    def age(self, store_name: str) -> float | None:
+        with self._lock:
+            session = self._load(store_name)
+            return time.time() - session.refreshed_at if session is not None else None
+
+    def is_stale(self, store_name: str) -> bool:
+        max_age = self.max_age_s.get(store_name)
+        if not max_age:
+            return False
+        age = self.age(store_name)
+        return age is not None and age >= max_age
+
+    def update(
+        self,
+        store_name: str,
+        state: Dict[str, Any] | None,
+        *,
+        persist: bool = True,
+        force: bool = False,
+        opened_from: int | None = None,
+    ) -> bool:
+        """
+        Record a context's storage state. Returns True when the session changed.
+        Unchanged state is not written; ``force`` writes regardless (and resets the age).
+        With ``opened_from`` (the version from ``checkout()``) the state is dropped
+        when the session has been replaced since the context was opened.
+        """
+        if not state:
+            return False
+        with self._lock:
+            current = self._load(store_name)
+            if not force and opened_from is not None and opened_from != (current.version if current else 0):
+                self.stats["outdated"] += 1
+                return False
+            fresh = _Session(state, time.time(), flushed=False, mtime_ns=current.mtime_ns if current else None)
+            changed = current is None or current.fingerprint != fresh.fingerprint
+            if not changed and not force:
+                # Same session: keep the newer expiries in memory, keep its age.
+                current.state = state
+                self.stats["unchanged"] += 1
+                if not persist or current.flushed:
+                    return False
+                fresh = current
+            self._sessions[store_name] = fresh
+            if persist:
+                fresh.mtime_ns = self._write(store_name, state)
+                fresh.flushed = True
+            return changed
+
+    def forget(self, store_name: str) -> None:
+        """Drop the cached session so the next ``get()`` re-reads the file."""
+        with self._lock:
+            self._sessions.pop(store_name, None)
+
+    def _load(self, store_name: str) -> _Session | None:
+        """Cached session, re-read when the file is newer than the version it is based on."""
+        path = self.path(store_name)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if store_name in self._sessions:
+            session = self._sessions[store_name]
+            if mtime_ns is None or (session is not None and session.mtime_ns is not None and mtime_ns <= session.mtime_ns):
+                return session
+        session = None
+        try:
+            with path.open("r", encoding="utf-8") as fh:
+                state = json.load(fh)
+            session = _Session(state, mtime_ns / 1e9, flushed=True, mtime_ns=mtime_ns)
+            self.stats["loads"] += 1
+        except (OSError, ValueError, TypeError):
+            session = self._sessions.get(store_name)
+        self._sessions[store_name] = session
+        return session
+
+    def _write(self, store_name: str, state: Dict[str, Any]) -> int:
+        """Write the state file atomically; returns its new mtime."""
+        path = self.path(store_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=str(path.parent))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(state, fh)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self.stats["flushes"] += 1
+        return path.stat().st_mtime_ns
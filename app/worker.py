@@ -0,0 +1,44 @@
+"""
+Standalone scrape worker. Claims queued ScrapeJob rows from the database under
+a lease, so several workers (and web processes) can share one queue.
+
+  python -m app.worker                      # any job
+  python -m app.worker --stores COLES       # shard: only COLES-only jobs
+  python -m app.worker --once               # drain the queue and exit
+
+Run the web app with PRICEWATCH_JOB_RUNNER=worker so it only enqueues.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import time
+
+from .db import init_db
+from .jobs import LEASE_SECONDS, drain_queue
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="PriceWatch scrape worker")
+    ap.add_argument("--stores", default="", help="comma-separated stores this worker serves (default: all jobs)")
+    ap.add_argument("--poll", type=float, default=5.0, help="seconds between queue polls when idle")
+    ap.add_argument("--lease", type=int, default=LEASE_SECONDS, help="lease length in seconds; renewed every third of it")
+    ap.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = ap.parse_args()
+
+    stores = [s.strip().upper() for s in args.stores.split(",") if s.strip()] or None
+    owner = f"worker:{socket.gethostname()}:{os.getpid()}"
+    init_db()
+    print(f"[+] {owner} serving {', '.join(stores) if stores else 'all stores'}")
+    while True:
+        ran = drain_queue(owner, stores, args.lease)
+        if ran:
+            print(f"[+] finished {ran} job(s)")
+        if args.once:
+            return
+        time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,18 @@
+"""
+Check store selectors against live product pages.
+
+  python debug_scrape.py --store COLES --url https://... [--headful --pause]
+  python debug_scrape.py --batch --from-db --store COLES --limit 30 --workers 4
+  python debug_scrape.py --batch --urls urls.txt --csv report.csv
+
+Batch mode tries every candidate selector in app/scrape.SELECTORS on each URL
+(StoreLink rows or a file of "STORE URL" lines), several pages at a time, and
+prints match and time-to-match per URL and selector. Screenshots and HTML are
+saved only for URLs where no price selector matched.
+"""
 import argparse
+import asyncio
+import csv
 import os
 import time
 from pathlib import Path
@@ -10,18 +24,188 @@ DEFAULT_SELECTORS = {
     "ALDI": "span.base-price__regular span",
 }
 
+def _load_urls(args):
+    """[(store, url)] from StoreLink rows or a "STORE URL" file (a bare URL uses --store)."""
+    if args.from_db:
+        from app.db import SessionLocal, init_db
+        from app.jobs import group_page_tasks, plan_scrape_work
+
+        init_db()
+        db = SessionLocal()
+        try:
+            pages = group_page_tasks(plan_scrape_work(db, args.store or "ALL"))
+        finally:
+            db.close()
+        urls = [(store, url) for store, url, _ in pages]
+    else:
+        urls = []
+        for line in Path(args.urls).read_text(encoding="utf-8").splitlines():
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            if len(parts) == 1:
+                if not args.store:
+                    raise SystemExit(f"[!] no store for {parts[0]}: use 'STORE URL' lines or --store")
+                urls.append((args.store, parts[0]))
+            else:
+                urls.append((parts[0].upper(), parts[1]))
+    return urls[: args.limit] if args.limit else urls
+
+
+def _candidates(store, extra=None):
+    """[(field, selector)] for every selector configured for the store, plus --selector."""
+    from app.scrape import SELECTORS, _selector_list
+
+    out = [(field, sel) for field, value in SELECTORS.get(store, {}).items() for sel in _selector_list(value)]
+    if extra and ("price", extra) not in out:
+        out.append(("price", extra))
+    return out
+
+
+async def _check_url(pool, store, url, args, out_dir):
+    from app.replay import url_key
+    from app.scrape import _parse_price
+
+    rows = []
+    page, entry = await pool.new_page(store)
+    try:
+        await pool.pacer.wait_async(store)
+        try:
+            await page.goto(url, wait_until="domcontentloaded", timeout=args.timeout)
+        except Exception as e:
+            return [{"store": store, "url": url, "field": "-", "selector": "-", "match": f"goto failed: {type(e).__name__}", "count": 0, "ms": None, "text": ""}]
+        started = time.perf_counter()
+
+        async def time_to_match(sel):
+            try:
+                await page.wait_for_selector(sel, state="attached", timeout=args.selector_timeout)
+            except Exception:
+                return None
+            return int((time.perf_counter() - started) * 1000)
+
+        candidates = _candidates(store, args.selector)
+        # All selectors wait at once, so a URL costs the slowest selector, not the sum.
+        timings = await asyncio.gather(*(time_to_match(sel) for _, sel in candidates))
+        for (field, sel), ms in zip(candidates, timings):
+            loc = page.locator(sel)
+            count = await loc.count() if ms is not None else 0
+            text = ""
+            if count:
+                try:
+                    text = (await loc.first.inner_text(timeout=2000)).strip()
+                except Exception:
+                    pass
+            matched = bool(count) and (field != "price" or _parse_price(text) is not None)
+            rows.append({"store": store, "url": url, "field": field, "selector": sel, "match": "yes" if matched else "no", "count": count, "ms": ms, "text": text[:40]})
+
+        if not any(r["match"] == "yes" for r in rows if r["field"] == "price"):
+            base = out_dir / f"{store.lower()}_{url_key(url)}"
+            try:
+                await page.screenshot(path=str(base) + ".png", full_page=True)
+                (Path(str(base) + ".html")).write_text(await page.content(), encoding="utf-8")
+            except Exception:
+                pass
+    finally:
+        await pool.release(store, entry, page)
+    return rows
+
+
+async def _run_batch(args, urls, out_dir):
+    from app.scrape_async import AsyncBrowserPool
+
+    settings = {
+        "headful": args.headful,
+        "slowmo_ms": args.slowmo,
+        "debug_capture_enabled": False,
+        "http_first": False,
+        "save_storage_state": False,
+    }
+    sem = asyncio.Semaphore(max(1, args.workers))
+    done = 0
+
+    async def one(store, url):
+        nonlocal done
+        async with sem:
+            rows = await _check_url(pool, store, url, args, out_dir)
+        done += 1
+        ok = any(r["match"] == "yes" for r in rows if r["field"] == "price")
+        print(f"[{done}/{len(urls)}] {'ok  ' if ok else 'FAIL'} {store:<10} {url}")
+        return rows
+
+    async with AsyncBrowserPool(settings) as pool:
+        results = await asyncio.gather(*(one(store, url) for store, url in urls))
+    return [row for rows in results for row in rows]
+
+
+def batch(args):
+    urls = _load_urls(args)
+    if not urls:
+        raise SystemExit("[!] no URLs to check")
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    print(f"[+] {len(urls)} URLs, {args.workers} at a time")
+    rows = asyncio.run(_run_batch(args, urls, out_dir))
+
+    print()
+    print(f"{'store':<10} {'field':<10} {'selector':<45} {'match':>5} {'count':>5} {'ms':>6}  url / text")
+    for r in rows:
+        ms = "-" if r["ms"] is None else r["ms"]
+        print(f"{r['store']:<10} {r['field']:<10} {r['selector'][:45]:<45} {r['match']:>5} {r['count']:>5} {ms:>6}  {r['url']}  {r['text']!r}")
+
+    # Per selector: how often it matched and how fast.
+    print()
+    print(f"{'store':<10} {'field':<10} {'selector':<45} {'hits':>9} {'p50 ms':>7} {'max ms':>7}")
+    summary = {}
+    for r in rows:
+        if r["field"] != "-":
+            summary.setdefault((r["store"], r["field"], r["selector"]), []).append(r)
+    for (store, field, sel), rs in summary.items():
+        times = sorted(r["ms"] for r in rs if r["match"] == "yes")
+        hits = f"{len(times)}/{len(rs)}"
+        p50 = times[len(times) // 2] if times else "-"
+        slowest = times[-1] if times else "-"
+        print(f"{store:<10} {field:<10} {sel[:45]:<45} {hits:>9} {p50:>7} {slowest:>7}")
+
+    failed = len({r["url"] for r in rows}) - len({r["url"] for r in rows if r["field"] == "price" and r["match"] == "yes"})
+    print(f"[+] {failed} URL(s) without a price match; artifacts in {out_dir}")
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["store", "url", "field", "selector", "match", "count", "ms", "text"])
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"[+] wrote {args.csv}")
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--store", required=True, choices=["ALDI", "COLES", "WOOLWORTHS"])
-    ap.add_argument("--url", required=True)
+    ap.add_argument("--store", default=None, choices=["ALDI", "COLES", "WOOLWORTHS"])
+    ap.add_argument("--url", default=None)
     ap.add_argument("--selector", default=None)
     ap.add_argument("--headful", action="store_true")
     ap.add_argument("--slowmo", type=int, default=250)  # ms
     ap.add_argument("--timeout", type=int, default=45000)
     ap.add_argument("--pause", action="store_true", help="pause with Playwright inspector")
     ap.add_argument("--out", default="debug_out", help="folder for screenshots/html")
+    ap.add_argument("--settle-ms", type=int, default=2000, help="single URL: fixed wait after load before the selector check")
+    ap.add_argument("--selector-timeout", type=int, default=None, help="ms to wait for a selector (default: 20000 single, 10000 batch)")
+    ap.add_argument("--batch", action="store_true", help="check many URLs against every candidate selector")
+    ap.add_argument("--from-db", action="store_true", help="batch: URLs from StoreLink rows (filtered by --store)")
+    ap.add_argument("--urls", default=None, help="batch: file of 'STORE URL' lines")
+    ap.add_argument("--workers", type=int, default=4, help="batch: pages checked at once")
+    ap.add_argument("--limit", type=int, default=None, help="batch: at most this many URLs")
+    ap.add_argument("--csv", default=None, help="batch: also write the table to this CSV file")
     args = ap.parse_args()
 
+    if args.batch:
+        if not args.from_db and not args.urls:
+            ap.error("--batch needs --from-db or --urls")
+        args.selector_timeout = args.selector_timeout or 10000
+        batch(args)
+        return
+    if not args.store or not args.url:
+        ap.error("--store and --url are required without --batch")
+    args.selector_timeout = args.selector_timeout or 20000
+
     selector = args.selector or DEFAULT_SELECTORS[args.store]
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -38,11 +222,12 @@ def main():
         page.goto(args.url, wait_until="domcontentloaded", timeout=args.timeout)
 
         # Optional: wait a bit for JS-heavy sites
-        page.wait_for_timeout(2000)
+        if args.settle_ms:
+            page.wait_for_timeout(args.settle_ms)
 
         print(f"[+] wait_for_selector: {selector}")
         try:
-            page.wait_for_selector(selector, timeout=20000)
+            page.wait_for_selector(selector, timeout=args.selector_timeout)
         except Exception as e:
             print(f"[!] selector not found: {e}")
 
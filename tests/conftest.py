@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point the app at a throwaway database and state folders before anything imports app.db.
+_TMP = tempfile.mkdtemp(prefix="pricewatch_tests_")
+os.environ["PRICEWATCH_DB"] = os.path.join(_TMP, "test.db")
+os.environ["PRICEWATCH_STATE_DIR"] = os.path.join(_TMP, "state")
+os.environ["PRICEWATCH_DEBUG_DIR"] = os.path.join(_TMP, "debug")
+os.environ["PRICEWATCH_ARCHIVE_DIR"] = os.path.join(_TMP, "archive")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fresh_db():
+    """An empty, fully migrated database for each test."""
+    from app.db import Base, engine, init_db
+
+    init_db()
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    yield engine
@@ -0,0 +1,54 @@
+"""ArtifactWriter sampling and size-capped eviction of the oldest files."""
+import os
+
+from app.artifacts import ArtifactWriter
+
+
+def test_first_failures_are_kept_then_sampled(tmp_path):
+    writer = ArtifactWriter(tmp_path, max_bytes=10**6, sample_rate=0.0, always_first=2)
+    assert [writer.wanted("COLES", "timeout") for _ in range(4)] == [True, True, False, False]
+    # Counted per (store, reason).
+    assert writer.wanted("COLES", "no_match")
+    assert writer.wanted("ALDI", "timeout")
+    assert writer.stats["artifacts_sampled_out"] == 2
+
+
+def test_full_sample_rate_keeps_everything(tmp_path):
+    writer = ArtifactWriter(tmp_path, max_bytes=10**6, sample_rate=1.0, always_first=0)
+    assert all(writer.wanted("COLES", "timeout") for _ in range(20))
+
+
+def test_oldest_artifacts_are_evicted_over_the_size_cap(tmp_path):
+    writer = ArtifactWriter(tmp_path, max_bytes=3000, screenshots=False, queue_size=64)
+    paths = []
+    for n in range(10):
+        base = writer.path_for(7, n, "COLES", "timeout", 0)
+        # Random hex gzips to roughly 1 KiB per artifact.
+        writer.submit(base, os.urandom(1000).hex(), None)
+        paths.append(base.with_name(base.name + ".html.gz"))
+    writer.close()
+
+    kept = [p for p in paths if p.exists()]
+    assert writer.stats["artifacts_saved"] == 10
+    assert writer.stats["artifacts_evicted"] == 10 - len(kept)
+    assert kept == paths[-len(kept):]
+    assert sum(p.stat().st_size for p in kept) <= 3000
+
+
+def test_existing_files_count_towards_the_cap(tmp_path):
+    old = tmp_path / "job1" / "item1_coles_timeout_a0.html.gz"
+    old.parent.mkdir()
+    old.write_bytes(b"x" * 2500)
+    writer = ArtifactWriter(tmp_path, max_bytes=3000, screenshots=False)
+    base = writer.path_for(2, 1, "COLES", "timeout", 0)
+    writer.submit(base, os.urandom(1000).hex(), None)
+    writer.close()
+    assert not old.exists()
+    assert base.with_name(base.name + ".html.gz").exists()
+
+
+def test_artifact_names_are_filesystem_safe(tmp_path):
+    writer = ArtifactWriter(tmp_path, max_bytes=0)
+    path = writer.path_for(3, (12, (4, 5)), "COLES", "error: Timeout", 1)
+    assert path.parent.name == "job3"
+    assert "/" not in path.name and " " not in path.name and ":" not in path.name
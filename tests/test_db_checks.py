@@ -0,0 +1,27 @@
+"""
+The database checks from bench_scrape.py, at sizes that run in seconds:
+write statement counts, index use of the price_history queries, and
+dashboard reads during a bulk write.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import bench_scrape
+
+
+@pytest.mark.parametrize("storage", ["change_only", "append"])
+def test_price_writes_are_batched(fresh_db, storage):
+    bench_scrape.bench_plan(SimpleNamespace(items=5000, commit_interval=100, storage=storage))
+
+
+def test_price_history_queries_use_indexes(fresh_db):
+    bench_scrape.bench_queries(SimpleNamespace(items=100, days=30))
+
+
+def test_reads_during_bulk_write_are_not_locked(fresh_db):
+    with fresh_db.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    bench_scrape.bench_concurrency(
+        SimpleNamespace(items=100, days=10, seconds=2, readers=4, commit_interval=200, max_p95_ms=None)
+    )
@@ -0,0 +1,52 @@
+"""Structured-data price extraction from saved product pages (tests/fixtures)."""
+from pathlib import Path
+
+from app.extract import extract_json_ld, extract_next_data, extract_structured
+
+FIXTURES = Path(__file__).parent / "fixtures"
+PRODUCT_URL = "https://www.coles.com.au/product/coles-full-cream-milk-2l-8150288"
+
+
+def _html(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+def test_next_data_reads_the_page_product_not_related_ones():
+    assert extract_next_data("COLES", _html("coles_next_data.html")) == {
+        "price": 3.1,
+        "was_price": 3.6,
+        "unit_price": 1.55,
+        "promo_text": "Save 50c",
+    }
+
+
+def test_next_data_without_a_product_node_matches_the_url():
+    found = extract_next_data("COLES", _html("coles_next_data_no_product.html"), PRODUCT_URL)
+    assert (found["price"], found["was_price"]) == (3.1, 3.6)
+    found = extract_next_data("COLES", _html("coles_next_data_no_product.html"), "https://www.coles.com.au/product/coles-skim-milk-2l-123")
+    assert found["price"] == 2.9
+
+
+def test_next_data_is_none_when_the_product_is_ambiguous():
+    assert extract_next_data("COLES", _html("coles_next_data_no_product.html")) is None
+    assert extract_next_data("COLES", _html("coles_next_data_no_product.html"), "https://www.coles.com.au/product/other-999") is None
+
+
+def test_next_data_ignores_pages_without_it():
+    assert extract_next_data("COLES", _html("json_ld_product.html")) is None
+    assert extract_next_data("COLES", '<script id="__NEXT_DATA__">{not json</script>') is None
+
+
+def test_json_ld_product_offer_and_strikethrough_price():
+    assert extract_json_ld("ALDI", _html("json_ld_product.html")) == {"price": 5.49, "was_price": 6.29}
+
+
+def test_json_ld_without_a_product_is_none():
+    html = '<script type="application/ld+json">{"@type":"Organization","name":"ALDI"}</script>'
+    assert extract_json_ld("ALDI", html) is None
+
+
+def test_extract_structured_tries_next_data_first():
+    assert extract_structured("COLES", _html("coles_next_data.html"), PRODUCT_URL)["price"] == 3.1
+    assert extract_structured("ALDI", _html("json_ld_product.html"))["price"] == 5.49
+    assert extract_structured("ALDI", "<html><body>$5.49</body></html>") is None
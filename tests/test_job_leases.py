@@ -0,0 +1,126 @@
+"""Job queue leases: compare-and-set claims, and a run that loses its lease stops writing."""
+import threading
+from datetime import datetime, timedelta
+
+from app import jobs
+from app.db import ReadSessionLocal, SessionLocal
+from app.models import Item, PriceHistory, ScrapeJob, Store
+
+
+def _add(*rows):
+    db = SessionLocal()
+    try:
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+def _job(job_id):
+    db = ReadSessionLocal()
+    try:
+        return db.get(ScrapeJob, job_id)
+    finally:
+        db.close()
+
+
+def _steal(job_id, owner):
+    db = SessionLocal()
+    try:
+        db.query(ScrapeJob).filter(ScrapeJob.id == job_id).update(
+            {"lease_owner": owner, "lease_expires_at": datetime.utcnow() + timedelta(minutes=5)}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_only_one_worker_claims_a_job(fresh_db):
+    (job_id,) = _add(ScrapeJob(status="queued"))
+    assert jobs.claim_next_job("worker-a") == job_id
+    assert jobs.claim_next_job("worker-b") is None
+    job = _job(job_id)
+    assert (job.status, job.lease_owner) == ("running", "worker-a")
+
+
+def test_concurrent_claims_hand_out_each_job_once(fresh_db):
+    job_ids = _add(*[ScrapeJob(status="queued") for _ in range(4)])
+    claimed = []
+    barrier = threading.Barrier(6)
+
+    def worker(owner):
+        barrier.wait()
+        while True:
+            job_id = jobs.claim_next_job(owner)
+            if job_id is None:
+                return
+            claimed.append(job_id)
+
+    threads = [threading.Thread(target=worker, args=(f"worker-{n}",)) for n in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == job_ids
+
+
+def test_expired_lease_is_claimable_and_the_old_owner_cannot_renew(fresh_db):
+    (job_id,) = _add(
+        ScrapeJob(status="running", lease_owner="worker-a", lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+    )
+    assert jobs.claim_next_job("worker-b") == job_id
+    assert jobs.renew_lease(job_id, "worker-a") == (False, False)
+    assert jobs.renew_lease(job_id, "worker-b") == (True, False)
+
+
+def test_claim_can_be_limited_to_stores(fresh_db):
+    coles, aldi = _add(ScrapeJob(status="queued", store="COLES"), ScrapeJob(status="queued", store="ALDI"))
+    assert jobs.claim_next_job("worker-a", stores=["aldi"]) == aldi
+    assert jobs.claim_next_job("worker-a", stores=["aldi"]) is None
+    assert jobs.claim_next_job("worker-b") == coles
+
+
+def test_run_leased_job_stops_when_the_lease_is_taken_over(fresh_db, monkeypatch):
+    (job_id,) = _add(ScrapeJob(status="queued"))
+    assert jobs.claim_next_job("worker-a", lease_s=1) == job_id
+    seen = {}
+
+    def fake_run(job_id, cancel_event, owner, lost):
+        _steal(job_id, "worker-b")
+        seen["lost"] = lost.wait(10)
+        seen["cancelled"] = cancel_event.is_set()
+
+    monkeypatch.setattr(jobs, "_run_scrape_job", fake_run)
+    jobs.run_leased_job(job_id, "worker-a", lease_s=1)
+
+    assert seen == {"lost": True, "cancelled": True}
+    job = _job(job_id)
+    # The old owner's cleanup leaves the new owner's lease alone.
+    assert job.lease_owner == "worker-b" and job.lease_expires_at is not None
+
+
+def test_price_writer_drops_rows_once_the_lease_is_lost(fresh_db):
+    store_id, item_id, job_id = _add(Store(name="COLES"), Item(name="Milk"), ScrapeJob(status="queued"))
+    assert jobs.claim_next_job("worker-a") == job_id
+    db = SessionLocal()
+    try:
+        lost = threading.Event()
+        writer = jobs.PriceRowWriter(db, commit_interval=10, lease=(job_id, "worker-a"), lost=lost)
+        writer.add(item_id, "COLES", {"price": 3.1})
+        writer.flush()
+        assert writer.saved == 1
+
+        _steal(job_id, "worker-b")
+        writer.add(item_id, "COLES", {"price": 2.9})
+        writer.flush()
+        assert lost.is_set()
+        assert writer.saved == 1
+        assert not writer.add(item_id, "COLES", {"price": 2.5})
+    finally:
+        db.close()
+    check = ReadSessionLocal()
+    try:
+        assert [p for (p,) in check.query(PriceHistory.price).filter(PriceHistory.store_id == store_id)] == [3.1]
+    finally:
+        check.close()
@@ -0,0 +1,58 @@
+"""ScrapeMetrics snapshots and the /metrics Prometheus text."""
+from app.metrics import BUCKETS, ScrapeMetrics, render_prometheus, summarize
+
+
+def _job(goto_seconds, pages):
+    metrics = ScrapeMetrics()
+    for seconds in goto_seconds:
+        metrics.observe("goto", "COLES", seconds)
+    metrics.inc("pages", "COLES", pages)
+    return metrics.snapshot()
+
+
+def test_render_prometheus_sums_jobs_into_cumulative_buckets():
+    text = render_prometheus([_job([0.03, 0.2], 2), _job([7.0], 1), None], {"scrape_jobs_running": 1})
+    lines = text.splitlines()
+    labels = 'stage="goto",store="COLES"'
+    assert "# TYPE pricewatch_scrape_stage_seconds histogram" in lines
+    assert f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="0.01"}} 0' in lines
+    assert f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="0.05"}} 1' in lines
+    assert f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="0.25"}} 2' in lines
+    assert f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="10.0"}} 3' in lines
+    assert f'pricewatch_scrape_stage_seconds_bucket{{{labels},le="+Inf"}} 3' in lines
+    assert f"pricewatch_scrape_stage_seconds_sum{{{labels}}} 7.230000" in lines
+    assert f"pricewatch_scrape_stage_seconds_count{{{labels}}} 3" in lines
+    assert "# TYPE pricewatch_scrape_pages_total counter" in lines
+    assert 'pricewatch_scrape_pages_total{store="COLES"} 3' in lines
+    assert "# TYPE pricewatch_scrape_jobs_running gauge" in lines
+    assert "pricewatch_scrape_jobs_running 1" in lines
+    assert text.endswith("\n")
+
+
+def test_buckets_are_monotonic_up_to_inf():
+    text = render_prometheus([_job([0.001, 0.5, 45.0, 120.0], 0)])
+    counts = [int(line.rsplit(" ", 1)[1]) for line in text.splitlines() if "_bucket{" in line]
+    assert len(counts) == len(BUCKETS) + 1
+    assert counts == sorted(counts)
+    assert counts[-1] == 4
+
+
+def test_take_returns_deltas_that_merge_back_to_the_total():
+    child, parent = ScrapeMetrics(), ScrapeMetrics()
+    child.observe("goto", "COLES", 0.2)
+    child.inc("pages", "COLES")
+    parent.merge(child.take())
+    child.inc("pages", "COLES", 2)
+    delta = child.take()
+    assert delta["histograms"] == []
+    parent.merge(delta)
+    assert child.snapshot() == {"histograms": [], "counters": []}
+    assert summarize(parent.snapshot())["COLES"]["pages"] == 3
+
+
+def test_summarize_reports_quantiles_in_ms():
+    summary = summarize(_job([0.03, 0.04, 0.2, 2.0], 4))["COLES"]
+    assert summary["goto"]["count"] == 4
+    assert summary["goto"]["p50_ms"] == 50
+    assert summary["goto"]["p95_ms"] == 2500
+    assert summary["pages"] == 4
@@ -0,0 +1,99 @@
+"""CircuitBreaker states and AdaptivePacer / TokenBucket backoff and recovery."""
+import pytest
+
+from app.pacing import AdaptivePacer, CircuitBreaker, TokenBucket
+
+
+def test_breaker_opens_after_threshold_blocks():
+    breaker = CircuitBreaker(threshold=2, cooldown_s=600)
+    assert breaker.allow("COLES")
+    assert breaker.record("COLES", blocked=True) is False
+    assert breaker.record("COLES", blocked=True) is True
+    assert breaker.state("COLES") == CircuitBreaker.OPEN
+    assert not breaker.allow("COLES")
+    assert breaker.skipped == {"COLES": 1}
+    assert breaker.blocks == {"COLES": 2}
+    # Other stores are unaffected.
+    assert breaker.allow("ALDI")
+
+
+def test_breaker_success_resets_the_block_streak():
+    breaker = CircuitBreaker(threshold=2, cooldown_s=600)
+    breaker.record("COLES", blocked=True)
+    breaker.record("COLES", blocked=False)
+    assert breaker.record("COLES", blocked=True) is False
+    assert breaker.state("COLES") == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, cooldown_s=0)
+    breaker.record("COLES", blocked=True)
+    assert breaker.allow("COLES")
+    assert breaker.state("COLES") == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow("COLES")
+    breaker.record("COLES", blocked=False)
+    assert breaker.state("COLES") == CircuitBreaker.CLOSED
+    assert breaker.allow("COLES") and breaker.allow("COLES")
+
+
+def test_blocked_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(threshold=3, cooldown_s=0)
+    for _ in range(3):
+        breaker.record("COLES", blocked=True)
+    assert breaker.allow("COLES")
+    assert breaker.record("COLES", blocked=True) is True
+    assert breaker.state("COLES") == CircuitBreaker.OPEN
+
+
+def test_release_hands_back_a_probe_without_a_result():
+    breaker = CircuitBreaker(threshold=1, cooldown_s=0)
+    breaker.record("COLES", blocked=True)
+    assert breaker.allow("COLES")
+    assert not breaker.allow("COLES")
+    breaker.release("COLES")
+    assert breaker.state("COLES") == CircuitBreaker.HALF_OPEN
+    assert breaker.allow("COLES")
+
+
+def test_token_bucket_bursts_then_spaces_requests():
+    bucket = TokenBucket(per_minute=60, burst=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+    # A halved rate doubles the wait for the next token.
+    bucket.factor = 0.5
+    assert bucket.reserve() == pytest.approx(4.0, abs=0.1)
+
+
+def test_pacer_backs_off_on_blocks_and_recovers_on_successes():
+    pacer = AdaptivePacer({"COLES": {"per_minute": 60, "burst": 1}})
+    pacer.record("COLES", "blocked")
+    assert pacer.factor("COLES") == pytest.approx(AdaptivePacer.BLOCK_FACTOR)
+    pacer.record("COLES", "blocked")
+    assert pacer.factor("COLES") == pytest.approx(AdaptivePacer.BLOCK_FACTOR ** 2)
+    assert pacer.stats["COLES"]["backoffs"] == 2
+    for _ in range(30):
+        pacer.record("COLES", "ok")
+    assert pacer.factor("COLES") == 1.0
+
+
+def test_pacer_ignores_isolated_errors_but_not_an_error_streak():
+    pacer = AdaptivePacer({"COLES": {"per_minute": 60, "burst": 1}}, error_threshold=0.3)
+    pacer.record("COLES", "error")
+    assert pacer.factor("COLES") == 1.0
+    pacer.record("COLES", "error")
+    assert pacer.factor("COLES") == pytest.approx(AdaptivePacer.ERROR_FACTOR)
+
+
+def test_pacer_never_drops_below_the_minimum_rate():
+    pacer = AdaptivePacer({"COLES": {"per_minute": 60, "burst": 1}})
+    for _ in range(20):
+        pacer.record("COLES", "blocked")
+    assert pacer.factor("COLES") == AdaptivePacer.MIN_FACTOR
+
+
+def test_unlimited_store_never_waits():
+    pacer = AdaptivePacer({})
+    pacer.record("ALDI", "blocked")
+    assert pacer.factor("ALDI") == 1.0
+    assert pacer._reserve("ALDI") == 0.0
@@ -0,0 +1,121 @@
+"""
+Change-only and append price storage must answer the dashboard queries the
+same way, and so must append history after compact_price_history.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db import Base, SessionLocal, init_db
+from app.models import Item, Store
+from app.services import (
+    compact_price_history,
+    compute_cycle_insights,
+    count_blocked,
+    get_latest_prices_for_items,
+    record_prices,
+)
+
+START = datetime(2026, 1, 5, 9, 30)
+BLOCKED = "[blocked: imperva_security_check]"
+
+
+def _observations(item_ids, store_ids):
+    """90 days of scrapes with missed days, weekly specials and a run of blocked COLES pages."""
+    coles, aldi = store_ids
+    days = []
+    for day in range(90):
+        if day % 11 == 3:
+            continue  # no scrape that day: a whole-day gap inside an unchanged run
+        when = START + timedelta(days=day, minutes=day % 5)
+        batch = []
+        for n, item_id in enumerate(item_ids):
+            on_special = (day + n) % 7 == 0
+            for store_id in (coles, aldi):
+                obs = {
+                    "item_id": item_id,
+                    "store_id": store_id,
+                    "captured_at": when,
+                    "price": 3.0 if on_special else 4.0 + n,
+                    "was_price": 4.0 + n if on_special else None,
+                    "unit_price": None,
+                    "promo_text": "Special" if on_special else None,
+                    "discount_percent": round((1 + n) / (4.0 + n) * 100, 1) if on_special else None,
+                    "source": "browser",
+                }
+                if store_id == coles and 40 <= day < 44:
+                    obs.update(price=None, was_price=None, discount_percent=None, promo_text=BLOCKED)
+                batch.append(obs)
+            # A second scrape the same day with the same price.
+            if day % 13 == 0:
+                batch.append(dict(batch[-1], captured_at=when + timedelta(hours=6)))
+        days.append(batch)
+    return days
+
+
+def _scrape(db, storage):
+    stores = [Store(name="COLES"), Store(name="ALDI")]
+    items = [Item(name=f"Item {n}") for n in range(3)]
+    db.add_all(stores + items)
+    db.commit()
+    item_ids = [item.id for item in items]
+    for batch in _observations(item_ids, [s.id for s in stores]):
+        record_prices(db, batch, storage)
+        db.commit()
+    return item_ids
+
+
+def _answers(db, item_ids):
+    latest = {
+        (item_id, store): tuple(getattr(row, f) for f in ("captured_at", "price", "was_price", "promo_text", "discount_percent"))
+        for item_id, by_store in get_latest_prices_for_items(db, item_ids).items()
+        for store, row in by_store.items()
+    }
+    return {
+        "insights": compute_cycle_insights(db, item_ids),
+        "latest": latest,
+        "blocked": count_blocked(db, "COLES"),
+    }
+
+
+def _reset():
+    from app.db import engine
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+
+
+@pytest.fixture
+def db(fresh_db):
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_change_only_and_append_give_the_same_answers(db):
+    item_ids = _scrape(db, "append")
+    append = _answers(db, item_ids)
+    compact_price_history(db)
+    compacted = _answers(db, item_ids)
+
+    db.close()
+    _reset()
+    assert _scrape(db, "change_only") == item_ids
+    change_only = _answers(db, item_ids)
+
+    # Four blocked days for each of the three items.
+    assert append["blocked"] == 12
+    assert any(store["avg_discount_interval_days"] for store in append["insights"][item_ids[0]].values())
+    assert change_only == append
+    assert compacted == append
+
+
+def test_change_only_stores_fewer_rows(db):
+    from app.models import PriceHistory
+
+    _scrape(db, "append")
+    appended = db.query(PriceHistory).count()
+    db.close()
+    _reset()
+    _scrape(db, "change_only")
+    assert db.query(PriceHistory).count() < appended / 3
@@ -0,0 +1,113 @@
+"""Retention moves old price_history rows to Parquet and price_daily; read_archive brings them back."""
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import retention
+from app.db import SessionLocal
+from app.models import Item, LatestPrice, PriceDaily, PriceHistory, Store
+from app.services import compute_cycle_insights, record_prices
+
+NOW = datetime(2026, 6, 30, 12, 0)
+COLUMNS = [c.name for c in PriceHistory.__table__.columns]
+
+
+@pytest.fixture
+def db(fresh_db):
+    shutil.rmtree(retention.ARCHIVE_DIR, ignore_errors=True)
+    session = SessionLocal()
+    yield session
+    session.close()
+    shutil.rmtree(retention.ARCHIVE_DIR, ignore_errors=True)
+
+
+def _seed(db):
+    """120 days of two items at one store; a special every 10th day, and a second price on day 50."""
+    store = Store(name="COLES")
+    items = [Item(name="Milk"), Item(name="Bread")]
+    db.add_all([store] + items)
+    db.commit()
+    for day in range(120):
+        when = NOW - timedelta(days=120 - day)
+        batch = []
+        for n, item in enumerate(items):
+            special = day % 10 == n
+            batch.append({
+                "item_id": item.id,
+                "store_id": store.id,
+                "captured_at": when,
+                "price": 2.0 + n if special else 3.0 + n + (day // 30) * 0.1,
+                "was_price": 3.0 + n if special else None,
+                "unit_price": None,
+                "promo_text": None,
+                "discount_percent": round(100 / (3.0 + n), 1) if special else None,
+                "source": "browser",
+            })
+        if day == 50:
+            batch.append(dict(batch[0], captured_at=when + timedelta(hours=3), price=1.5))
+        record_prices(db, batch, "change_only")
+        db.commit()
+    return [item.id for item in items]
+
+
+def _rows(rows):
+    return sorted(tuple(getattr(row, c) for c in COLUMNS) for row in rows)
+
+
+def test_dry_run_only_counts(db):
+    _seed(db)
+    before = db.query(PriceHistory).count()
+    stats = retention.run_retention(db, keep_days=30, now=NOW, dry_run=True)
+    assert stats["rows"] > 0 and stats["files"] == []
+    assert db.query(PriceHistory).count() == before
+    assert not retention.ARCHIVE_DIR.exists()
+
+
+def test_archived_rows_read_back_unchanged(db):
+    item_ids = _seed(db)
+    cutoff = datetime.combine((NOW - timedelta(days=30)).date(), datetime.min.time())
+    old = _rows(
+        row for row in db.query(PriceHistory).all() if (row.last_seen_at or row.captured_at) < cutoff
+    )
+    latest_ids = {lp.price_history_id for lp in db.query(LatestPrice)}
+    insights_before = compute_cycle_insights(db, item_ids)
+
+    stats = retention.run_retention(db, keep_days=30, now=NOW)
+
+    assert stats["rows"] == len(old) > 0
+    assert set(stats["months"]) == {"2026-03", "2026-04", "2026-05"}
+    assert all(path.endswith(".parquet") for path in stats["files"])
+    # Everything older than the cut-off is gone from the hot table except the rows latest_price points at.
+    remaining = db.query(PriceHistory).all()
+    assert all((r.last_seen_at or r.captured_at) >= cutoff or r.id in latest_ids for r in remaining)
+    assert {lp.price_history_id for lp in db.query(LatestPrice)} <= {r.id for r in remaining}
+
+    archived = retention.read_archive(item_ids)
+    assert _rows(archived) == old
+    assert [r.captured_at for r in archived] == sorted(r.captured_at for r in archived)
+    since = NOW - timedelta(days=100)
+    assert _rows(retention.read_archive(item_ids, since)) == [r for r in old if r[COLUMNS.index("captured_at")] >= since]
+    assert retention.read_archive(item_ids[:1]) and all(r.item_id == item_ids[0] for r in retention.read_archive(item_ids[:1]))
+
+    # The hot table alone no longer sees the archived specials; with the archive the answers are unchanged.
+    assert compute_cycle_insights(db, item_ids, archive=True) == insights_before
+    assert compute_cycle_insights(db, item_ids) != insights_before
+
+
+def test_daily_rollup_keeps_min_max_last_and_counts(db):
+    item_ids = _seed(db)
+    retention.run_retention(db, keep_days=30, now=NOW)
+    day50 = (NOW - timedelta(days=70)).date()
+    daily = db.query(PriceDaily).filter(PriceDaily.item_id == item_ids[0], PriceDaily.day == day50).one()
+    # Day 50 is a special (2.0) and a later scrape the same day saw 1.5.
+    assert (daily.min_price, daily.max_price, daily.last_price) == (1.5, 2.0, 1.5)
+    assert daily.observations == 2
+    assert db.query(PriceDaily).count() > 0
+
+
+def test_second_run_moves_nothing(db):
+    _seed(db)
+    retention.run_retention(db, keep_days=30, now=NOW)
+    again = retention.run_retention(db, keep_days=30, now=NOW)
+    assert again["rows"] == 0 and again["files"] == []
@@ -0,0 +1,80 @@
+"""Browser-free scrape decisions: selector order and Imperva challenge classification."""
+from app.scrape import SelectorStats, _classify_challenge
+
+SELECTORS = ["span.price", "div.price", "[data-testid=pricing]"]
+
+
+def test_unknown_selectors_keep_configured_order():
+    assert SelectorStats().ordered("COLES", SELECTORS) == SELECTORS
+
+
+def test_selectors_that_match_move_to_the_front():
+    stats = SelectorStats()
+    stats.record("COLES", SELECTORS, ["[data-testid=pricing]"], 120)
+    assert stats.ordered("COLES", SELECTORS)[0] == "[data-testid=pricing]"
+    # Scores are per store.
+    assert stats.ordered("ALDI", SELECTORS) == SELECTORS
+
+
+def test_recent_hits_outrank_old_ones():
+    stats = SelectorStats()
+    for _ in range(3):
+        stats.record("COLES", SELECTORS, ["span.price"], 100)
+    for _ in range(12):
+        stats.record("COLES", SELECTORS, ["div.price"], 100)
+    assert stats.ordered("COLES", SELECTORS)[:2] == ["div.price", "span.price"]
+
+
+def test_record_counts_hits_misses_and_average_latency():
+    stats = SelectorStats()
+    stats.record("COLES", SELECTORS, ["span.price"], 100)
+    stats.record("COLES", SELECTORS, ["span.price"], 300)
+    stats.record("COLES", SELECTORS, [], None)
+    row = {r["selector"]: r for r in stats.rows()}["span.price"]
+    assert (row["hits"], row["misses"], row["avg_match_ms"]) == (2, 1, 200.0)
+    assert stats.rows(dirty_only=True)
+
+
+def test_merge_adds_a_copys_new_counts():
+    loaded = [
+        {"store": "COLES", "selector": "span.price", "hits": 10, "misses": 2, "score": 1.0, "avg_match_ms": 100.0, "last_hit_at": None}
+    ]
+    parent, child = SelectorStats(loaded), SelectorStats(loaded)
+    parent.record("COLES", ["span.price"], ["span.price"], 100)
+    parent_score = parent.rows()[0]["score"]
+    child.record("COLES", ["span.price", "div.price"], ["span.price"], 400)
+    child.record("COLES", ["span.price", "div.price"], ["div.price"], 50)
+    parent.merge(child.rows(dirty_only=True))
+
+    rows = {r["selector"]: r for r in parent.rows()}
+    span = rows["span.price"]
+    # 10 loaded + 1 parent hit + 1 child hit; the child's loaded 10 are not counted twice.
+    assert (span["hits"], span["misses"]) == (12, 3)
+    assert span["avg_match_ms"] == (100.0 * 11 + child.rows()[0]["avg_match_ms"]) / 12
+    assert rows["div.price"]["hits"] == 1
+    child_score = {r["selector"]: r for r in child.rows()}["span.price"]["score"]
+    assert span["score"] == max(parent_score, child_score)
+
+
+def test_challenge_from_incapsula_url_or_title():
+    assert _classify_challenge(200, {}, "https://x/_Incapsula_Resource?x=1", "", None) is True
+    assert _classify_challenge(200, {}, "https://x/p", "Pardon Our Interruption", None) is True
+
+
+def test_challenge_from_probe_frame():
+    assert _classify_challenge(200, {}, "https://x/p", "Milk", {"challengeFrame": True, "productData": True}) is True
+
+
+def test_challenge_needs_imperva_headers_on_403():
+    assert _classify_challenge(403, {"X-Iinfo": "1-2-3"}, "https://x/p", "", {}) is True
+    assert _classify_challenge(403, {"x-cdn": "Imperva"}, "https://x/p", "", {}) is True
+    assert _classify_challenge(403, {"server": "nginx"}, "https://x/p", "", {}) is None
+
+
+def test_product_page_is_not_a_challenge():
+    assert _classify_challenge(200, {}, "https://x/p", "Milk 2L | Coles", {"productData": True}) is False
+
+
+def test_ambiguous_signals_defer_to_the_html_scan():
+    assert _classify_challenge(200, {}, "https://x/p", "Milk", {"productData": False}) is None
+    assert _classify_challenge(None, None, "", "", None) is None
@@ -0,0 +1,84 @@
+"""SessionStateManager: writes only on change, re-reads a replaced file, drops outdated state."""
+import json
+import os
+
+from app.session_state import SessionStateManager
+
+
+def _state(value, expires=1):
+    return {"cookies": [{"name": "sid", "value": value, "domain": ".coles.com.au", "path": "/", "expires": expires}], "origins": []}
+
+
+def _touch_later(path):
+    # Another process's write; make sure the mtime moves even on a coarse clock.
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_unchanged_state_is_not_rewritten(tmp_path):
+    sessions = SessionStateManager(tmp_path)
+    assert sessions.update("COLES", _state("a")) is True
+    assert sessions.stats["flushes"] == 1
+    # A new expiry alone is the same session.
+    assert sessions.update("COLES", _state("a", expires=2)) is False
+    assert sessions.stats == {"loads": 0, "flushes": 1, "unchanged": 1, "outdated": 0}
+    assert sessions.get("COLES")["cookies"][0]["expires"] == 2
+
+    assert sessions.update("COLES", _state("b")) is True
+    assert sessions.stats["flushes"] == 2
+    assert json.loads(sessions.path("COLES").read_text())["cookies"][0]["value"] == "b"
+
+
+def test_persist_false_keeps_the_session_in_memory_only(tmp_path):
+    sessions = SessionStateManager(tmp_path)
+    sessions.update("COLES", _state("a"), persist=False)
+    assert sessions.get("COLES")["cookies"][0]["value"] == "a"
+    assert not sessions.path("COLES").exists()
+
+
+def test_file_replaced_by_another_process_is_read_again(tmp_path):
+    ours, theirs = SessionStateManager(tmp_path), SessionStateManager(tmp_path)
+    ours.update("COLES", _state("a"))
+    assert ours.get("COLES")["cookies"][0]["value"] == "a"
+
+    theirs.update("COLES", _state("b"), force=True)
+    _touch_later(theirs.path("COLES"))
+    assert ours.get("COLES")["cookies"][0]["value"] == "b"
+    assert ours.stats["loads"] == 1
+
+
+def test_state_from_an_outdated_context_is_dropped(tmp_path):
+    ours, theirs = SessionStateManager(tmp_path), SessionStateManager(tmp_path)
+    ours.update("COLES", _state("a"))
+    _, opened_from = ours.checkout("COLES")
+
+    theirs.update("COLES", _state("fresh"), force=True)
+    _touch_later(theirs.path("COLES"))
+
+    # The context opened on "a" hands back its cookies after the file was replaced.
+    assert ours.update("COLES", _state("a2"), opened_from=opened_from) is False
+    assert ours.stats["outdated"] == 1
+    assert json.loads(ours.path("COLES").read_text())["cookies"][0]["value"] == "fresh"
+
+    _, current = ours.checkout("COLES")
+    assert ours.update("COLES", _state("a3"), opened_from=current) is True
+
+
+def test_context_opened_without_a_session_is_outdated_once_one_exists(tmp_path):
+    sessions = SessionStateManager(tmp_path)
+    state, opened_from = sessions.checkout("COLES")
+    assert (state, opened_from) == (None, 0)
+    sessions.update("COLES", _state("init"), force=True)
+    assert sessions.update("COLES", _state("other"), opened_from=opened_from) is False
+    assert sessions.get("COLES")["cookies"][0]["value"] == "init"
+
+
+def test_is_stale_follows_max_age(tmp_path):
+    sessions = SessionStateManager(tmp_path, {"COLES": 3600})
+    assert not sessions.is_stale("COLES")
+    sessions.update("COLES", _state("a"))
+    assert not sessions.is_stale("COLES")
+    path = sessions.path("COLES")
+    os.utime(path, (1, 1))
+    sessions.forget("COLES")
+    assert sessions.is_stale("COLES")